@@ -1,15 +1,20 @@
-import contextlib
+import logging
+import os
 import re
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import requests
 import urllib3.util
 from bs4 import BeautifulSoup, Tag
-from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo, Document
-from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from llama_index.core.schema import BaseNode, TextNode, NodeRelationship, RelatedNodeInfo, Document
 
-from instagram_util import filter_instagram_by_url
-from search import index
-from settings import chroma_collection, Settings, hex_id
+from fetcher import fetcher
+from instagram_util import child_infos, filter_instagram_by_url, instagram_kind
+from llm_clients import llm_clients
+from search import insert_nodes
+from settings import Settings, hex_id
+from text_index import text_hash_index
 
 Settings
 
@@ -28,6 +33,12 @@ Determine whether these summaries share the same general context or topics and p
 
 prompt_tmpl = PromptTemplate(qa_prompt_tmpl_str)
 
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "8"))
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "256"))
+INGEST_MODEL = os.getenv("INGEST_MODEL", "llama3-8b-8192")  # summaries and same-context checks, over Groq
+
+logger = logging.getLogger(__name__)
+
 
 def _fmt_promt(*, previous_chunk_summary, middle_chunk_summary):
     return prompt_tmpl.format(
@@ -83,12 +94,7 @@ def passes_filter(text):
 
 
 def check_node_exists(text_hash):
-    existing_documents = chroma_collection.get(where={"text_hash": text_hash})
-    if len(existing_documents["documents"]) > 0:
-        node = metadata_dict_to_node(existing_documents["metadatas"][0])
-        node.set_content(existing_documents["documents"][0])
-        node.get_content()
-        return node
+    return text_hash_index.get_nodes([text_hash]).get(text_hash)
 
 
 def white_space_cleaner(text):
@@ -97,107 +103,212 @@ def white_space_cleaner(text):
 
 
 def get_nodes(url):
+    """Scrape one url into chroma; raises when it wasn't, so the scrape queue records the error and retries."""
     # if len(chroma_collection.get(where={"url": url})["documents"]) > 0:
     #     return
     if urllib3.util.parse_url(url).hostname == "www.instagram.com":
+        if instagram_kind(url) is None:
+            raise ValueError(f"not an Instagram profile or post URL: {url}")
         return filter_instagram_by_url(url)
     return nodes_from_html(url)
 
 
-def nodes_from_html(url, chunking_agent_llm=None):
-    request = requests.get(url)
-    text = request.text  # simple_json_from_html_string(request.text, use_readability=True)["content"]
-    doc = BeautifulSoup(text, 'html.parser')
+class Block:
+    """One parent element of a page: its cleaned text, headings and the paragraphs that become child nodes."""
+
+    def __init__(self, parent: Tag, url: str):
+        self.text = white_space_cleaner(parent.text)
+        self.text_hash = hex_id(self.text)
+        self.url = url
+        self.headings = {
+            "h1": strip_text(parent.h1.text) if parent.h1 else None,
+            "h2": strip_text(parent.h2.text) if parent.h2 else None,
+            "h3": strip_text(parent.h3.text) if parent.h3 else None,
+        }
+        sub_texts = parent.find_all("p")
+        self.paragraphs = [white_space_cleaner(p.text) for p in sub_texts] if len(sub_texts) > 1 else []
+        self.paragraphs = [text for text in self.paragraphs if " " in text]
+
+
+class Page:
+    def __init__(self, url: str, blocks: list[Block], existing: dict[str, BaseNode]):
+        self.url = url
+        self.blocks = blocks
+        self.existing = existing
+
+
+def fetch_page(url: str) -> Page:
+    response = fetcher.fetch(url)
+    doc = BeautifulSoup(response.text, 'html.parser')
     parents: list[Tag | None] = []
     for p in doc.find_all('p'):
         if p.parent not in parents:
             parents.append(p.parent)
+    blocks = [block for block in (Block(parent, response.url) for parent in parents) if " " in block.text]
+    hashes = [block.text_hash for block in blocks] + [hex_id(text) for block in blocks for text in block.paragraphs]
+    return Page(response.url, blocks, text_hash_index.get_nodes(hashes))
+
+
+def summarise(llm, text: str) -> str:
+    return llm_clients.complete(llm, f"Provide a one sentence summary of the text below:\n{text}").text
+
+
+def same_context(llm, previous_chunk_summary: str, summary: str) -> bool:
+    result = llm_clients.complete(
+        llm, _fmt_promt(previous_chunk_summary=previous_chunk_summary, middle_chunk_summary=summary)
+    ).text.strip()
+    return result.startswith("Yes")
+
+
+def page_nodes(page: Page, llm, pool: ThreadPoolExecutor, summary_futures: dict[str, Future],
+               seen: dict[str, BaseNode]) -> list[BaseNode]:
+    """Build the parent documents and paragraph nodes of `page` that aren't in chroma (or this run) yet.
 
-    parent_documents: list[Document] = []
-    previous_chunk_summary = "N/A"
-    for parent in parents:
-        primary_text = parent.text
-        primary_text = white_space_cleaner(primary_text)
-        if " " not in primary_text:
-            continue
-        summary = Settings.llm.complete(f"Provide a one sentence summary of the text below:\n{primary_text}").text
-        text_hash = hex_id(primary_text)
-        parent_document = check_node_exists(text_hash)
+    Parents that are already stored (or were built for an earlier page) and gain a NEXT or CHILD link here are
+    returned too, so the link is written back with them.
+    """
+    new_hashes = {block.text_hash for block in page.blocks
+                  if block.text_hash not in page.existing and block.text_hash not in seen}
+    summaries = {text_hash: summary_futures[text_hash].result() for text_hash in new_hashes}
+
+    def summary_of(block: Block) -> str:
+        if block.text_hash in summaries:
+            return summaries[block.text_hash]
+        known = page.existing.get(block.text_hash) or seen.get(block.text_hash)
+        return known.metadata.get("Summary") or "N/A"
+
+    # a new block is linked to the block just before it, new or not, so that is the one it's compared with;
+    # every prompt only needs two summaries that are already known, so they all go out together
+    related: dict[str, Future] = {}
+    unlinked = set(new_hashes)
+    for i, block in enumerate(page.blocks):
+        if block.text_hash in unlinked:
+            unlinked.discard(block.text_hash)
+            if i:
+                related[block.text_hash] = pool.submit(same_context, llm, summary_of(page.blocks[i - 1]),
+                                                       summaries[block.text_hash])
+
+    nodes: list[BaseNode] = []
+    touched: dict[str, BaseNode] = {}
+    parent_documents: list[BaseNode] = []
+    for block in page.blocks:
+        parent_document = page.existing.get(block.text_hash) or seen.get(block.text_hash)
         if parent_document is None:
+            summary = summaries[block.text_hash]
             parent_document = Document(
-                metadata={
-                    "text_hash": text_hash,
-                    "h1": strip_text(parent.h1.text)
-                    if parent.h1
-                    else None,
-                    "h2": strip_text(parent.h2.text)
-                    if parent.h2
-                    else None,
-                    "h3": strip_text(parent.h3.text)
-                    if parent.h3
-                    else None,
-                    "url": request.url,
-                    "Summary": summary,
-                },
-                text=primary_text,
+                metadata={**block.headings, "text_hash": block.text_hash, "url": block.url, "Summary": summary},
+                text=block.text,
             )
             parent_document.excluded_llm_metadata_keys = ["Summary", "url", "text_hash"]
-            _result = Settings.llm.complete(
-                _fmt_promt(previous_chunk_summary=previous_chunk_summary, middle_chunk_summary=summary)
-            ).text.strip()
-            related = _result.startswith("Yes")
-            if related and parent_documents:
+            if block.text_hash in related and related[block.text_hash].result():
+                previous_document = parent_documents[-1]
                 parent_document.relationships[NodeRelationship.PREVIOUS] = RelatedNodeInfo(
-                    node_id=parent_documents[-1].node_id
+                    node_id=previous_document.node_id
                 )
-                parent_documents[-1].relationships[NodeRelationship.NEXT] = RelatedNodeInfo(
+                previous_document.relationships[NodeRelationship.NEXT] = RelatedNodeInfo(
                     node_id=parent_document.node_id)
-            previous_chunk_summary = summary
+                touched[previous_document.node_id] = previous_document
+            seen[block.text_hash] = parent_document
+            nodes.append(parent_document)
+        else:
+            summary = parent_document.metadata.get("Summary")
 
         # Sub texts
-        sub_texts = parent.find_all("p")
-        if len(sub_texts) > 1:
-            sub_nodes: list[TextNode] = []
-            for i, sub_text in enumerate(sub_texts):
-                sub_text_text = sub_text.text
-                sub_text_text = white_space_cleaner(sub_text_text)
-                if " " not in sub_text_text:
-                    continue
-                text_hash = hex_id(sub_text_text)
-                new_node = check_node_exists(text_hash)
-                if new_node is None:
-                    new_node = TextNode(
-                        text=sub_text_text,
-                        metadata={
-                            "text_hash": text_hash,
-                            "h1": strip_text(parent.h1.text)
-                            if parent.h1
-                            else None,
-                            "h2": strip_text(parent.h2.text)
-                            if parent.h2
-                            else None,
-                            "h3": strip_text(parent.h3.text)
-                            if parent.h3
-                            else None,
-                            "url": request.url,
-                            "Parent Document Summary": summary,
-                        },
-                    )
-                    new_node.excluded_llm_metadata_keys = ["Parent Document Summary", "url", "text_hash"]
-                    new_node.relationships[NodeRelationship.PARENT] = RelatedNodeInfo(node_id=parent_document.node_id)
-                    parent_document.relationships[NodeRelationship.CHILD] = RelatedNodeInfo(node_id=new_node.node_id)
-                    if i > 0:
-                        with contextlib.suppress(IndexError):
-                            previous_node = sub_nodes[-1]
-                            previous_node.relationships[NodeRelationship.NEXT] = RelatedNodeInfo(
-                                node_id=new_node.node_id)
-                            new_node.relationships[NodeRelationship.PREVIOUS] = RelatedNodeInfo(
-                                node_id=previous_node.node_id)
-                    sub_nodes.append(new_node)
-            index.insert_nodes(sub_nodes)
+        sub_nodes: list[TextNode] = []
+        for sub_text_text in block.paragraphs:
+            text_hash = hex_id(sub_text_text)
+            if text_hash in page.existing or text_hash in seen:
+                continue
+            new_node = TextNode(
+                text=sub_text_text,
+                metadata={**block.headings, "text_hash": text_hash, "url": block.url,
+                          "Parent Document Summary": summary},
+            )
+            new_node.excluded_llm_metadata_keys = ["Parent Document Summary", "url", "text_hash"]
+            new_node.relationships[NodeRelationship.PARENT] = RelatedNodeInfo(node_id=parent_document.node_id)
+            if sub_nodes:
+                previous_node = sub_nodes[-1]
+                previous_node.relationships[NodeRelationship.NEXT] = RelatedNodeInfo(node_id=new_node.node_id)
+                new_node.relationships[NodeRelationship.PREVIOUS] = RelatedNodeInfo(node_id=previous_node.node_id)
+            seen[text_hash] = new_node
+            sub_nodes.append(new_node)
+        if sub_nodes:
+            parent_document.relationships[NodeRelationship.CHILD] = (
+                child_infos(parent_document) + [RelatedNodeInfo(node_id=sub_node.node_id) for sub_node in sub_nodes]
+            )
+            touched[parent_document.node_id] = parent_document
+        nodes.extend(sub_nodes)
         parent_documents.append(parent_document)
-    index.insert_nodes(parent_documents)
-    return
+    new_ids = {node.node_id for node in nodes}
+    return nodes + [node for node_id, node in touched.items() if node_id not in new_ids]
+
+
+def ingest_urls(urls: list[str], llm=None, concurrency: int = INGEST_CONCURRENCY,
+                insert_batch_size: int = INSERT_BATCH_SIZE, insert: bool = True) -> dict:
+    """Scrape `urls` into chroma as a pipeline: fetch/parse -> summarise -> link -> batched embed and insert.
+
+    Pages are fetched concurrently and each page's summaries are requested as soon as it is parsed, all on
+    one pool of `concurrency` threads, so the LLM is never waiting on the network or the other way round.
+    Paragraphs and blocks already in chroma, or already seen earlier in this run, are skipped. A page that
+    fails is logged and counted, and its exception kept in the report's `errors` by url.
+    """
+    llm = llm or llm_clients.groq(INGEST_MODEL)
+    started = time.perf_counter()
+    report = {"pages": 0, "failed": 0, "nodes": 0, "errors": {}}
+    pending: list[BaseNode] = []
+    seen: dict[str, BaseNode] = {}
+
+    def flush(force=False):
+        while pending and (force or len(pending) >= insert_batch_size):
+            # a parent relinked by a later page can be pending twice
+            batch = list({node.node_id: node for node in pending[:insert_batch_size]}.values())
+            del pending[:insert_batch_size]
+            if insert:
+                insert_nodes(batch)
+            report["nodes"] += len(batch)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        fetches = [(url, pool.submit(fetch_page, url)) for url in urls]
+        pages: list[tuple[str, Page]] = []
+        summary_futures: dict[str, Future] = {}
+        for url, fetch in fetches:
+            try:
+                page = fetch.result()
+            except requests.RequestException as e:
+                logger.exception(f"failed to fetch {url}")
+                report["failed"] += 1
+                report["errors"][url] = e
+                continue
+            for block in page.blocks:
+                if block.text_hash not in page.existing and block.text_hash not in summary_futures:
+                    summary_futures[block.text_hash] = pool.submit(summarise, llm, block.text)
+            pages.append((url, page))
+        for url, page in pages:
+            try:
+                nodes = page_nodes(page, llm, pool, summary_futures, seen)
+            except Exception as e:
+                logger.exception(f"failed to build nodes for {page.url}")
+                report["failed"] += 1
+                report["errors"][url] = e
+                continue
+            report["pages"] += 1
+            pending.extend(nodes)
+            flush()
+        flush(force=True)
+
+    report["summaries"] = len(summary_futures)
+    report["seconds"] = time.perf_counter() - started
+    report["pages_per_minute"] = report["pages"] / report["seconds"] * 60 if report["seconds"] else 0
+    logger.info(f"ingested {report['pages']} pages ({report['failed']} failed), {report['nodes']} nodes, "
+                f"{report['pages_per_minute']:.1f} pages/minute")
+    return report
+
+
+def nodes_from_html(url, chunking_agent_llm=None):
+    report = ingest_urls([url], llm=chunking_agent_llm)
+    if url in report["errors"]:
+        raise report["errors"][url]
+    return report
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+from settings import DB_NAME, Settings
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 60 * 60 * 24))  # seconds
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+
+
+class CacheHit(NamedTuple):
+    cache_id: str
+    query: str
+    answer: str
+    similarity: float
+
+
+class _Entry(NamedTuple):
+    query: str
+    answer: str
+    embedding: np.ndarray
+    created_at: float
+
+
+def _normalize(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AnswerCache:
+    """Semantic cache of final answers, keyed on the query embedding.
+
+    A lookup hits when the cosine similarity to a cached query is at least `threshold`.
+    Entries expire after `ttl` seconds and the least recently used ones are evicted past `max_size`.
+    Everything is mirrored to the `answer_cache` table so the cache survives restarts. Rows are tagged with the
+    embedding model and dimension, and only the ones written by `model_name` are loaded, so switching
+    EMBED_BACKEND starts an empty cache instead of comparing vectors from two different models.
+    """
+
+    def __init__(self, db_name=DB_NAME, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL,
+                 max_size=ANSWER_CACHE_SIZE, model_name=None):
+        self.db_name = db_name
+        self.model_name = model_name or Settings.embed_model.model_name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._ids: list[str] = []
+        self._matrix: np.ndarray | None = None
+        self._load()
+
+    def _load(self):
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("DELETE FROM answer_cache WHERE created_at <= ?", (time.time() - self.ttl,))
+            rows = conn.execute(
+                "SELECT cache_id, query, answer, embedding, created_at FROM answer_cache WHERE embed_model = ? "
+                "ORDER BY last_used", (self.model_name,)
+            ).fetchall()
+            for cache_id, query, answer, embedding, created_at in rows:
+                self._entries[cache_id] = _Entry(query, answer, np.frombuffer(embedding, dtype=np.float32), created_at)
+            if len(self._entries) > self.max_size:
+                self._drop(conn, list(self._entries)[:len(self._entries) - self.max_size])
+
+    def _search_matrix(self):
+        if self._matrix is None:
+            self._ids = list(self._entries)
+            self._matrix = np.stack([self._entries[i].embedding for i in self._ids]) if self._ids else None
+        return self._ids, self._matrix
+
+    def _drop(self, conn, cache_ids):
+        for cache_id in cache_ids:
+            self._entries.pop(cache_id, None)
+        conn.executemany("DELETE FROM answer_cache WHERE cache_id = ?", [(i,) for i in cache_ids])
+        self._matrix = None
+
+    def lookup(self, embedding) -> CacheHit | None:
+        vector = _normalize(embedding)
+        with self._lock, sqlite3.connect(self.db_name) as conn:
+            expired = [i for i, entry in self._entries.items() if entry.created_at <= time.time() - self.ttl]
+            if expired:
+                self._drop(conn, expired)
+            ids, matrix = self._search_matrix()
+            if matrix is None or matrix.shape[1] != vector.shape[0]:
+                return None
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            cache_id = ids[best]
+            self._entries.move_to_end(cache_id)
+            conn.execute("UPDATE answer_cache SET last_used = ?, hits = hits + 1 WHERE cache_id = ?",
+                         (time.time(), cache_id))
+            entry = self._entries[cache_id]
+            return CacheHit(cache_id, entry.query, entry.answer, float(similarities[best]))
+
+    def store(self, query: str, embedding, answer: str) -> str:
+        cache_id = uuid.uuid4().hex
+        vector = _normalize(embedding)
+        now = time.time()
+        with self._lock, sqlite3.connect(self.db_name) as conn:
+            conn.execute(
+                "INSERT INTO answer_cache (cache_id, query, answer, embedding, created_at, last_used, hits, embed_model, "
+                "dimension) VALUES (?,?,?,?,?,?,0,?,?)",
+                (cache_id, query, answer, vector.tobytes(), now, now, self.model_name, len(vector))
+            )
+            self._entries[cache_id] = _Entry(query, answer, vector, now)
+            self._matrix = None
+            if len(self._entries) > self.max_size:
+                self._drop(conn, list(self._entries)[:len(self._entries) - self.max_size])
+        return cache_id
@@ -1,36 +1,57 @@
+import asyncio
 import logging
 import os
-import sqlite3
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
 
-from anthropic import Anthropic
 from bs4 import BeautifulSoup
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from llama_index.core import VectorStoreIndex
-from llama_index.core.schema import MetadataMode
-from llama_index.llms.groq import Groq
+from llama_index.core.schema import MetadataMode, BaseNode
 from pydantic import BaseModel
 from slowapi import _rate_limit_exceeded_handler, Limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 from starlette import status
 from starlette.requests import Request
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, StreamingResponse
 from starlette.staticfiles import StaticFiles
 
+from answer_cache import AnswerCache, CacheHit
+from llm_clients import llm_clients
+from log_sink import log_sink
 from prompts import claude_prompt, accumulated_prompt
-from search import log_retrieval, retrieve_documents, gather_nodes_recursively, hyde_vector_retriever
-from settings import logging_startup, vector_store, storage_context
+from scrape_queue import scrape_queue
+from search import log_retrieval, aretrieve_documents, gather_nodes_recursively, NodeFetcher, node_cache, reranker, \
+    retrieve_nodes
+from settings import logging_startup, vector_store, storage_context, Settings
+from streaming import AnswerStreamParser, sse_event
 
 logging_startup()
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
-app = FastAPI()
+logger = logging.getLogger("uvicorn.out")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    llm_clients.start()
+    await asyncio.to_thread(Settings.embed_model.warm)
+    logger.info(f"{Settings.embed_model.model_name} loaded in {Settings.embed_model.stats()['load_seconds']:.1f}s")
+    warmed = await asyncio.to_thread(node_cache.warm, retrieve_nodes)
+    logger.info(f"node cache warmed with {warmed} ids")
+    await asyncio.to_thread(reranker.warm)
+    yield
+    await llm_clients.aclose()
+    log_sink.close()
+
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/src", StaticFiles(directory="src"), name="src")
 simple_index = VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
-logger = logging.getLogger("uvicorn.out")
+answer_cache = AnswerCache()
 
 origins = [
     "http://localhost:8002",
@@ -47,6 +68,7 @@ app.add_middleware(
 security = HTTPBearer()
 
 ADMIN_TOKEN = os.getenv("HIGH_LIFE_ADMIN_TOKEN")
+NO_ANSWER = "I could not find a suitable answer"
 
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
@@ -59,7 +81,8 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     return credentials.credentials
 
 
-limiter = Limiter(key_func=get_remote_address)
+# HIGH_LIFE_RATE_LIMIT=off lets explorations/load_benchmark.py drive the api harder than 5/minute
+limiter = Limiter(key_func=get_remote_address, enabled=os.getenv("HIGH_LIFE_RATE_LIMIT", "on") != "off")
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -75,51 +98,80 @@ class Input(BaseModel):
 
 
 def log_query(logging_id: str, query_str: str):
-    with sqlite3.connect('logs.sqlite3') as conn:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO queries (logging_id,query) VALUES (?,?)", (logging_id, query_str))
+    log_sink.write("INSERT INTO queries (logging_id,query) VALUES (?,?)", [(logging_id, query_str)])
 
 
 @app.post("/query")
 @limiter.limit("5/minute")
 async def query(request: Request, input: Input) -> dict[str, str]:
     logging_id: str = uuid.uuid4().hex
-    docs = docs_accumulation(query_str=input.text, logging_id=logging_id)
-    answer = anthropic_call(docs, input.text, logging_id)
+    query_embedding = await Settings.embed_model.aget_query_embedding(input.text)
+    if hit := await asyncio.to_thread(cached_answer, input.text, query_embedding, logging_id):
+        return {"text": hit.answer}
+    docs = await docs_accumulation(query_str=input.text, logging_id=logging_id)
+    answer = await anthropic_call(docs, input.text, logging_id)
+    await asyncio.to_thread(cache_answer, input.text, query_embedding, answer)
     logger.info(f"{logging_id}:{datetime.utcnow()} - Query finalized")
 
     return {"text": answer}
 
 
+@app.post("/query/stream")
+@limiter.limit("5/minute")
+def query_stream(request: Request, input: Input):
+    """Server-sent events: `status` while retrieving, `token` for each piece of the answer, then `done`."""
+    logging_id: str = uuid.uuid4().hex
+    return StreamingResponse(stream_answer(input.text, logging_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @limiter.limit("5/minute")
 @app.post("/vector-query")
-def vector_query(request: Request, input: Input):
-    return retrieve_documents(query_str=input.text)
+async def vector_query(request: Request, input: Input):
+    return await aretrieve_documents(input.text)
 
 
 def log_filtering_responses(logging_id, query_str: str, model_resp: str):
-    with sqlite3.connect('logs.sqlite3') as conn:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO filtering_responses (logging_id,input,result) VALUES (?,?,?)",
-                       (logging_id, query_str, model_resp))
+    log_sink.write("INSERT INTO filtering_responses (logging_id,input,result) VALUES (?,?,?)",
+                   [(logging_id, query_str, model_resp)])
 
 
 def log_final_responses(logging_id, query_str: str, model_resp: str):
-    with sqlite3.connect('logs.sqlite3') as conn:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO final_responses (logging_id,input,result) VALUES (?,?,?)",
-                       (logging_id, query_str, model_resp))
+    log_sink.write("INSERT INTO final_responses (logging_id,input,result) VALUES (?,?,?)",
+                   [(logging_id, query_str, model_resp)])
+
+
+def log_cache_hit(logging_id, hit: CacheHit):
+    log_sink.write("INSERT INTO cache_hits (logging_id,cache_id,similarity) VALUES (?,?,?)",
+                   [(logging_id, hit.cache_id, hit.similarity)])
 
 
-def docs_accumulation(query_str: str, logging_id) -> str:
-    # sourcery skip: inline-immediately-returned-variable
-    log_query(logging_id, query_str=query_str)
+def cached_answer(query_str: str, query_embedding, logging_id) -> CacheHit | None:
+    if hit := answer_cache.lookup(query_embedding):
+        log_query(logging_id, query_str=query_str)
+        log_cache_hit(logging_id, hit)
+        logger.info(f"{logging_id}:{datetime.utcnow()} - answer cache hit {hit.similarity:.3f} '{hit.query}'")
+    return hit
+
+
+def cache_answer(query_str: str, query_embedding, answer: str):
+    if answer != NO_ANSWER:
+        answer_cache.store(query_str, query_embedding, answer)
+
+
+async def docs_accumulation(query_str: str, logging_id) -> str:
+    log_query(logging_id, query_str)
     logger.info(f"{logging_id}:{datetime.utcnow()} - Starting Query")
-    docs = hyde_vector_retriever.retrieve(query_str)
+    docs = await aretrieve_documents(query_str, logging_id=logging_id)
     logger.info(f"{logging_id}:{datetime.utcnow()} - documents retrieved")
     log_retrieval(logging_id, docs)
-    texts = gather_nodes_recursively(docs)
-    logger.info(f"{logging_id}:{datetime.utcnow()} - nodes gathered")
+    fetcher = NodeFetcher()
+    texts = await asyncio.to_thread(gather_nodes_recursively, docs, fetcher)
+    logger.info(f"{logging_id}:{datetime.utcnow()} - nodes gathered in {fetcher.round_trips} round trips")
+    return format_documents(texts)
+
+
+def format_documents(texts: dict[str, list[BaseNode]]) -> str:
     answer_content = "<documents>"
     for index, node_list in enumerate(texts.values()):
         _answer_content = f"\n<document {index}:\n"
@@ -131,12 +183,8 @@ def docs_accumulation(query_str: str, logging_id) -> str:
     return answer_content
 
 
-def anthropic_call(accumulated_docs, user_query, logging_id) -> str:
-    client = Anthropic(
-        # defaults to os.environ.get("ANTHROPIC_API_KEY")
-        api_key=os.getenv("ANTHROPIC_API_KEY"),
-    )
-    messages = client.messages.create(
+def claude_request(accumulated_docs, user_query) -> dict:
+    return dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=2000,
         temperature=0.1,
@@ -144,19 +192,68 @@ def anthropic_call(accumulated_docs, user_query, logging_id) -> str:
         messages=[
             {"role": "user", "content": [{"type": "text", "text": user_query}]}
         ],
-    ).content
+    )
+
+
+async def anthropic_call(accumulated_docs, user_query, logging_id) -> str:
+    messages = (await llm_clients.anthropic_message(claude_request(accumulated_docs, user_query), logging_id)).content
     # final_response = llm.complete(final_prompt).text
 
     resp = " ".join([i.text for i in messages])
     log_final_responses(logging_id, f"{accumulated_docs}\n{user_query}", resp)
     xml = BeautifulSoup(f"<response>{resp}</response>", 'lxml-xml')
-    return resp.text if (resp := xml.find("answer")) else "I could not find a suitable answer"
+    return resp.text if (resp := xml.find("answer")) else NO_ANSWER
+
+
+async def stream_answer(query_str: str, logging_id: str):
+    """Same pipeline as /query, but yields SSE events and streams the <answer> body as Claude writes it."""
+    try:
+        query_embedding = await Settings.embed_model.aget_query_embedding(query_str)
+        if hit := await asyncio.to_thread(cached_answer, query_str, query_embedding, logging_id):
+            yield sse_event("token", hit.answer)
+            yield sse_event("done", logging_id)
+            return
+        log_query(logging_id, query_str)
+        logger.info(f"{logging_id}:{datetime.utcnow()} - Starting Query")
+        yield sse_event("status", "Searching")
+        docs = await aretrieve_documents(query_str, logging_id=logging_id)
+        logger.info(f"{logging_id}:{datetime.utcnow()} - documents retrieved")
+        yield sse_event("status", "Documents retrieved")
+        log_retrieval(logging_id, docs)
+        fetcher = NodeFetcher()
+        texts = await asyncio.to_thread(gather_nodes_recursively, docs, fetcher)
+        logger.info(f"{logging_id}:{datetime.utcnow()} - nodes gathered in {fetcher.round_trips} round trips")
+        yield sse_event("status", "Writing answer")
+        accumulated_docs = format_documents(texts)
+
+        parser = AnswerStreamParser()
+        chunks, answer = [], []
+        async with llm_clients.anthropic_stream(claude_request(accumulated_docs, query_str), logging_id) as stream:
+            async for text in stream.text_stream:
+                chunks.append(text)
+                if token := parser.feed(text):
+                    answer.append(token)
+                    yield sse_event("token", token)
+        if token := parser.close():
+            answer.append(token)
+            yield sse_event("token", token)
+        if not parser.emitted:
+            answer.append(NO_ANSWER)
+            yield sse_event("token", NO_ANSWER)
+        log_final_responses(logging_id, f"{accumulated_docs}\n{query_str}", "".join(chunks))
+        await asyncio.to_thread(cache_answer, query_str, query_embedding, "".join(answer))
+        logger.info(f"{logging_id}:{datetime.utcnow()} - Query finalized")
+        yield sse_event("done", logging_id)
+    except Exception:
+        logger.exception(f"{logging_id}:{datetime.utcnow()} - streaming query failed")
+        yield sse_event("error", "Something went wrong, please try again")
 
 
 def call_model(accumulated_docs, user_query, logging_id) -> str:
-    groq = Groq(model="llama3-8b-8192", api_key=os.getenv("GROQ_API_KEY"))
+    groq = llm_clients.groq("llama3-8b-8192")
     # Call the complete method with a query
-    resp = groq.complete(accumulated_prompt.format(docs=accumulated_docs, query_str=user_query)).text
+    resp = llm_clients.complete(groq, accumulated_prompt.format(docs=accumulated_docs, query_str=user_query),
+                                logging_id).text
 
     # from groq import Groq
     #
@@ -180,7 +277,13 @@ def call_model(accumulated_docs, user_query, logging_id) -> str:
     # Call the complete method with a query
     log_final_responses(logging_id, f"{accumulated_docs}\n{user_query}", resp)
     xml = BeautifulSoup(f"<response>{resp}</response>", 'lxml-xml')
-    return resp.text if (resp := xml.find("answer")) else "I could not find a suitable answer"
+    return resp.text if (resp := xml.find("answer")) else NO_ANSWER
+
+
+@app.get("/stats")
+def stats(token: str = Depends(verify_token)):
+    return {"node_cache": node_cache.stats(), "log_sink": log_sink.stats(), "llm": llm_clients.stats(),
+            "embeddings": Settings.embed_model.stats()}
 
 
 class ScrapeInput(BaseModel):
@@ -191,21 +294,5 @@ class ScrapeInput(BaseModel):
 @app.post("/add_one")
 def scrape_one(request: Request, input: ScrapeInput, token: str = Depends(verify_token), ):
     """add an url to be scraped later"""
-    conn = sqlite3.connect("scraping.db")
-    cursor = conn.cursor()
-
-    # Create the table if it doesn't exist
-    cursor.execute('''
-            CREATE TABLE IF NOT EXISTS urls
-            (url TEXT PRIMARY KEY, complete BOOLEAN)
-        ''')
-
-    # Insert the new URL with complete set to False
-    cursor.execute('''
-            INSERT OR IGNORE INTO urls (url, complete)
-            VALUES (?, ?)
-        ''', (input.url, False))
-
-    conn.commit()
-    conn.close()
+    scrape_queue.enqueue(input.url)
     return {"message": "success"}
@@ -0,0 +1,128 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_HEADLESS = os.getenv("BROWSER_HEADLESS", "true").lower() in ("1", "true", "yes")
+BROWSER_LEASE_TIMEOUT = float(os.getenv("BROWSER_LEASE_TIMEOUT", "300"))
+
+logger = logging.getLogger(__name__)
+
+
+def make_firefox(headless=BROWSER_HEADLESS) -> webdriver.Firefox:
+    options = webdriver.FirefoxOptions()
+    if headless:
+        options.add_argument("-headless")
+    options.set_preference("permissions.default.image", 2)  # alt text is all we read; don't download the images
+    return webdriver.Firefox(options=options)
+
+
+class BrowserPool:
+    """Up to `size` browsers kept warm between urls instead of one booted (and logged in) per url.
+
+    Browsers start lazily, `prepare` runs once on each new one (e.g. restoring a login), and `lease` hands
+    one out for the length of a `with` block. A browser that raises a WebDriverException is quit and replaced
+    on the next lease, so one crashed instance doesn't poison the pool.
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, make_driver: Callable[[], webdriver.Remote] = make_firefox,
+                 prepare: Callable[[webdriver.Remote], None] | None = None, lease_timeout=BROWSER_LEASE_TIMEOUT):
+        self.size = size
+        self.make_driver = make_driver
+        self.prepare = prepare
+        self.lease_timeout = lease_timeout
+        self.idle: queue.Queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.started = 0
+        self.drivers = []
+        self.counts = {"leases": 0, "started": 0, "replaced": 0}
+        atexit.register(self.close)
+
+    def _start(self):
+        driver = self.make_driver()
+        try:
+            if self.prepare is not None:
+                self.prepare(driver)
+        except BaseException:
+            driver.quit()
+            raise
+        with self.lock:
+            self.drivers.append(driver)
+            self.counts["started"] += 1
+        return driver
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.lease_timeout
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                can_start = self.started < self.size
+                if can_start:
+                    self.started += 1
+            if can_start:
+                try:
+                    return self._start()
+                except BaseException:
+                    with self.lock:
+                        self.started -= 1
+                    raise
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"no browser free after {self.lease_timeout}s")
+            try:
+                return self.idle.get(timeout=0.5)  # short, so a slot freed by a replaced browser is noticed
+            except queue.Empty:
+                continue
+
+    def _discard(self, driver):
+        with self.lock:
+            self.started -= 1
+            self.counts["replaced"] += 1
+            if driver in self.drivers:
+                self.drivers.remove(driver)
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    @contextmanager
+    def lease(self):
+        driver = self._acquire()
+        with self.lock:
+            self.counts["leases"] += 1
+        try:
+            yield driver
+        except WebDriverException:
+            logger.warning("browser failed, replacing it", exc_info=True)
+            self._discard(driver)
+            raise
+        except BaseException:
+            self.idle.put(driver)
+            raise
+        else:
+            self.idle.put(driver)
+
+    def close(self):
+        with self.lock:
+            drivers, self.drivers = self.drivers, []
+            self.started = 0
+        self.idle = queue.Queue()
+        for driver in drivers:
+            try:
+                driver.quit()
+            except WebDriverException:
+                pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counts, "size": self.size, "running": self.started, "idle": self.idle.qsize()}
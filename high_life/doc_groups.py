@@ -0,0 +1,169 @@
+import json
+import sqlite3
+from typing import Callable
+
+from chromadb.api.models import Collection
+from llama_index.core.schema import BaseNode, NodeRelationship
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from settings import INDEX_DB_NAME, chroma_collection
+
+BUILD_PAGE_SIZE = 1000
+LINKS = (NodeRelationship.PARENT, NodeRelationship.CHILD, NodeRelationship.PREVIOUS, NodeRelationship.NEXT)
+
+
+def _related_ids(node: BaseNode, relationship: NodeRelationship) -> list[str]:
+    related = node.relationships.get(relationship)
+    if related is None:
+        return []
+    return [info.node_id for info in (related if isinstance(related, list) else [related])]
+
+
+def _related_id(node: BaseNode, relationship: NodeRelationship) -> str | None:
+    return next(iter(_related_ids(node, relationship)), None)
+
+
+def links(node: BaseNode) -> dict[NodeRelationship, list[str]]:
+    """The ids a node points at through the relationships groups are made of."""
+    return {relationship: _related_ids(node, relationship) for relationship in LINKS}
+
+
+def group_of(node_id: str, get: Callable[[str], BaseNode | None]) -> tuple[str, list[str]] | None:
+    """(group_id, ordered member ids) of the answer document `node_id` expands to, the way
+    `search.gather_nodes_recursively` walks it: its PARENT if that exists, otherwise its PREVIOUS/NEXT chain.
+
+    A parent doc is both a one-member group for its children and the head of its own chain of parent docs,
+    so group ids say which: "parent:<id>" or "chain:<head id>".
+    """
+    if (node := get(node_id)) is None:
+        return None
+    if (parent_id := _related_id(node, NodeRelationship.PARENT)) and get(parent_id) is not None:
+        return f"parent:{parent_id}", [parent_id]
+    seen = {node_id}
+    walks = {NodeRelationship.PREVIOUS: [], NodeRelationship.NEXT: []}
+    for relationship, walk in walks.items():
+        current = node
+        while ((other_id := _related_id(current, relationship)) and other_id not in seen
+               and (other := get(other_id)) is not None):
+            seen.add(other_id)
+            walk.append(other_id)
+            current = other
+    members = walks[NodeRelationship.PREVIOUS][::-1] + [node_id] + walks[NodeRelationship.NEXT]
+    return f"chain:{members[0]}", members
+
+
+class DocGroups:
+    """Precomputed answer documents: node_id -> group_id -> ordered member ids, in two sqlite tables.
+
+    `gather_nodes_recursively` used to chase PARENT and then PREVIOUS/NEXT from every hit, one chroma round
+    trip per hop. The result only changes with the graph, so `build` computes it for every node from one
+    paged scan and retrieval looks the hits up instead. A chain's members all share the chain's group.
+    `refresh` recomputes the groups around nodes as they are inserted; anything missing or stale falls
+    back to the traversal at query time.
+    """
+
+    def __init__(self, collection: Collection, db_name=INDEX_DB_NAME):
+        self.collection = collection
+        self.name = collection.name
+        self.db_name = db_name
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS doc_groups (
+                    collection TEXT,
+                    node_id TEXT,
+                    group_id TEXT,
+                    PRIMARY KEY (collection, node_id)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS doc_group_members (
+                    collection TEXT,
+                    group_id TEXT,
+                    members TEXT,
+                    PRIMARY KEY (collection, group_id)
+                )
+            """)
+
+    def _compute(self, seeds, get) -> tuple[dict[str, str], dict[str, list[str]]]:
+        def has_parent(node_id):
+            parent_id = _related_id(get(node_id), NodeRelationship.PARENT)
+            return bool(parent_id) and get(parent_id) is not None
+
+        assignments, groups = {}, {}
+        for node_id in seeds:
+            if node_id in assignments or (group := group_of(node_id, get)) is None:
+                continue
+            group_id, members = group
+            groups[group_id] = members
+            assignments[node_id] = group_id
+            if node_id in members:  # a chain: every member without a parent of its own expands to the same one
+                assignments.update({member_id: group_id for member_id in members
+                                    if member_id not in assignments and not has_parent(member_id)})
+        return assignments, groups
+
+    def _write(self, conn, assignments: dict[str, str], groups: dict[str, list[str]]):
+        conn.executemany("INSERT OR REPLACE INTO doc_groups (collection, node_id, group_id) VALUES (?,?,?)",
+                         [(self.name, node_id, group_id) for node_id, group_id in assignments.items()])
+        conn.executemany("INSERT OR REPLACE INTO doc_group_members (collection, group_id, members) VALUES (?,?,?)",
+                         [(self.name, group_id, json.dumps(members)) for group_id, members in groups.items()])
+
+    def build(self, page_size=BUILD_PAGE_SIZE) -> int:
+        """Replace this collection's groups with ones computed from one paged pass over its metadata."""
+        nodes = {}
+        for offset in range(0, self.collection.count(), page_size):
+            page = self.collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            for node_id, metadata in zip(page["ids"], page["metadatas"]):
+                nodes[node_id] = metadata_dict_to_node(metadata)
+        assignments, groups = self._compute(sorted(nodes), nodes.get)
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("DELETE FROM doc_groups WHERE collection = ?", (self.name,))
+            conn.execute("DELETE FROM doc_group_members WHERE collection = ?", (self.name,))
+            self._write(conn, assignments, groups)
+        return len(groups)
+
+    def refresh(self, nodes: list[BaseNode], fetch: Callable[[list[str]], dict[str, BaseNode]]):
+        """Recompute the groups of `nodes` and of the nodes they link to; `fetch` loads anything else the walk needs."""
+        known: dict[str, BaseNode | None] = {node.node_id: node for node in nodes}
+
+        def get(node_id):
+            if node_id not in known:
+                known.update(fetch([node_id]))
+                known.setdefault(node_id, None)
+            return known[node_id]
+
+        seeds = list(dict.fromkeys([node.node_id for node in nodes] +
+                                   [related_id for node in nodes for relationship in LINKS
+                                    for related_id in _related_ids(node, relationship)]))
+        if missing := [node_id for node_id in seeds if node_id not in known]:  # one round trip for all of them
+            found = fetch(missing)
+            known.update({node_id: found.get(node_id) for node_id in missing})
+        assignments, groups = self._compute(seeds, get)
+        with sqlite3.connect(self.db_name) as conn:
+            self._write(conn, assignments, groups)
+            # a chain that gained a new head is stored under the new id; drop groups nothing points at anymore
+            conn.execute("""
+                DELETE FROM doc_group_members WHERE collection = ? AND group_id NOT IN (
+                    SELECT group_id FROM doc_groups WHERE collection = ?
+                )
+            """, (self.name, self.name))
+
+    def lookup(self, node_ids) -> dict[str, list[str]]:
+        """Ordered member ids of each node's group, for the nodes that have one."""
+        node_ids = list(dict.fromkeys(node_ids))
+        found = {}
+        with sqlite3.connect(self.db_name) as conn:
+            for i in range(0, len(node_ids), 500):
+                chunk = node_ids[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT g.node_id, m.members FROM doc_groups g JOIN doc_group_members m "
+                    f"ON m.collection = g.collection AND m.group_id = g.group_id "
+                    f"WHERE g.collection = ? AND g.node_id IN ({','.join('?' * len(chunk))})", [self.name, *chunk]
+                ).fetchall()
+                found.update({node_id: json.loads(members) for node_id, members in rows})
+        return found
+
+
+doc_groups = DocGroups(chroma_collection)
+
+if __name__ == "__main__":
+    print(f"{doc_groups.build()} document groups built for {doc_groups.name}")
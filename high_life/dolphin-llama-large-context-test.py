@@ -1,10 +1,11 @@
+import asyncio
 import datetime
 
 from llama_index.core.schema import MetadataMode, NodeWithScore
 from llama_index.llms.ollama import Ollama
 
 from prompts import accumulated_prompt
-from search import hyde_vector_retriever
+from search import aretrieve_documents
 
 query_str = "i need some restaurants or places to eat in Switzerland?"
 
@@ -15,7 +16,7 @@ llm = Ollama(model="llama3-gradient", request_timeout=5500, additional_kwargs={"
 # query_engine = index.as_query_engine(similarity_top_k=20, llm=llm, )
 
 # docs = retrieve_documents(query_str)
-docs: list[NodeWithScore] = hyde_vector_retriever.retrieve(query_str)
+docs: list[NodeWithScore] = asyncio.run(aretrieve_documents(query_str))
 answer_content = "<documents>"
 for index, node in enumerate(docs):
     _answer_content = f"\n<document {index}:\n>"
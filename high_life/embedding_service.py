@@ -0,0 +1,241 @@
+import asyncio
+import glob
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import PrivateAttr
+
+if TYPE_CHECKING:
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+EMBED_TORCH_THREADS = int(os.getenv("EMBED_TORCH_THREADS", "0"))  # 0 leaves torch's default
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")  # torch | onnx | small
+EMBED_MODEL = os.getenv("EMBED_MODEL", "avsolatorio/GIST-large-Embedding-v0")
+# 384 dimensions instead of 1024: only usable against a collection embedded with the same model
+EMBED_SMALL_MODEL = os.getenv("EMBED_SMALL_MODEL", "avsolatorio/GIST-small-Embedding-v0")
+EMBED_ONNX_QUANTIZATION = os.getenv("EMBED_ONNX_QUANTIZATION", "avx2")  # arm64 | avx2 | avx512 | avx512_vnni
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "10"))
+CACHE_FOLDER = "embeddings-cache"
+
+
+def onnx_int8_model(model_name: str, quantization: str = EMBED_ONNX_QUANTIZATION) -> tuple[str, str]:
+    """Export `model_name` to ONNX and quantize it to int8 once, into embeddings-cache; returns (path, file_name)."""
+    path = os.path.join(CACHE_FOLDER, "onnx-int8", model_name.replace("/", "__"))
+    pattern = os.path.join(path, "onnx", f"model_q*int8_{quantization}.onnx")  # avx2 is quint8, the rest qint8
+    if not glob.glob(pattern):
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+
+        model = SentenceTransformer(model_name, backend="onnx", cache_folder=CACHE_FOLDER)
+        model.save_pretrained(path)
+        export_dynamic_quantized_onnx_model(model, quantization, path)
+    return path, os.path.relpath(glob.glob(pattern)[0], path)
+
+
+def embed_model_name(backend: str = EMBED_BACKEND) -> str:
+    return {"onnx": f"{EMBED_MODEL} (onnx int8 {EMBED_ONNX_QUANTIZATION})", "small": EMBED_SMALL_MODEL}.get(backend, EMBED_MODEL)
+
+
+def load_embed_model(backend: str = EMBED_BACKEND) -> "HuggingFaceEmbedding":
+    # imported here rather than at the top: it pulls in sentence_transformers and torch, which settings (and so
+    # every process) would otherwise pay for before anything is embedded
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    if backend == "torch":
+        return HuggingFaceEmbedding(EMBED_MODEL, cache_folder=CACHE_FOLDER, embed_batch_size=EMBED_BATCH_SIZE)
+    if backend == "onnx":
+        path, file_name = onnx_int8_model(EMBED_MODEL)
+        return HuggingFaceEmbedding(path, cache_folder=CACHE_FOLDER, embed_batch_size=EMBED_BATCH_SIZE,
+                                    backend="onnx", model_kwargs={"file_name": file_name})
+    if backend == "small":
+        return HuggingFaceEmbedding(EMBED_SMALL_MODEL, cache_folder=CACHE_FOLDER, embed_batch_size=EMBED_BATCH_SIZE)
+    raise ValueError(f"unknown EMBED_BACKEND {backend!r}, expected torch, onnx or small")
+
+
+def normalize(text: str) -> str:
+    """Whitespace and case only; the GIST tokenizer lowercases anyway, so this never changes the embedding."""
+    return " ".join(text.split()).lower()
+
+
+class EmbeddingService(BaseEmbedding):
+    """Wraps an embedding model with an LRU cache and micro-batching.
+
+    The model comes from `loader` and is only loaded on first use or by `warm()`, so importing settings
+    no longer pays for loading GIST-large.
+
+    Single query/text embeddings from concurrent callers queue up for at most `max_wait_ms` and go through
+    the model together, up to `max_batch` at a time, on a small pool of `workers` threads. Every result is
+    cached under `(kind, hash_fn(normalize(text)))`, so a query embedded for the answer cache is not embedded
+    again for the vector search. Lists of texts (ingestion) skip the queue and are embedded in
+    `embed_batch_size` chunks, still going through the cache.
+    """
+
+    _model: BaseEmbedding | None = PrivateAttr(default=None)
+    _loader = PrivateAttr()
+    _hash_fn = PrivateAttr()
+    _cache_size: int = PrivateAttr()
+    _max_batch: int = PrivateAttr()
+    _max_wait: float = PrivateAttr()
+    _cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _load_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _queue: queue.Queue = PrivateAttr(default_factory=queue.Queue)
+    _pool: ThreadPoolExecutor = PrivateAttr()
+    _collector: threading.Thread | None = PrivateAttr(default=None)
+    _stats: defaultdict = PrivateAttr(default_factory=lambda: defaultdict(int))
+
+    def __init__(self, loader, hash_fn, model_name=None, cache_size=EMBED_CACHE_SIZE,
+                 max_batch=EMBED_MAX_BATCH, max_wait_ms=EMBED_MAX_WAIT_MS, workers=EMBED_WORKERS,
+                 torch_threads=EMBED_TORCH_THREADS, **kwargs):
+        super().__init__(model_name=model_name or embed_model_name(), embed_batch_size=EMBED_BATCH_SIZE, **kwargs)
+        self._loader = loader
+        self._hash_fn = hash_fn
+        self._cache_size = cache_size
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed")
+        if torch_threads:
+            import torch
+
+            torch.set_num_threads(torch_threads)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "EmbeddingService"
+
+    @property
+    def model(self) -> BaseEmbedding:
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    started = time.perf_counter()
+                    self._model = self._loader()
+                    self._stats["load_seconds"] = time.perf_counter() - started
+        return self._model
+
+    def warm(self):
+        """Load the model and push a full dummy batch of each kind through it, outside the cache."""
+        for kind in ("query", "text"):
+            self._embed(kind, ["warm up"] * self._max_batch)
+
+    def _embed(self, kind: str, texts: list[str]) -> list[Embedding]:
+        model = self.model
+        started = time.perf_counter()
+        if hasattr(model, "_embed"):  # HuggingFaceEmbedding: one forward pass, right prompt per kind
+            embeddings = model._embed(texts, prompt_name=kind)
+        elif kind == "query":
+            embeddings = [model._get_query_embedding(text) for text in texts]
+        else:
+            embeddings = model._get_text_embeddings(texts)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["embedded"] += len(texts)
+            self._stats["embed_seconds"] += time.perf_counter() - started
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(texts))
+        return embeddings
+
+    def _cache_get(self, key) -> Embedding | None:
+        with self._lock:
+            if (embedding := self._cache.get(key)) is not None:
+                self._cache.move_to_end(key)
+                self._stats["hits"] += 1
+            else:
+                self._stats["misses"] += 1
+            return embedding
+
+    def _cache_put(self, key, embedding: Embedding):
+        with self._lock:
+            self._cache[key] = embedding
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _key(self, kind: str, text: str):
+        return kind, self._hash_fn(normalize(text))
+
+    def _submit(self, kind: str, text: str) -> Future:
+        """A future for one embedding, answered from the cache or from the next micro-batch."""
+        future = Future()
+        key = self._key(kind, text)
+        if (embedding := self._cache_get(key)) is not None:
+            future.set_result(embedding)
+            return future
+        if self._collector is None:
+            with self._lock:
+                if self._collector is None:
+                    self._collector = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+                    self._collector.start()
+        self._queue.put((kind, text, key, future))
+        return future
+
+    def _collect(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self._max_wait
+            while len(pending) < self._max_batch:
+                try:
+                    pending.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            by_kind = defaultdict(list)
+            for item in pending:
+                by_kind[item[0]].append(item)
+            for kind, items in by_kind.items():
+                self._pool.submit(self._run_batch, kind, items)
+
+    def _run_batch(self, kind: str, items: list):
+        # the same text can be queued twice before the first result lands in the cache
+        unique = list(OrderedDict((key, text) for _, text, key, _ in items).items())
+        try:
+            embeddings = dict(zip([key for key, _ in unique], self._embed(kind, [text for _, text in unique])))
+        except Exception as e:
+            for *_, future in items:
+                future.set_exception(e)
+            return
+        for key, embedding in embeddings.items():
+            self._cache_put(key, embedding)
+        for _, _, key, future in items:
+            future.set_result(embeddings[key])
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._submit("query", query).result()
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await asyncio.wrap_future(self._submit("query", query))
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._submit("text", text).result()
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await asyncio.wrap_future(self._submit("text", text))
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        keys = [self._key("text", text) for text in texts]
+        embeddings = [self._cache_get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        for start in range(0, len(missing), self.embed_batch_size):
+            chunk = missing[start:start + self.embed_batch_size]
+            for i, embedding in zip(chunk, self._embed("text", [texts[i] for i in chunk])):
+                embeddings[i] = embedding
+                self._cache_put(keys[i], embedding)
+        return embeddings
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return await asyncio.to_thread(self._get_text_embeddings, texts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached"] = len(self._cache)
+        stats["mean_batch"] = stats.get("embedded", 0) / stats["batches"] if stats.get("batches") else 0
+        return stats
@@ -0,0 +1,97 @@
+"""Embedding backends compared on load time, query latency, peak RSS and recall@k.
+
+A sample of the collection is the corpus, each row as the text ingestion embeds (the node's content with
+its embed-visible metadata). The reference ranking is the torch backend, GIST-large as /query runs it. Every
+backend, torch included, embeds the same corpus and queries itself, and recall@k is the overlap of its top
+k with the reference top k. Each backend runs in its own process so their RSS numbers don't include each
+other.
+
+Run from high_life/:
+    python -m explorations.embedding_backends_benchmark --backends torch onnx small --corpus 2000 --k 10
+"""
+import argparse
+import multiprocessing
+import resource
+import sqlite3
+import statistics
+import time
+
+import numpy as np
+from llama_index.core.schema import MetadataMode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from explorations.load_benchmark import QUERIES
+from settings import DB_NAME, chroma_collection
+
+
+def sample_corpus(n: int) -> list[str]:
+    """The texts the stored vectors were computed from, so every backend sees what ingestion embedded."""
+    result = chroma_collection.get(limit=n, include=["documents", "metadatas"])
+    return [metadata_dict_to_node(metadata, text=document).get_content(metadata_mode=MetadataMode.EMBED)
+            for metadata, document in zip(result["metadatas"], result["documents"])]
+
+
+def logged_queries(n: int) -> list[str]:
+    with sqlite3.connect(DB_NAME) as conn:
+        queries = [query for query, in conn.execute("SELECT DISTINCT query FROM queries LIMIT ?", (n,))]
+    return queries or QUERIES
+
+
+def top_k(query_embeddings: np.ndarray, corpus_embeddings: np.ndarray, k: int) -> list[set[int]]:
+    corpus = corpus_embeddings / np.linalg.norm(corpus_embeddings, axis=1, keepdims=True)
+    queries = query_embeddings / np.linalg.norm(query_embeddings, axis=1, keepdims=True)
+    return [set(row) for row in np.argsort(-(queries @ corpus.T), axis=1)[:, :k].tolist()]
+
+
+def measure(backend: str, documents: list[str], queries: list[str], k: int) -> dict:
+    from embedding_service import load_embed_model
+
+    start = time.perf_counter()
+    model = load_embed_model(backend)
+    model.get_text_embedding_batch(["warm up"] * 8)
+    load_seconds = time.perf_counter() - start
+
+    latencies, query_embeddings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_embeddings.append(model.get_query_embedding(query))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    corpus = np.asarray(model.get_text_embedding_batch(documents), dtype=np.float32)
+    corpus_seconds = time.perf_counter() - start
+    return {
+        "load_seconds": load_seconds,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "corpus_docs_per_second": len(documents) / corpus_seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "top_k": top_k(np.asarray(query_embeddings, dtype=np.float32), corpus, k),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "small"])
+    parser.add_argument("--corpus", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    documents = sample_corpus(args.corpus)
+    queries = logged_queries(args.queries)
+    backends = ["torch"] + [backend for backend in args.backends if backend != "torch"]
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for backend in backends:
+        with context.Pool(1) as pool:
+            results[backend] = pool.apply(measure, (backend, documents, queries, args.k))
+
+    reference = results["torch"]["top_k"]
+    print(f"{len(documents)} documents, {len(queries)} queries, k={args.k}")
+    for backend, result in results.items():
+        recall = statistics.mean(len(got & want) / args.k for got, want in zip(result["top_k"], reference))
+        print(f"{backend:<6} load={result['load_seconds']:6.1f}s query p50={result['p50_ms']:7.1f}ms "
+              f"mean={result['mean_ms']:7.1f}ms peak_rss={result['peak_rss_mb']:7.0f}MB "
+              f"corpus={result['corpus_docs_per_second']:.1f} docs/s "
+              f"recall@{args.k}={recall:.3f}")
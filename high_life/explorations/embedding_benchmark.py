@@ -0,0 +1,49 @@
+"""Embedding throughput: the bare model per batch size, then the micro-batching service under concurrent callers.
+
+Run from high_life/ (EMBED_TORCH_THREADS, EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS and EMBED_WORKERS apply):
+    python -m explorations.embedding_benchmark --texts 256
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from settings import Settings, chroma_collection
+
+
+def sample_texts(n: int) -> list[str]:
+    documents = chroma_collection.get(limit=n, include=["documents"])["documents"]
+    # unique suffixes so neither the service cache nor duplicate documents flatter the numbers
+    return [f"{document[:1000]} #{i}" for i, document in enumerate(documents)]
+
+
+def model_throughput(texts: list[str], batch_size: int) -> float:
+    model = Settings.embed_model.model
+    model.embed_batch_size = batch_size
+    start = time.perf_counter()
+    model.get_text_embedding_batch(texts)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def service_throughput(texts: list[str], callers: int) -> float:
+    service = Settings.embed_model
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        list(pool.map(service.get_query_embedding, texts))
+    return len(texts) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--callers", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    texts = sample_texts(args.texts)
+    Settings.embed_model.model.get_text_embedding_batch(texts[:4])  # load weights before timing
+    for batch_size in args.batch_sizes:
+        print(f"model   batch_size={batch_size:>3} {model_throughput(texts, batch_size):8.1f} texts/s")
+    for callers in args.callers:
+        throughput = service_throughput([f"{text} callers={callers}" for text in texts], callers)
+        print(f"service callers={callers:>3}    {throughput:8.1f} texts/s")
+    print(Settings.embed_model.stats())
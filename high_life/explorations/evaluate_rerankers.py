@@ -0,0 +1,107 @@
+"""Offline comparison of the cross-encoder reranker against LLMRerank over logged /query traffic.
+
+Every logged query's candidates (the `vector_retrieval` rows with stage='candidates', or a fresh vector
+search for queries logged before candidates were kept) are ranked by both rerankers, then compared on
+top-n overlap, Spearman correlation over the nodes both ranked, and latency.
+
+Run from high_life/:
+    python -m explorations.evaluate_rerankers --limit 100 --top-n 2
+    CROSS_ENCODER_BACKEND=onnx python -m explorations.evaluate_rerankers
+"""
+import argparse
+import sqlite3
+import statistics
+import time
+
+from llama_index.core.postprocessor import LLMRerank
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from llm_clients import llm_clients
+from rerankers import CrossEncoderReranker
+from search import SIMILARITY_TOP_K, retrieve_nodes, vector_search
+from settings import DB_NAME
+
+
+def logged_queries(db_name: str, limit: int) -> list[tuple[str, str]]:
+    with sqlite3.connect(db_name) as conn:
+        return conn.execute("""
+            SELECT queries.logging_id, queries.query
+            FROM queries
+            WHERE EXISTS (SELECT 1 FROM vector_retrieval WHERE vector_retrieval.logging_id = queries.logging_id)
+            ORDER BY queries.rowid DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+
+
+def logged_candidates(db_name: str, logging_id: str, query_str: str) -> list[NodeWithScore]:
+    with sqlite3.connect(db_name) as conn:
+        rows = conn.execute("SELECT node_id, score FROM vector_retrieval WHERE logging_id = ? AND stage = 'candidates' "
+                            "ORDER BY rank", (logging_id,)).fetchall()
+    if not rows:
+        return vector_search(QueryBundle(query_str), SIMILARITY_TOP_K)
+    nodes = retrieve_nodes([node_id for node_id, _ in rows])
+    return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in rows if node_id in nodes]
+
+
+def spearman(a: list[str], b: list[str]) -> float | None:
+    """Rank correlation over the ids present in both rankings."""
+    shared = [node_id for node_id in a if node_id in b]
+    if len(shared) < 2:
+        return None
+    rank_a = {node_id: i for i, node_id in enumerate(shared)}
+    rank_b = {node_id: i for i, node_id in enumerate([node_id for node_id in b if node_id in rank_a])}
+    n = len(shared)
+    return 1 - 6 * sum((rank_a[i] - rank_b[i]) ** 2 for i in shared) / (n * (n ** 2 - 1))
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def summarise(name: str, values: list[float]):
+    if values:
+        print(f"{name:<26} mean={statistics.mean(values):7.3f} p50={statistics.median(values):7.3f} "
+              f"max={max(values):7.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--top-n", type=int, default=2)
+    args = parser.parse_args()
+
+    cross_encoder = CrossEncoderReranker()
+    cross_encoder.warm()
+    # top_n=len(candidates) so both return their whole ranking, not just the picks that reach the prompt
+    llm_rerank = lambda query_str, candidates: LLMRerank(
+        llm=llm_clients.groq("llama3-8b-8192", sdk_retries=True), choice_batch_size=5, top_n=len(candidates),
+    ).postprocess_nodes(candidates, query_str=query_str)
+
+    overlaps, correlations, llm_latencies, cross_latencies = [], [], [], []
+    for logging_id, query_str in logged_queries(args.db, args.limit):
+        candidates = logged_candidates(args.db, logging_id, query_str)
+        if not candidates:
+            continue
+        llm_ranked, llm_latency = timed(llm_rerank, query_str, candidates)
+        cross_ranked, cross_latency = timed(cross_encoder.rerank_sync, query_str, candidates, len(candidates))
+        llm_ids = [node.node_id for node in llm_ranked]
+        cross_ids = [node.node_id for node in cross_ranked]
+        overlap = len(set(llm_ids[:args.top_n]) & set(cross_ids[:args.top_n])) / args.top_n
+        correlation = spearman(llm_ids, cross_ids)
+        overlaps.append(overlap)
+        llm_latencies.append(llm_latency)
+        cross_latencies.append(cross_latency)
+        if correlation is not None:
+            correlations.append(correlation)
+        print(f"{logging_id} candidates={len(candidates):>3} overlap@{args.top_n}={overlap:.2f} "
+              f"spearman={'-' if correlation is None else f'{correlation:.2f}'} "
+              f"llm={llm_latency:.2f}s cross-encoder={cross_latency:.3f}s  {query_str[:60]!r}")
+
+    print(f"\n{len(overlaps)} queries, cross-encoder backend={cross_encoder.backend}")
+    summarise(f"overlap@{args.top_n}", overlaps)
+    summarise("spearman", correlations)
+    summarise("llm latency (s)", llm_latencies)
+    summarise("cross-encoder latency (s)", cross_latencies)
@@ -0,0 +1,92 @@
+"""Cold fetch vs. revalidation vs. offline re-parse through fetcher.Fetcher, against a local page server.
+
+The server hands out N generated pages with ETag and Last-Modified headers, gzips them when asked, answers
+conditional requests with 304 and counts what it served, so nothing here touches the real sites.
+
+Run from high_life/:
+    python -m explorations.fetcher_benchmark --pages 200 --delay 0.05
+"""
+import argparse
+import gzip
+import hashlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fetcher import Fetcher
+
+LAST_MODIFIED = formatdate(time.time() - 3600, usegmt=True)
+
+
+def page(number: int) -> bytes:
+    paragraphs = "".join(f"<p>Paragraph {i} of page {number}, about a small hotel in Lisbon.</p>" for i in range(40))
+    return f"<html><body><div><h1>Page {number}</h1>{paragraphs}</div></body></html>".encode()
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    counts = {"200": 0, "304": 0, "bytes": 0}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = page(int(self.path.strip("/").split("/")[-1] or 0))
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag or self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+            with self.lock:
+                self.counts["304"] += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        payload = gzip.compress(body) if gzipped else body
+        with self.lock:
+            self.counts["200"] += 1
+            self.counts["bytes"] += len(payload)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=0, delay=0.0) -> ThreadingHTTPServer:
+    PageHandler.delay = delay
+    server = ThreadingHTTPServer(("127.0.0.1", port), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.05, help="server latency per request")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    server = serve(delay=args.delay)
+    urls = [f"http://127.0.0.1:{server.server_port}/page/{i}" for i in range(args.pages)]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fetcher = Fetcher(cache_dir=cache_dir, pool_size=args.concurrency)
+        for label, offline in (("cold", False), ("revalidate", False), ("offline", True)):
+            before = dict(PageHandler.counts)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(lambda url: fetcher.fetch(url, offline=offline), urls))
+            seconds = time.perf_counter() - started
+            served = {key: PageHandler.counts[key] - before[key] for key in before}
+            print(f"{label:<11} {seconds:6.2f}s  200s={served['200']:>4} 304s={served['304']:>4} "
+                  f"wire_bytes={served['bytes']:>8} from_cache={sum(r.from_cache for r in results):>4}")
+        print(fetcher.stats())
+    server.shutdown()
@@ -0,0 +1,22 @@
+"""Pages/minute of agent_splitter.ingest_urls at different concurrency levels.
+
+Nothing is inserted unless --insert is passed, so every run does the same summarising and linking work.
+
+Run from high_life/:
+    python -m explorations.ingestion_benchmark --concurrency 1 8 16 https://monocle.com/minute/2024/6/3/ ...
+"""
+import argparse
+
+from agent_splitter import ingest_urls
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--insert", action="store_true")
+    args = parser.parse_args()
+    for concurrency in args.concurrency:
+        report = ingest_urls(args.urls, concurrency=concurrency, insert=args.insert)
+        print(f"concurrency={concurrency:>3} pages={report['pages']:>3} failed={report['failed']:>2} "
+              f"nodes={report['nodes']:>5} summaries={report['summaries']:>4} "
+              f"{report['seconds']:7.1f}s {report['pages_per_minute']:7.1f} pages/minute")
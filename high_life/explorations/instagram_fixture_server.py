@@ -0,0 +1,122 @@
+"""Instagram-shaped pages served locally, for exercising instagram_util's browser pool without Instagram.
+
+/accounts/login/ has the username/password form and sets a `sessionid` cookie; every other page redirects
+there without one. Profiles (/<name>/) and posts (/p/<id>/) render their content from javascript after
+--render-delay, the way Instagram does, so a fixed sleep either wastes time or reads an empty page.
+The server counts logins, so a run shows the saved session being reused.
+
+Run from high_life/ (needs Firefox and geckodriver):
+    python -m explorations.instagram_fixture_server --pages 20 --pool-size 1 2 4
+    python -m explorations.instagram_fixture_server --serve --port 8765
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOGIN_PAGE = """<html><body><form method="post" action="/accounts/login/">
+<input name="username"><input name="password" type="password"><button type="submit">Log in</button>
+</form></body></html>"""
+
+RENDERED_PAGE = """<html><body><div id="root"></div><script>
+setTimeout(function () {{ document.getElementById("root").innerHTML = {content}; }}, {delay_ms});
+</script></body></html>"""
+
+
+def profile_content(name: str, posts=12) -> str:
+    """A header with the bio, then the grid: rows of three linked images, each row a sibling of the header."""
+    grid = [f'<a href="/p/{name}{i}/"><div><img alt="Post {i} by {name}: a morning swim in Lisbon"></div></a>'
+            for i in range(posts)]
+    rows = "".join(f"<div>{''.join(grid[i:i + 3])}</div>" for i in range(0, posts, 3))
+    return (f"<header><section><h2>{name}</h2><div><span>Chef and writer</span><span>Lisbon, Portugal</span>"
+            f"</div></section></header>{rows}")
+
+
+def post_content(post_id: str) -> str:
+    return (f"<article><div><span>{post_id}</span><span>A long lunch at a small restaurant in Alfama with the "
+            f"best grilled sardines in the city</span></div></article>")
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    render_delay = 1.0
+    counts = {"logins": 0, "pages": 0}
+    lock = threading.Lock()
+
+    def _send(self, status: int, body: str = "", headers: dict | None = None):
+        payload = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.lock:
+            self.counts["logins"] += 1
+        self._send(303, headers={"Location": "/", "Set-Cookie": f"sessionid=fixture{time.time_ns()}; Path=/"})
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path.startswith("/accounts/login"):
+            self._send(200, LOGIN_PAGE)
+        elif path == "/":
+            self._send(200, "<html><body>home</body></html>")
+        elif "sessionid=" not in self.headers.get("Cookie", ""):
+            self._send(302, headers={"Location": "/accounts/login/"})
+        else:
+            parts = [part for part in path.split("/") if part]
+            content = post_content(parts[1]) if parts[0] in ("p", "reel") else profile_content(parts[0])
+            with self.lock:
+                self.counts["pages"] += 1
+            self._send(200, RENDERED_PAGE.format(content=json.dumps(content), delay_ms=int(self.render_delay * 1000)))
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=0, render_delay=1.0) -> ThreadingHTTPServer:
+    FixtureHandler.render_delay = render_delay
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", action="store_true", help="only serve the fixtures")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--pool-size", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--render-delay", type=float, default=1.0)
+    args = parser.parse_args()
+    server = serve(args.port, args.render_delay)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    if args.serve:
+        print(f"serving on {base_url}")
+        server.serve_forever()
+
+    import instagram_util
+    from browser_pool import BrowserPool
+
+    instagram_util.INSTAGRAM_BASE_URL = base_url
+    urls = [f"{base_url}/p/post{i}/" if i % 2 else f"{base_url}/profile{i}/" for i in range(args.pages)]
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare = partial(instagram_util.log_in, cookie_file=os.path.join(tmp, "cookies.json"))
+        for size in args.pool_size:
+            pool = BrowserPool(size=size, prepare=prepare)
+            logins = FixtureHandler.counts["logins"]
+            started = time.perf_counter()
+            pages = instagram_util.get_instagram_pages(urls, pool)
+            seconds = time.perf_counter() - started
+            ready = sum(isinstance(page, str) and ("Lisbon" in page or "sardines" in page) for page in pages.values())
+            print(f"pool={size:>2} {len(urls)} pages in {seconds:6.1f}s ({seconds / len(urls):.2f}s/page) "
+                  f"rendered={ready:>3} logins={FixtureHandler.counts['logins'] - logins} {pool.stats()}")
+            pool.close()
+    server.shutdown()
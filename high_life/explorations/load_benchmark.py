@@ -0,0 +1,59 @@
+"""Throughput of /query with 1, 8 and 32 concurrent clients.
+
+Start the api with the rate limit off (otherwise this only counts 429s) and the answer cache
+emptied (otherwise repeated queries measure cache hits):
+    HIGH_LIFE_RATE_LIMIT=off ANSWER_CACHE_SIZE=0 uvicorn api:app --port=8001
+    python explorations/load_benchmark.py --url http://localhost:8001/query
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+QUERIES = [
+    "seafood restaurant in Paris?",
+    "where should I stay in the south of france?",
+    "natural wine bars in Copenhagen",
+    "what can i eat in Barcelona?",
+    "recommendations for a chilled red wine",
+    "a good hotel in Tokyo",
+    "restaurant in Hong kong?",
+    "shops to visit in Zürich",
+]
+
+
+async def client(http: httpx.AsyncClient, url: str, requests_per_client: int, offset: int, latencies: list, errors: list):
+    for i in range(requests_per_client):
+        start = time.perf_counter()
+        try:
+            response = await http.post(url, json={"text": QUERIES[(offset + i) % len(QUERIES)]})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError as e:
+            errors.append(e)
+
+
+async def run(url: str, concurrency: int, requests_per_client: int):
+    latencies, errors = [], []
+    async with httpx.AsyncClient(timeout=300) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*[client(http, url, requests_per_client, i, latencies, errors)
+                               for i in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    p50 = statistics.median(latencies) if latencies else float("nan")
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else float("nan")
+    print(f"concurrency={concurrency:>3} requests={len(latencies):>4} errors={len(errors):>3} "
+          f"throughput={len(latencies) / elapsed:6.2f} req/s p50={p50:6.2f}s p95={p95:6.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8001/query")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    args = parser.parse_args()
+    for concurrency in args.concurrency:
+        asyncio.run(run(args.url, concurrency, args.requests_per_client))
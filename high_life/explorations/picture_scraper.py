@@ -2,6 +2,8 @@ import base64
 
 import requests
 
+from fetcher import fetcher
+
 # Define the image URL variable
 image_url = "https://scontent.cdninstagram.com/v/t39.30808-6/429587290_18425245873036331_9006932432805414794_n.jpg?stp=dst-jpg_e35_p1080x1080_sh0.08&_nc_ht=scontent.cdninstagram.com&_nc_cat=111&_nc_ohc=kNDdnSZJTRgAX9mpPq_&edm=APs17CUAAAAA&ccb=7-5&oh=00_AfDaTro-NfUHSy684WWtuNBeIGMmC8RGo2gdHW5biCUe-A&oe=65F3306A&_nc_sid=10d13b"  # Replace with your actual image URL
 
@@ -10,9 +12,12 @@ image_url = "https://scontent.cdninstagram.com/v/t39.30808-6/429587290_184252458
 
 
 def extract_text_from_photo(image_url):
-    response = requests.get(image_url, stream=True)
+    try:
+        response = fetcher.fetch(image_url)
+    except requests.RequestException as e:
+        print(f"Error downloading image: {e}")
+        return
 
-    # Check for successful download
     if response.status_code == 200:
         # Read the image content in binary mode
         image_data = response.content
@@ -0,0 +1,74 @@
+"""Nodes/second of instagram_util's profile extraction on a saved profile page, against the old per-sibling loop.
+
+The old loop re-read every image on the page once per sibling of <header>, so its cost grew with
+posts x rows; `extract_profile` visits each element once. No LLM is called (the bio is fixed) and nothing is
+written unless --insert is passed, which times the one batched `insert_nodes` as well.
+
+Run from high_life/:
+    python -m explorations.profile_extraction_benchmark --html saved_profile.html
+    python -m explorations.profile_extraction_benchmark --posts 300 --repeat 5
+"""
+import argparse
+import time
+
+from bs4 import BeautifulSoup
+
+from explorations.instagram_fixture_server import profile_content
+from instagram_util import build_profile_nodes, extract_profile
+from search import insert_nodes
+
+URL = "https://www.instagram.com/fixture/"
+BIO = "A chef and writer based in Lisbon."
+
+
+def old_extract(text: str) -> list[tuple[str, str]]:
+    """The image loop profile scrapes ran before `extract_profile`: (alt, href) per image per sibling."""
+    html = BeautifulSoup(text, 'html.parser')
+    found = []
+    body = html.find("header").next_sibling
+    while body:
+        for image in html.find_all("img"):
+            current_tag, post_url = image, ""
+            while current_tag.parent is not None:
+                if current_tag.get("href"):
+                    post_url = current_tag.get("href")
+                    break
+                current_tag = current_tag.parent
+            found.append((image.get("alt") or "", post_url))
+        body = body.next_sibling
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--html", help="saved profile page; a generated one otherwise")
+    parser.add_argument("--posts", type=int, default=120, help="posts on the generated page")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--insert", action="store_true")
+    args = parser.parse_args()
+    if args.html:
+        with open(args.html) as f:
+            text = f.read()
+    else:
+        text = f"<html><body>{profile_content('fixture', args.posts)}</body></html>"
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        old = old_extract(text)
+    old_seconds = (time.perf_counter() - started) / args.repeat
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        nodes = build_profile_nodes(URL, extract_profile(text), BIO)
+    new_seconds = (time.perf_counter() - started) / args.repeat
+
+    distinct = len({alt for alt, _ in old if alt})
+    print(f"old loop:  {distinct:>6} post nodes (+1 parent) {old_seconds * 1000:8.1f}ms "
+          f"{(distinct + 1) / old_seconds:10.0f} nodes/s  ({len(old)} images processed)")
+    print(f"one pass:  {len(nodes) - 1:>6} post nodes (+1 parent) {new_seconds * 1000:8.1f}ms "
+          f"{len(nodes) / new_seconds:10.0f} nodes/s")
+    if args.insert:
+        started = time.perf_counter()
+        insert_nodes(nodes)
+        seconds = time.perf_counter() - started
+        print(f"insert:    {len(nodes):>6} nodes in one batch {seconds * 1000:8.1f}ms {len(nodes) / seconds:10.0f} nodes/s")
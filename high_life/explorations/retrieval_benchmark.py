@@ -0,0 +1,62 @@
+"""Latency of the serial HyDE -> search -> LLMRerank pipeline against search.aretrieve_documents.
+
+Run from high_life/:
+    python -m explorations.retrieval_benchmark --similarity-top-k 20 --top-n 2
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from llama_index.core.indices.query.query_transform import HyDEQueryTransform
+from llama_index.core.postprocessor import LLMRerank
+
+from explorations.load_benchmark import QUERIES
+from llm_clients import llm_clients
+from search import aretrieve_documents, index
+
+
+def serial_retrieve(query_str: str, similarity_top_k: int, top_n: int):
+    """HyDE, then the search, then LLMRerank: every LLM call waits for the one before it."""
+    groq = llm_clients.groq("llama3-8b-8192", sdk_retries=True)  # LLMRerank and HyDE call it directly
+    query_bundle = HyDEQueryTransform(llm=groq, include_original=True).run(query_str)
+    retriever = index.as_retriever(similarity_top_k=similarity_top_k, vector_store_query_mode="hybrid")
+    nodes = retriever.retrieve(query_bundle)
+    return LLMRerank(llm=groq, choice_batch_size=5, top_n=top_n).postprocess_nodes(nodes, query_str=query_str)
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+async def atimed(coro) -> float:
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def concurrent_latencies(similarity_top_k: int, top_n: int) -> list[float]:
+    """Every query in one event loop, so the shared async clients aren't left bound to a loop that has closed."""
+    try:
+        return [await atimed(aretrieve_documents(query, similarity_top_k, top_n)) for query in QUERIES]
+    finally:
+        await llm_clients.aclose()
+
+
+def report(name: str, latencies: list[float]):
+    print(f"{name:<12} mean={statistics.mean(latencies):6.2f}s p50={statistics.median(latencies):6.2f}s "
+          f"max={max(latencies):6.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--similarity-top-k", type=int, default=20)
+    parser.add_argument("--top-n", type=int, default=2)
+    args = parser.parse_args()
+
+    serial = [timed(serial_retrieve, query, args.similarity_top_k, args.top_n) for query in QUERIES]
+    concurrent = asyncio.run(concurrent_latencies(args.similarity_top_k, args.top_n))
+    report("serial", serial)
+    report("concurrent", concurrent)
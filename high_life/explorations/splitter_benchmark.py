@@ -0,0 +1,56 @@
+"""Per-caption latency, tokens and cost of splitter.PropositionSplitter, packed vs. one request per caption.
+
+Each setting starts from an empty cache and is then run a second time to show every caption coming back
+from it. Point it at the stub server to measure the request count and overhead without a Groq key, or at
+Groq itself for real token counts.
+
+Run from high_life/:
+    python -m explorations.stub_llm_server --port 11500 --delay 0.8 --malformed 0.1
+    python -m explorations.splitter_benchmark --api-base http://localhost:11500/openai/v1 --pack-items 1 4 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from llm_clients import llm_clients
+from splitter import SPLITTER_MODEL, PropositionSplitter
+
+PLACES = ["Lisbon", "Copenhagen", "Kyoto", "Mexico City", "Zürich", "Naples"]
+DISHES = ["grilled sardines", "a natural wine", "hand-pulled noodles", "tacos al pastor", "an espresso"]
+
+
+def captions(count: int, seed=0) -> list[str]:
+    rng = random.Random(seed)
+    return [f"Post {i}: {rng.choice(DISHES).capitalize()} in {rng.choice(PLACES)}. "
+            f"The chef, {rng.choice(['Ana', 'Jun', 'Marco', 'Freja'])}, opened the place in {rng.randint(1990, 2023)}. "
+            f"Booking ahead is a good idea." for i in range(count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--api-base", help="OpenAI-style base url, e.g. the stub server's /openai/v1")
+    parser.add_argument("--model", default=SPLITTER_MODEL)
+    parser.add_argument("--captions", type=int, default=64)
+    parser.add_argument("--pack-items", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+    llm = llm_clients.groq(args.model, temperature=0.1, **({"api_base": args.api_base} if args.api_base else {}))
+    texts = captions(args.captions)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for pack_items in args.pack_items:
+            splitter = PropositionSplitter(llm, db_name=os.path.join(tmp, f"cache-{pack_items}.sqlite3"),
+                                           pack_items=pack_items)
+            for run in ("cold", "cached"):
+                before = splitter.stats()
+                started = time.perf_counter()
+                results = splitter.split_many(texts)
+                seconds = time.perf_counter() - started
+                stats = splitter.stats()
+                print(f"pack={pack_items:>2} {run:<6} {seconds:6.2f}s requests={stats['requests'] - before['requests']:>3} "
+                      f"repairs={stats['repairs'] - before['repairs']:>2} "
+                      f"cache_hits={stats['cache_hits'] - before['cache_hits']:>3} "
+                      f"propositions={sum(map(len, results)):>4} "
+                      f"llm_s/item={stats['llm_seconds_per_item']:.3f} tokens/item={stats['tokens_per_item']:.0f} "
+                      f"usd/item={stats['cost_usd_per_item']:.6f}")
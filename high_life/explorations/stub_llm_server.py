@@ -0,0 +1,87 @@
+"""A stand-in for Ollama and Groq that answers after a fixed delay, for exercising migrations.enrich and splitter.py.
+
+Serves Ollama's /api/chat, /api/generate and /api/show (the client asks it for the context window) and the
+OpenAI-style /openai/v1/chat/completions Groq uses. Category prompts get "... the best category is 1",
+proposition prompts (splitter.py) one proposition per sentence as JSON, everything else a short entity list.
+
+Run from high_life/:
+    python -m explorations.stub_llm_server --port 11500 --delay 0.5
+    python -m high_life.migrations.enrich --models ollama:mistral@http://localhost:11500 --concurrency 8
+"""
+import argparse
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def split_sentences(content: str) -> list[str]:
+    return [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+", content.strip()) if sentence.strip()]
+
+
+def answer(prompt: str, malformed=0.0) -> str:
+    if "categorize" in prompt:
+        return "Since the text mentions a chef, the best category is 1"
+    if "corrected JSON" in prompt:
+        broken = prompt.rsplit("\n", 1)[-1].strip()
+        return broken + ("]" if broken.startswith("[") else "}")
+    if "Decompose" in prompt:
+        inputs = prompt.rsplit("Input: ", 1)[-1].rsplit("Output:", 1)[0].strip()
+        if "Decompose each numbered" in prompt:
+            items = re.findall(r"^\s*(\d+)\. Content: (.*)$", inputs, flags=re.M)
+            output = json.dumps({number: split_sentences(content) for number, content in items})
+        else:
+            output = json.dumps(split_sentences(inputs))
+        return output[:-1] if random.random() < malformed else output  # a dropped closing bracket, now and then
+    return "gpe: Zürich, Switzerland\nperson: Johannes Gutenberg"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.5
+    malformed = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = body.get("prompt") or "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        if self.path != "/api/show":
+            time.sleep(self.delay)
+        text, model = answer(prompt, self.malformed), body.get("model", "stub")
+        if self.path == "/api/chat":
+            response = {"model": model, "created_at": "", "message": {"role": "assistant", "content": text},
+                        "done": True, "prompt_eval_count": len(prompt.split()), "eval_count": len(text.split())}
+        elif self.path == "/api/show":
+            response = {"modelfile": "", "parameters": "", "template": "", "details": {"family": "stub"},
+                        "model_info": {"stub.context_length": 8192}, "capabilities": ["completion"]}
+        elif self.path == "/api/generate":
+            response = {"model": model, "created_at": "", "response": text, "done": True}
+        elif self.path.endswith("/chat/completions"):
+            response = {"id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": text}}],
+                        "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(text.split()),
+                                  "total_tokens": len(prompt.split()) + len(text.split())}}
+        else:
+            self.send_error(404)
+            return
+        payload = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--delay", type=float, default=0.5)
+    parser.add_argument("--malformed", type=float, default=0.0, help="share of splitter answers with broken JSON")
+    args = parser.parse_args()
+    StubHandler.delay = args.delay
+    StubHandler.malformed = args.malformed
+    print(f"stub LLM on http://localhost:{args.port}, {args.delay}s per request")
+    ThreadingHTTPServer(("", args.port), StubHandler).serve_forever()
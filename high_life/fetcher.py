@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+FETCH_CACHE_DIR = os.getenv("FETCH_CACHE_DIR", "html-cache")
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "20"))
+FETCH_POOL_SIZE = int(os.getenv("FETCH_POOL_SIZE", "16"))
+FETCH_MAX_AGE = float(os.getenv("FETCH_MAX_AGE", "0"))  # seconds a cached page is served without revalidating
+FETCH_OFFLINE = os.getenv("FETCH_OFFLINE", "").lower() in ("1", "true", "yes")
+FETCH_USER_AGENT = os.getenv("FETCH_USER_AGENT", "Mozilla/5.0 (compatible; high-life-scraper)")
+
+logger = logging.getLogger(__name__)
+
+
+class FetchResult:
+    """The parts of a `requests.Response` the scrapers use, whether it came from the network or the cache."""
+
+    def __init__(self, url: str, status_code: int, content: bytes, encoding: str | None, content_type: str | None,
+                 from_cache: bool):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding or "utf-8"
+        self.content_type = content_type
+        self.from_cache = from_cache
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+
+class Fetcher:
+    """GETs through one pooled, retrying session, with every body kept in a content-addressed cache on disk.
+
+    Bodies live under `cache_dir/objects/<sha256[:2]>/<sha256>`, so identical pages are stored once, and an
+    sqlite index maps each url to its body and its ETag/Last-Modified validators. A repeat fetch sends
+    If-None-Match/If-Modified-Since and a 304 is served from disk; `offline` (or FETCH_OFFLINE) skips the
+    network for anything cached, so re-parsing after a splitter change reads only the disk. Error
+    responses aren't cached and raise `requests.HTTPError`.
+    """
+
+    def __init__(self, cache_dir=FETCH_CACHE_DIR, timeout=FETCH_TIMEOUT, pool_size=FETCH_POOL_SIZE,
+                 max_age=FETCH_MAX_AGE, offline=FETCH_OFFLINE):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.max_age = max_age
+        self.offline = offline
+        self.db_name = os.path.join(cache_dir, "index.sqlite3")
+        self.counts = {"network": 0, "not_modified": 0, "cache_hits": 0, "bytes_downloaded": 0}
+        self.lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 502, 503, 504),
+                                                allowed_methods=("GET",)))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"User-Agent": FETCH_USER_AGENT})
+
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS fetch_cache (
+                    url TEXT PRIMARY KEY,
+                    final_url TEXT,
+                    status INTEGER,
+                    sha256 TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_type TEXT,
+                    encoding TEXT,
+                    fetched_at REAL,
+                    validated_at REAL
+                )
+            """)
+
+    def _object_path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, "objects", sha256[:2], sha256)
+
+    def _read_object(self, sha256: str) -> bytes | None:
+        try:
+            with open(self._object_path(sha256), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_object(self, content: bytes) -> str:
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = self._object_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(content)
+            os.replace(tmp, path)
+        return sha256
+
+    def cached(self, url: str) -> FetchResult | None:
+        with sqlite3.connect(self.db_name) as conn:
+            row = conn.execute("SELECT final_url, status, sha256, content_type, encoding FROM fetch_cache WHERE url = ?",
+                               (url,)).fetchone()
+        if row is None or (content := self._read_object(row[2])) is None:
+            return None
+        final_url, status, _, content_type, encoding = row
+        return FetchResult(final_url, status, content, encoding, content_type, from_cache=True)
+
+    def _count(self, key: str, amount=1):
+        with self.lock:
+            self.counts[key] += amount
+
+    def fetch(self, url: str, offline: bool | None = None, max_age: float | None = None) -> FetchResult:
+        offline = self.offline if offline is None else offline
+        max_age = self.max_age if max_age is None else max_age
+        with sqlite3.connect(self.db_name) as conn:
+            entry = conn.execute("SELECT etag, last_modified, validated_at FROM fetch_cache WHERE url = ?",
+                                 (url,)).fetchone()
+        if entry is not None and (offline or time.time() - entry[2] < max_age):
+            if (hit := self.cached(url)) is not None:
+                self._count("cache_hits")
+                return hit
+
+        headers = {}
+        if entry is not None:
+            etag, last_modified, _ = entry
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        self._count("network")
+        now = time.time()
+
+        if response.status_code == 304 and (hit := self.cached(url)) is not None:
+            self._count("not_modified")
+            with sqlite3.connect(self.db_name) as conn:
+                conn.execute("UPDATE fetch_cache SET validated_at = ? WHERE url = ?", (now, url))
+            return hit
+        if response.status_code == 304:  # the body went missing from disk; ask again without validators
+            response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+
+        content = response.content
+        self._count("bytes_downloaded", len(content))
+        encoding = response.encoding or response.apparent_encoding
+        sha256 = self._write_object(content)
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("INSERT OR REPLACE INTO fetch_cache VALUES (?,?,?,?,?,?,?,?,?,?)", (
+                url, response.url, response.status_code, sha256, response.headers.get("ETag"),
+                response.headers.get("Last-Modified"), response.headers.get("Content-Type"), encoding, now, now,
+            ))
+        return FetchResult(response.url, response.status_code, content, encoding,
+                           response.headers.get("Content-Type"), from_cache=False)
+
+    def stats(self) -> dict:
+        with sqlite3.connect(self.db_name) as conn:
+            urls, objects = conn.execute("SELECT COUNT(*), COUNT(DISTINCT sha256) FROM fetch_cache").fetchone()
+        with self.lock:
+            return {**self.counts, "cached_urls": urls, "cached_objects": objects}
+
+
+fetcher = Fetcher()
+
+if __name__ == "__main__":
+    print(fetcher.stats())
@@ -1,19 +1,32 @@
+import json
+import logging
 import os
 import re
+import sqlite3
+import threading
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
 
-from bs4 import BeautifulSoup
+import urllib3.util
+from bs4 import BeautifulSoup, NavigableString
 from llama_index.core import PromptTemplate
-from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo, Document
-from llama_index.llms.groq import Groq
+from llama_index.core.schema import BaseNode, TextNode, NodeRelationship, RelatedNodeInfo, Document
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 
-from prompts import propositional_splitter
-from search import index
-from settings import hex_id
+from browser_pool import BrowserPool
+from llm_clients import llm_clients
+from scrape_queue import SCRAPING_DB
+from search import insert_nodes, retrieve_nodes
+from settings import chroma_collection, hex_id
+from splitter import splitter
+from text_index import text_hash_index
 
 
 # selenium 4
@@ -35,101 +48,199 @@ from settings import hex_id
 #         return page.content()
 
 
-def get_instagram_text(url: str):
-    driver = webdriver.Firefox()
+INSTAGRAM_BASE_URL = os.getenv("INSTAGRAM_BASE_URL", "https://www.instagram.com")
+INSTAGRAM_COOKIE_FILE = os.getenv("INSTAGRAM_COOKIE_FILE", "instagram-cookies.json")
+INSTAGRAM_PAGE_TIMEOUT = float(os.getenv("INSTAGRAM_PAGE_TIMEOUT", "20"))
+SESSION_COOKIE = "sessionid"
+# an element each kind of page only has once its content has rendered
+READY_SELECTORS = {"profile": "header", "post": "article span, main span"}
+
+profile_pattern = r'^/([a-zA-Z0-9_\.]+)/?$'
+post_pattern = r'^/p/([a-zA-Z0-9_\-]+)/?'
+reel_pattern = r'^/(reel)/([a-zA-Z0-9_\-]+)/?'
+
+logger = logging.getLogger(__name__)
+_cookie_lock = threading.Lock()
+_login_lock = threading.Lock()
+
+
+def url_kind(url: str) -> str | None:
+    """"profile", "post" (posts and reels) or None, from the url's path."""
+    path = urllib3.util.parse_url(url).path or "/"
+    if re.match(profile_pattern, path):
+        return "profile"
+    if re.match(post_pattern, path) or re.match(reel_pattern, path):
+        return "post"
+    return None
+
+
+def instagram_kind(url: str) -> str | None:
+    """`url_kind`, but only for instagram.com urls."""
+    return url_kind(url) if re.match(r'^https?://(?:www\.)?instagram\.com/', url) else None
+
+
+def save_cookies(driver: webdriver.Remote, cookie_file=INSTAGRAM_COOKIE_FILE):
+    with _cookie_lock:
+        tmp = f"{cookie_file}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(driver.get_cookies(), f)
+        os.replace(tmp, cookie_file)
+
+
+def log_in(driver: webdriver.Remote, restore=True, cookie_file=INSTAGRAM_COOKIE_FILE):
+    """Give a browser an Instagram session: the saved cookies if there are any, otherwise log in and save them.
+
+    The browser pool runs this on every browser it starts, so only the first one ever types a password.
+    """
+    with _login_lock:  # browsers starting together wait for the first login and reuse its cookies
+        driver.get(f"{INSTAGRAM_BASE_URL}/")  # cookies can only be added for the page's own domain
+        if restore and os.path.exists(cookie_file):
+            with _cookie_lock, open(cookie_file) as f:
+                cookies = json.load(f)
+            for cookie in cookies:
+                driver.add_cookie(cookie)
+            if driver.get_cookie(SESSION_COOKIE):
+                return
+
+        driver.get(f"{INSTAGRAM_BASE_URL}/accounts/login/")
+        wait = WebDriverWait(driver, INSTAGRAM_PAGE_TIMEOUT)
+        username_field = wait.until(EC.presence_of_element_located((By.NAME, "username")))
+        username_field.send_keys(os.getenv("INSTAGRAM_USERNAME"))
+        driver.find_element(By.NAME, "password").send_keys(os.getenv("INSTAGRAM_PASSWORD"))
+        driver.find_element(By.XPATH, "//button[@type='submit']").click()
+        wait.until(lambda d: d.get_cookie(SESSION_COOKIE))  # logged in once the session cookie is set
+        save_cookies(driver, cookie_file)
+
+
+browser_pool = BrowserPool(prepare=log_in)
 
-    # Navigate to the Instagram login page
-    driver.get("https://www.instagram.com/accounts/login/")
-    # Wait for the login form to be present
-    username_field = WebDriverWait(driver, 10).until(
-        EC.presence_of_element_located((By.NAME, "username"))
-    )
 
-    # Enter your Instagram credentials
-    username_field.send_keys(os.getenv("INSTAGRAM_USERNAME"))
-    password_field = driver.find_element(By.NAME, "password")
-    password_field.send_keys(os.getenv("INSTAGRAM_PASSWORD"))
-
-    # Submit the login form
-    login_button = driver.find_element(By.XPATH, "//button[@type='submit']")
-    login_button.click()
-
-    # Wait for the login process to complete and the feed to load
-    time.sleep(5)  # Adjust the delay as needed
-
-    # Navigate to the desired webpage
-    driver.get(url)
-
-    # Wait for the page to load completely
-    time.sleep(5)  # Adjust the delay as needed
-    page = driver.page_source
-    driver.quit()
-    # Get the full page source
-    return page
-
-
-def filter_instagram_by_url(url):
-    profile_pattern = r'^https?://(?:www\.)?instagram\.com/([a-zA-Z0-9_\.]+)/?$'
-    post_pattern = r'^https?://(?:www\.)?instagram\.com/p/([a-zA-Z0-9_\-]+)/?'
-    reel_pattern = r'^https?://(?:www\.)?instagram\.com/(reel)/([a-zA-Z0-9_\-]+)/?'
-    profile_match = re.match(profile_pattern, url)
-    post_match = re.match(post_pattern, url)
-    reel_match = re.match(reel_pattern, url)
-    if profile_match:
-        return profile_nodes_from_html_file(url)
-    elif post_match or reel_match:
-        return nodes_from_instagram(url)
+def wait_until_ready(driver: webdriver.Remote, kind: str | None):
+    wait = WebDriverWait(driver, INSTAGRAM_PAGE_TIMEOUT)
+    try:
+        wait.until(lambda d: d.execute_script("return document.readyState") == "complete")
+        if kind in READY_SELECTORS:
+            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, READY_SELECTORS[kind])))
+    except TimeoutException:
+        logger.warning(f"{driver.current_url} not ready after {INSTAGRAM_PAGE_TIMEOUT}s, using what has loaded")
+
+
+def get_instagram_text(url: str, pool: BrowserPool = None) -> str:
+    """The rendered html of `url`, from a logged-in browser out of the pool."""
+    pool = pool or browser_pool
+    with pool.lease() as driver:
+        driver.get(url)
+        if "/accounts/login" in driver.current_url and "/accounts/login" not in url:  # the saved session expired
+            log_in(driver, restore=False)
+            driver.get(url)
+        wait_until_ready(driver, url_kind(url))
+        return driver.page_source
+
+
+def get_instagram_pages(urls: list[str], pool: BrowserPool = None) -> dict[str, str | Exception]:
+    """Rendered html for many urls, as many at once as the pool has browsers; failures are returned, not raised."""
+    pool = pool or browser_pool
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        futures = {url: executor.submit(get_instagram_text, url, pool) for url in dict.fromkeys(urls)}
+    return {url: future.exception() or future.result() for url, future in futures.items()}
+
+
+def filter_instagram_by_url(url, text=None):
+    kind = instagram_kind(url)
+    if kind == "profile":
+        return refresh_profile(url, text)
+    elif kind == "post":
+        return nodes_from_instagram(url, text)
     else:
         return "The URL is not a valid Instagram profile or post URL."
 
 
-def profile_nodes_from_html_file(url):
-    text = get_instagram_text(url)
+def ingest_instagram_urls(urls: list[str], pool: BrowserPool = None) -> dict[str, str]:
+    """`filter_instagram_by_url` for a batch: every page is loaded through the pool first, then parsed."""
+    pages = get_instagram_pages([url for url in urls if instagram_kind(url)], pool)
+    captions = []
+    for url, page in pages.items():
+        if instagram_kind(url) == "post" and isinstance(page, str):
+            try:
+                captions.append(post_caption(page))
+            except IndexError:
+                pass  # no caption; nodes_from_instagram reports it below
+    if captions:
+        try:
+            splitter.split_many(captions)  # packed requests; the per-post splits below are then cache hits
+        except Exception:  # only a warm-up; each post still gets split (or fails) on its own below
+            logger.exception("splitting the batch's captions failed")
+    results = {}
+    for url in urls:
+        page = pages.get(url)
+        if isinstance(page, Exception):
+            logger.error(f"failed to load {url}: {page}")
+            results[url] = f"failed: {page}"
+        else:
+            results[url] = filter_instagram_by_url(url, page)
+    logger.info(f"splitter: {splitter.stats()}")
+    return results
+
+
+class ProfilePage:
+    """What a rendered profile holds: the bio's strings and its posts as (text_hash, alt text, href)."""
+
+    def __init__(self, bio_texts: list[str], posts: list[tuple[str, str, str]]):
+        self.bio_texts = bio_texts
+        self.posts = posts
+
+
+def extract_profile(text: str) -> ProfilePage:
+    """One walk over the DOM: strings inside <header> are the bio, every <img> outside it is a post.
+
+    Each element is visited once, carrying down whether it's in the header and the nearest enclosing href,
+    so a post's link needs no walk back up its parents. Posts are deduplicated by text_hash and images
+    without alt text are skipped.
+    """
     html = BeautifulSoup(text, 'html.parser')
-    stack = list(html.find("header").children)
-    bio_texts = []
+    bio_texts: list[str] = []
+    posts: dict[str, tuple[str, str, str]] = {}
+    stack = [(html, False, "")]
     while stack:
-        x = stack.pop(0)
-        try:
-            children = list(x.children)
-            stack = children + stack
-        except:
-            bio_texts.append(x.text)
+        element, in_header, href = stack.pop()
+        if isinstance(element, NavigableString):
+            if in_header and element.strip():
+                bio_texts.append(element.strip())
+            continue
+        if element.name in ("script", "style"):
+            continue
+        in_header = in_header or element.name == "header"
+        href = element.get("href") or href
+        if element.name == "img" and not in_header and (alt := (element.get("alt") or "").strip()):
+            text_hash = hex_id(alt)
+            posts.setdefault(text_hash, (text_hash, alt, href))
+        stack.extend((child, in_header, href) for child in reversed(element.contents))
+    return ProfilePage(bio_texts, list(posts.values()))
+
+
+def profile_bio(bio_texts: list[str]) -> str:
     prompt = PromptTemplate(
         "the text provided comes from an instagram bio. Please reconstruct a biographical sentence to be included with other pieces of information as part of a data application:\n{bio_text}")
-    bio = Groq(model="llama3-8b-8192", api_key=os.getenv("GROQ_API_KEY")).complete(
-        prompt.format(bio_text=bio_texts)).text
-    body = html.find("header").next_sibling
-    new_nodes = []
-    texts: list[str] = []
-    while body:
-        image_tags = html.find_all("img")
-        for i in image_tags:
-            text = i.get("alt") or ""
-            texts.append(text)
-            current_tag = i
-            post_url = ""
-            while current_tag.parent is not None:
-                if current_tag.get("href"):
-                    post_url = current_tag.get("href")
-                    break
-                else:
-                    current_tag = current_tag.parent
-
-            text_hash = hex_id(text)
-            new_node = TextNode(
-                text=text,
-                metadata={
-                    "text_hash": text_hash,
-                    "url": f"{url}{post_url.lstrip('/')}",
-                    "bio": bio
-                })
-            new_node.excluded_llm_metadata_keys = ["url", "text_hash"]
-            new_node.excluded_embed_metadata_keys = ["url", "text_hash"]
-            new_nodes.append(new_node)
-        body = body.next_sibling
-    # build parent doc
-    parent_texts = "\n".join(texts)
+    return llm_clients.complete(llm_clients.groq("llama3-8b-8192"), prompt.format(bio_text="\n".join(bio_texts))).text
+
+
+def post_node(url: str, text_hash: str, text: str, href: str, bio: str) -> TextNode:
+    new_node = TextNode(
+        text=text,
+        metadata={
+            "text_hash": text_hash,
+            "url": urljoin(url, href) if href else url,
+            "bio": bio
+        })
+    new_node.excluded_llm_metadata_keys = ["url", "text_hash"]
+    new_node.excluded_embed_metadata_keys = ["url", "text_hash"]
+    return new_node
+
+
+def build_profile_nodes(url: str, page: ProfilePage, bio: str) -> list[BaseNode]:
+    """A node per post and the parent document of them all, linked both ways; the parent comes last."""
+    new_nodes: list[BaseNode] = [post_node(url, text_hash, text, href, bio) for text_hash, text, href in page.posts]
+    parent_texts = "\n".join(text for _, text, _ in page.posts)
     parent_document = Document(
         metadata={
             "url": url,
@@ -139,21 +250,157 @@ def profile_nodes_from_html_file(url):
         text=parent_texts
     )
     parent_document.excluded_llm_metadata_keys = ["url", "text_hash"]
+    parent_document.relationships[NodeRelationship.CHILD] = [RelatedNodeInfo(node_id=new_node.node_id)
+                                                             for new_node in new_nodes]
     for new_node in new_nodes:
-        parent_document.relationships[NodeRelationship.CHILD] = RelatedNodeInfo(node_id=new_node.node_id)
         new_node.relationships[NodeRelationship.PARENT] = RelatedNodeInfo(node_id=parent_document.node_id)
+    return new_nodes + [parent_document]
+
+
+class ProfileWatermarks:
+    """What has been ingested from each profile, in scraping.db: its parent document, bio and posts seen.
+
+    `refresh_profile` checks a freshly rendered profile against this, so a re-scrape only builds and embeds
+    the posts it hasn't seen before and rewrites the parent document in place.
+    """
+
+    def __init__(self, db_name=SCRAPING_DB):
+        self.db_name = db_name
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS instagram_profiles (
+                    url TEXT PRIMARY KEY,
+                    parent_id TEXT,
+                    bio TEXT,
+                    bio_source_hash TEXT,
+                    refreshed_at REAL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS instagram_profile_posts (
+                    profile_url TEXT,
+                    text_hash TEXT,
+                    post_url TEXT,
+                    node_id TEXT,
+                    first_seen_at REAL,
+                    PRIMARY KEY (profile_url, text_hash)
+                )
+            """)
+
+    def get(self, url: str) -> tuple[dict | None, set[str]]:
+        """(profile row or None, text hashes of the posts already ingested)."""
+        with sqlite3.connect(self.db_name) as conn:
+            row = conn.execute("SELECT parent_id, bio, bio_source_hash FROM instagram_profiles WHERE url = ?",
+                               (url,)).fetchone()
+            seen = {text_hash for text_hash, in conn.execute(
+                "SELECT text_hash FROM instagram_profile_posts WHERE profile_url = ?", (url,))}
+        if row is None:
+            return None, seen
+        return {"parent_id": row[0], "bio": row[1], "bio_source_hash": row[2]}, seen
+
+    def record(self, url: str, parent_id: str, bio: str, bio_source_hash: str | None, posts: list[TextNode]):
+        now = time.time()
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("INSERT OR REPLACE INTO instagram_profiles VALUES (?,?,?,?,?)",
+                         (url, parent_id, bio, bio_source_hash, now))
+            conn.executemany("INSERT OR IGNORE INTO instagram_profile_posts VALUES (?,?,?,?,?)",
+                             [(url, node.metadata["text_hash"], node.metadata["url"], node.node_id, now)
+                              for node in posts])
+
+    def touch(self, url: str):
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("UPDATE instagram_profiles SET refreshed_at = ? WHERE url = ?", (time.time(), url))
 
-    new_nodes.append(parent_document)
-    for node in new_nodes:
-        index.insert_nodes([node])
-    return f"added {len(new_nodes)} nodes"
+    def due(self, older_than: float) -> list[str]:
+        """Profiles last refreshed more than `older_than` seconds ago."""
+        with sqlite3.connect(self.db_name) as conn:
+            return [url for url, in conn.execute("SELECT url FROM instagram_profiles WHERE refreshed_at < ?",
+                                                 (time.time() - older_than,))]
 
 
-def nodes_from_instagram(url):
-    text = get_instagram_text(url)
+profile_watermarks = ProfileWatermarks()
+
+
+def child_infos(node: BaseNode) -> list[RelatedNodeInfo]:
+    related = node.relationships.get(NodeRelationship.CHILD)
+    if related is None:
+        return []
+    return list(related) if isinstance(related, list) else [related]
+
+
+def adopt_profile(url: str, post_hashes: list[str]) -> tuple[BaseNode | None, list[BaseNode]]:
+    """The parent document of a profile scraped before there were watermarks, and the stored posts under it.
+
+    Older scrapes overwrote the parent's CHILD once per post, so the stored posts are looked up by text hash
+    and kept if their PARENT is the profile's parent document.
+    """
+    known = text_hash_index.get_nodes(post_hashes)
+    parent_ids = Counter(node.relationships[NodeRelationship.PARENT].node_id for node in known.values()
+                         if NodeRelationship.PARENT in node.relationships)
+    found = chroma_collection.get(where={"url": url}, include=["metadatas"])
+    for node_id, metadata in zip(found["ids"], found["metadatas"]):  # a parent none of whose posts are left
+        if NodeRelationship.PARENT not in metadata_dict_to_node(metadata).relationships:
+            parent_ids.setdefault(node_id, 0)
+    for parent_id, _ in parent_ids.most_common():
+        if parent := retrieve_nodes([parent_id]).get(parent_id):
+            return parent, [node for node in known.values()
+                            if NodeRelationship.PARENT in node.relationships
+                            and node.relationships[NodeRelationship.PARENT].node_id == parent_id]
+    return None, []
+
+
+def refresh_profile(url, text=None, watermarks: ProfileWatermarks = None) -> str:
+    """Scrape a profile, embedding only the posts missing from its watermark.
+
+    New posts are linked under the existing parent document, which keeps its id and gets their text
+    prepended (profiles list the newest first). The bio is only summarised again when its text changed;
+    posts ingested earlier keep the bio they were embedded with. A profile with nothing new costs the page
+    load and no LLM or embedding calls.
+    """
+    watermarks = watermarks or profile_watermarks
+    page = extract_profile(text or get_instagram_text(url))
+    bio_source_hash = hex_id("\n".join(page.bio_texts))
+    profile, seen = watermarks.get(url)
+    parent = retrieve_nodes([profile["parent_id"]]).get(profile["parent_id"]) if profile else None
+    if profile is None:
+        parent, adopted = adopt_profile(url, [text_hash for text_hash, _, _ in page.posts])
+        if parent is not None:  # watermark the legacy posts now, or the next refresh would add them again
+            profile = {"bio": parent.metadata.get("bio"), "bio_source_hash": None}
+            watermarks.record(url, parent.node_id, profile["bio"], None, adopted)
+        seen = {node.metadata["text_hash"] for node in adopted}
+
+    if parent is None:  # never scraped, or its parent document is gone: build it all
+        new_nodes = build_profile_nodes(url, page, profile_bio(page.bio_texts))
+        insert_nodes(new_nodes)
+        watermarks.record(url, new_nodes[-1].node_id, new_nodes[-1].metadata["bio"], bio_source_hash, new_nodes[:-1])
+        return f"added {len(new_nodes)} nodes"
+
+    new_posts = [post for post in page.posts if post[0] not in seen]
+    if not new_posts and bio_source_hash == profile["bio_source_hash"]:
+        watermarks.touch(url)
+        return "no new posts"
+    bio = profile["bio"] if bio_source_hash == profile["bio_source_hash"] else profile_bio(page.bio_texts)
+    new_nodes = [post_node(url, text_hash, post_text, href, bio) for text_hash, post_text, href in new_posts]
+    for new_node in new_nodes:
+        new_node.relationships[NodeRelationship.PARENT] = RelatedNodeInfo(node_id=parent.node_id)
+    parent_texts = "\n".join([post_text for _, post_text, _ in new_posts] + [parent.get_content()])
+    parent.set_content(parent_texts)
+    parent.metadata.update(bio=bio, text_hash=hex_id(parent_texts))
+    parent.relationships[NodeRelationship.CHILD] = (child_infos(parent) +
+                                                   [RelatedNodeInfo(node_id=new_node.node_id) for new_node in new_nodes])
+    insert_nodes(new_nodes + [parent])  # same parent id, so it's rewritten rather than duplicated
+    watermarks.record(url, parent.node_id, bio, bio_source_hash, new_nodes)
+    return f"added {len(new_nodes)} posts to {parent.node_id}"
+
+
+def post_caption(text: str) -> str:
     html = BeautifulSoup(text, 'html.parser')
+    return [i for i in html.find_all("span") if len(i.text.split(" ")) > 2][0].get_text(" ")
+
 
-    content = [i for i in html.find_all("span") if len(i.text.split(" ")) > 2][0].get_text(" ")
+def nodes_from_instagram(url, text=None):
+    text = text or get_instagram_text(url)
+    content = post_caption(text)
     nodes: list[TextNode] = []
     parent_document = TextNode(
         text=" ".join(content),
@@ -161,7 +408,7 @@ def nodes_from_instagram(url):
             "text_hash": hex_id(content),
             "url": url
         })
-    propositions = propositional_splitter(content)
+    propositions = splitter.split(content)
     for proposition in propositions:
         text_hash = hex_id(proposition)
         new_node = TextNode(
@@ -176,7 +423,7 @@ def nodes_from_instagram(url):
         parent_document.relationships[NodeRelationship.CHILD] = RelatedNodeInfo(node_id=new_node.node_id)
         nodes.append(new_node)
     nodes.append(parent_document)
-    index.insert_nodes(nodes)
+    insert_nodes(nodes)
     return f"added {len(nodes)} nodes"
 
 
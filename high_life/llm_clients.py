@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+import anthropic
+import httpx
+import openai
+from llama_index.core.base.llms.types import CompletionResponse
+from llama_index.core.llms import LLM
+from llama_index.llms.groq import Groq
+
+from log_sink import log_sink
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_CONCURRENCY = {
+    "anthropic": int(os.getenv("ANTHROPIC_CONCURRENCY", "8")),
+    "groq": int(os.getenv("GROQ_CONCURRENCY", "8")),
+    "default": int(os.getenv("LLM_CONCURRENCY", "8")),  # any other llama_index LLM, e.g. Settings.llm
+}
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+logger = logging.getLogger(__name__)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (anthropic.APIConnectionError, openai.APIConnectionError, httpx.TransportError)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+def backoff(attempt: int, base=0.5, cap=20.0) -> float:
+    """Full jitter: anywhere between 0 and the exponential ceiling."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def token_usage(response) -> tuple[int | None, int | None]:
+    """(input, output) tokens from an Anthropic message or the raw OpenAI-style completion under a Groq response."""
+    usage = getattr(response, "usage", None)
+    if usage is None and isinstance(raw := getattr(response, "raw", None), dict):
+        usage = raw.get("usage")
+    elif usage is None:
+        usage = getattr(raw, "usage", None)
+    if usage is None:
+        return None, None
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens", usage.get("input_tokens")), usage.get("completion_tokens", usage.get("output_tokens"))
+    return (getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", None),
+            getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", None))
+
+
+def _provider(llm: LLM) -> str:
+    return "groq" if isinstance(llm, Groq) else "default"
+
+
+def _model(llm: LLM) -> str:
+    return getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+
+
+class LLMClients:
+    """One set of LLM clients for the whole process.
+
+    Clients keep their HTTP connection pools between calls, every call goes through a per-provider concurrency
+    limit and is retried with jittered backoff on 429/5xx, and each call's latency and token counts are recorded
+    in the `llm_calls` log table and in `stats()`. The SDKs' own retries are off so these are the only ones, except
+    on Groq clients asked for with `sdk_retries=True`.
+    Sync and async callers are limited separately, since a thread semaphore can't be awaited.
+    """
+
+    def __init__(self, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES, concurrency=None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        concurrency = concurrency or LLM_CONCURRENCY
+        self._thread_limits = {provider: threading.BoundedSemaphore(n) for provider, n in concurrency.items()}
+        self._async_limits = {provider: asyncio.Semaphore(n) for provider, n in concurrency.items()}
+        self._anthropic: anthropic.AsyncAnthropic | None = None
+        self._groq: dict[tuple, Groq] = {}
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    @property
+    def anthropic_client(self) -> anthropic.AsyncAnthropic:
+        if self._anthropic is None:
+            self._anthropic = anthropic.AsyncAnthropic(
+                api_key=os.getenv("ANTHROPIC_API_KEY"),
+                max_retries=0,
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                http_client=anthropic.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=LLM_CONCURRENCY["anthropic"] * 2,
+                                        max_keepalive_connections=LLM_CONCURRENCY["anthropic"]),
+                ),
+            )
+        return self._anthropic
+
+    def groq(self, model="llama3-8b-8192", sdk_retries=False, **kwargs) -> Groq:
+        """A shared Groq client. Calls through `complete`/`acomplete` are retried here, so its own retries are off;
+        pass `sdk_retries=True` for one handed to a llama_index component (LLMRerank, HyDEQueryTransform) that
+        calls it directly, so those calls keep the SDK's default retries."""
+        key = (model, sdk_retries, tuple(sorted(kwargs.items())))
+        with self._lock:
+            if key not in self._groq:
+                self._groq[key] = Groq(model=model, api_key=os.getenv("GROQ_API_KEY"),
+                                       max_retries=openai.DEFAULT_MAX_RETRIES if sdk_retries else 0,
+                                       timeout=self.timeout, **kwargs)
+            return self._groq[key]
+
+    def start(self):
+        """Create the long-lived clients up front instead of on the first request."""
+        _ = self.anthropic_client
+        self.groq()
+
+    async def aclose(self):
+        if self._anthropic is not None:
+            await self._anthropic.close()
+            self._anthropic = None
+
+    def _record(self, provider, model, started, attempts, status, response=None, logging_id=None):
+        latency = time.perf_counter() - started
+        input_tokens, output_tokens = token_usage(response) if response is not None else (None, None)
+        with self._lock:
+            stats = self._stats[f"{provider}:{model}"]
+            stats["calls"] += 1
+            stats["errors"] += status != "ok"
+            stats["retries"] += attempts - 1
+            stats["latency"] += latency
+            stats["input_tokens"] += input_tokens or 0
+            stats["output_tokens"] += output_tokens or 0
+        log_sink.write(
+            "INSERT INTO llm_calls (logging_id, provider, model, latency, input_tokens, output_tokens, attempts, status, "
+            "created_at) VALUES (?,?,?,?,?,?,?,?,?)",
+            [(logging_id, provider, model, latency, input_tokens, output_tokens, attempts, status, time.time())]
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: {**stats, "mean_latency": stats["latency"] / stats["calls"] if stats["calls"] else 0}
+                    for name, stats in self._stats.items()}
+
+    def _call(self, provider, model, fn, logging_id=None):
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._thread_limits[provider]:
+                    response = fn()
+            except Exception as e:
+                if attempt < self.max_retries and is_retryable(e):
+                    logger.warning(f"{provider}:{model} attempt {attempt + 1} failed ({e!r}), retrying")
+                    time.sleep(backoff(attempt))
+                    continue
+                self._record(provider, model, started, attempt + 1, type(e).__name__, logging_id=logging_id)
+                raise
+            self._record(provider, model, started, attempt + 1, "ok", response, logging_id)
+            return response
+
+    async def _acall(self, provider, model, fn, logging_id=None):
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._async_limits[provider]:
+                    response = await fn()
+            except Exception as e:
+                if attempt < self.max_retries and is_retryable(e):
+                    logger.warning(f"{provider}:{model} attempt {attempt + 1} failed ({e!r}), retrying")
+                    await asyncio.sleep(backoff(attempt))
+                    continue
+                self._record(provider, model, started, attempt + 1, type(e).__name__, logging_id=logging_id)
+                raise
+            self._record(provider, model, started, attempt + 1, "ok", response, logging_id)
+            return response
+
+    def complete(self, llm: LLM, prompt: str, logging_id=None, **kwargs) -> CompletionResponse:
+        return self._call(_provider(llm), _model(llm), lambda: llm.complete(prompt, **kwargs), logging_id)
+
+    async def acomplete(self, llm: LLM, prompt: str, logging_id=None, **kwargs) -> CompletionResponse:
+        return await self._acall(_provider(llm), _model(llm), lambda: llm.acomplete(prompt, **kwargs), logging_id)
+
+    async def anthropic_message(self, request: dict, logging_id=None) -> anthropic.types.Message:
+        return await self._acall("anthropic", request["model"], lambda: self.anthropic_client.messages.create(**request),
+                                 logging_id)
+
+    @asynccontextmanager
+    async def anthropic_stream(self, request: dict, logging_id=None):
+        """`messages.stream` under the same limit; only opening the stream is retried, never a half-read one."""
+        started = time.perf_counter()
+        async with self._async_limits["anthropic"]:
+            for attempt in range(self.max_retries + 1):
+                manager = self.anthropic_client.messages.stream(**request)
+                try:
+                    stream = await manager.__aenter__()
+                except Exception as e:
+                    if attempt < self.max_retries and is_retryable(e):
+                        await asyncio.sleep(backoff(attempt))
+                        continue
+                    self._record("anthropic", request["model"], started, attempt + 1, type(e).__name__,
+                                 logging_id=logging_id)
+                    raise
+                break
+            try:
+                yield stream
+                message = await stream.get_final_message()
+            except BaseException as e:
+                await manager.__aexit__(type(e), e, e.__traceback__)
+                self._record("anthropic", request["model"], started, attempt + 1, type(e).__name__,
+                             logging_id=logging_id)
+                raise
+            await manager.__aexit__(None, None, None)
+            self._record("anthropic", request["model"], started, attempt + 1, "ok", message, logging_id)
+
+
+llm_clients = LLMClients()
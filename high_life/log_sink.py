@@ -0,0 +1,131 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from settings import DB_NAME, logging_startup
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))  # seconds
+
+logger = logging.getLogger(__name__)
+_STOP = object()
+
+
+class LogSink:
+    """Takes log rows off the request path.
+
+    Callers enqueue `(sql, rows)` and return immediately; one writer thread owns a WAL-mode connection and
+    commits whatever has queued up as a single transaction; if a constraint rejects a row, the batch is written
+    again row by row so the rest still land. When the queue is full a caller waits up to `put_timeout` seconds
+    and then the rows are dropped and counted instead of stalling the request. Whatever is still queued when
+    the process exits is flushed by an atexit hook.
+    """
+
+    def __init__(self, db_name=DB_NAME, max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, put_timeout=0.05):
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.written = self.dropped = self.errors = self.batches = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)  # scripts exit without calling close(); don't lose their rows
+
+    def write(self, sql: str, rows: list[tuple]):
+        self._ensure_started()
+        try:
+            self._queue.put((sql, rows), timeout=self.put_timeout)
+        except queue.Full:
+            self.dropped += len(rows)
+
+    def _run(self):
+        if self.db_name == DB_NAME:
+            logging_startup()  # scripts write llm_calls etc. without the api having created the tables
+        conn = sqlite3.connect(self.db_name)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            if batch:
+                self._flush(conn, batch)
+        conn.close()
+
+    def _flush(self, conn, batch):
+        grouped = defaultdict(list)
+        for sql, rows in batch:
+            grouped[sql].extend(rows)
+        try:
+            with conn:
+                for sql, rows in grouped.items():
+                    conn.executemany(sql, rows)
+            self.written += sum(len(rows) for rows in grouped.values())
+            self.batches += 1
+        except sqlite3.IntegrityError:
+            logger.warning("log sink batch rejected a row, writing it row by row", exc_info=True)
+            self._flush_rows(conn, grouped)
+        except sqlite3.Error:
+            self.errors += 1
+            logger.exception("log sink failed to write a batch")
+
+    def _flush_rows(self, conn, grouped):
+        """One statement per row, so only the rows that violate a constraint are lost."""
+        written = rejected = 0
+        try:
+            with conn:
+                for sql, rows in grouped.items():
+                    for row in rows:
+                        try:
+                            conn.execute(sql, row)
+                            written += 1
+                        except sqlite3.IntegrityError:
+                            rejected += 1
+        except sqlite3.Error:
+            self.errors += 1
+            logger.exception("log sink failed to write a batch")
+            return
+        self.written += written
+        self.errors += rejected
+        self.batches += 1
+
+    def close(self, timeout=5):
+        """Flush everything queued so far and stop the writer."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped,
+                "errors": self.errors, "batches": self.batches}
+
+
+log_sink = LogSink()
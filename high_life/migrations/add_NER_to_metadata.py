@@ -1,25 +1,22 @@
-from llama_index.core import PromptTemplate, StorageContext
-from llama_index.core.indices import VectorStoreIndex
-from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from llama_index.core import PromptTemplate
 from llama_index.llms.ollama import Ollama
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from tqdm import tqdm
 
-from high_life.settings import chroma_client, chroma_collection, hex_id
-
-
-def get_NER(query_str):
-    labels = [
-        "person",  # people, including fictional characters
-        "fac",  # buildings, airports, highways, bridges
-        "org",  # organizations, companies, agencies, institutions
-        "gpe",  # geopolitical entities like countries, cities, states
-        "loc",  # non-gpe locations
-        "product",  # vehicles, foods, appareal, appliances, software, toys
-        "event",  # named sports, scientific milestones, historical events
-        "work_of_art",  # titles of books, songs, movies
-    ]
-    prompt_template = PromptTemplate("""You are an expert in Natural Language Processing. Your task is to identify common Named Entities (NER) in a given text.
+from high_life.migrations.blue_green import migration_main
+from high_life.migrations.framework import Record
+from high_life.settings import hex_id
+
+
+NER_LABELS = [
+    "person",  # people, including fictional characters
+    "fac",  # buildings, airports, highways, bridges
+    "org",  # organizations, companies, agencies, institutions
+    "gpe",  # geopolitical entities like countries, cities, states
+    "loc",  # non-gpe locations
+    "product",  # vehicles, foods, appareal, appliances, software, toys
+    "event",  # named sports, scientific milestones, historical events
+    "work_of_art",  # titles of books, songs, movies
+]
+NER_PROMPT = PromptTemplate("""You are an expert in Natural Language Processing. Your task is to identify common Named Entities (NER) in a given text.
     The possible common Named Entities (NER) types are exclusively: ({labels}).
     If you include a city, add the country. For wine products, include the type if possible.
     EXAMPLE:
@@ -36,37 +33,25 @@ def get_NER(query_str):
     }}
     MORE INSTRUCTIONS: DO NOT provide an explanation. Give just the Named Entities only.
     My job depends on it.
-    """)
+    """).partial_format(labels=", ".join(NER_LABELS))
 
-    prompt_template = prompt_template.partial_format(labels=", ".join(labels))
+
+def get_NER(query_str):
     model = Ollama(model="mistral", temperature=0.1, timeout=500)
-    prompt = prompt_template.format(query_str=query_str)
+    prompt = NER_PROMPT.format(query_str=query_str)
     return model.complete(prompt).text
 
 
-if __name__ == "__main__":
-    metadata_version = 2
-    chroma_client.delete_collection("high_life_3")
-    new_collection = chroma_client.get_or_create_collection("high_life_3")
-    new_vector_store = ChromaVectorStore(chroma_collection=new_collection, ssl=False, stores_text=True)
-    new_storage_context = StorageContext.from_defaults(vector_store=new_vector_store)
-    new_index = VectorStoreIndex.from_vector_store(new_vector_store, storage_context=new_storage_context)
-    for i in tqdm(range(chroma_collection.count())):
-        result = chroma_collection.get(limit=1, offset=i)
-
-        # create Node
-        node = metadata_dict_to_node(result["metadatas"][0])
-        document = result['documents'][0]
-        text_hash = hex_id(document)
-        if len(new_collection.get(where={"text_hash": text_hash})["documents"]) == 0:
-            ner = get_NER(document)
-            node.set_content(document)
-            node.excluded_llm_metadata_keys = node.excluded_llm_metadata_keys + ["url", "Named Entities"]
-            node.excluded_embed_metadata_keys = ["url"]
+def add_NER(record: Record, get_entities=get_NER):
+    node = record.node
+    node.excluded_llm_metadata_keys = list(dict.fromkeys(node.excluded_llm_metadata_keys + ["url", "Named Entities"]))
+    node.excluded_embed_metadata_keys = ["url"]
+    if not node.metadata.get("Named-Entities"):
+        node.metadata.update({"Named-Entities": get_entities(record.document)})
+    node.metadata.update({"text_hash": hex_id(record.document)})
+    record.set_node(node)  # the entities are part of the embedded text
 
-            ner = {"Named-Entities": ner}
-            # print(ner)
 
-            node.metadata.update(ner)
-            node.metadata.update({"text_hash": text_hash})
-            new_index.insert_nodes([node])
+if __name__ == "__main__":
+    metadata_version = 2
+    migration_main("add_NER_to_metadata", metadata_version, add_NER)
@@ -4,9 +4,9 @@ from enum import Enum
 
 from llama_index.core import PromptTemplate
 from llama_index.llms.ollama import Ollama
-from tqdm import tqdm
 
-from high_life.settings import chroma_collection
+from high_life.migrations.blue_green import migration_main
+from high_life.migrations.framework import Record
 
 
 class Category(Enum):
@@ -25,8 +25,7 @@ class Category(Enum):
     OTHER = 13
 
 
-def get_category(query_str):
-    prompt = PromptTemplate("""You are the world's best AI assistant trained to categorize short articles or pieces of articles into predefined categories. 
+CATEGORY_PROMPT = PromptTemplate("""You are the world's best AI assistant trained to categorize short articles or pieces of articles into predefined categories. 
         Your goal is to analyze each piece of text to assign the most relevant category.
           
         Predefined Categories:  
@@ -68,9 +67,8 @@ def get_category(query_str):
         RESPONSE FORMAT: 'Since the text mentions [thing], the best category is [return one category number that best categorizes the article.]'
         """)
 
-    model = Ollama(model="mistral", temperature=0.1)
 
-    model_resp = model.complete(prompt.format(query_str=query_str), max_output=40).text
+def parse_category(model_resp: str) -> int:
     with contextlib.suppress(ValueError, IndexError):
         resp = int(re.findall(r'\d{1,2}', model_resp)[-1])
         if resp in range(1, 13 + 1):
@@ -78,13 +76,20 @@ def get_category(query_str):
     return 13
 
 
+def get_category(query_str):
+    model = Ollama(model="mistral", temperature=0.1)
+
+    model_resp = model.complete(CATEGORY_PROMPT.format(query_str=query_str), max_output=40).text
+    return parse_category(model_resp)
+
+
+def add_category(record: Record, categorize=get_category):
+    if "category" not in record.metadata:
+        category = categorize(f"{record.metadata}\n{record.document}")
+        record.metadata["category"] = Category(category).name
+
+
 if __name__ == "__main__":
     metadata_version = 1
-    for i in tqdm(range(chroma_collection.count())):
-        res = chroma_collection.get(limit=1, offset=i)
-        if "category" not in res['metadatas'][0].keys():
-            category = get_category(f"{res['metadatas'][0]}\n{res['documents'][0]}")
-            new_metadata = res["metadatas"][0]
-            new_metadata["category"] = Category(category).name
-            chroma_collection.update(ids=res["ids"], metadatas=[new_metadata])
-    # 100%|██████████| 6335/6335 [8:57:37<00:00,  5.09s/it]
+    migration_main("add_category_to_metadata", metadata_version, add_category)
+    # before paging: 100%|██████████| 6335/6335 [8:57:37<00:00,  5.09s/it]
@@ -1,7 +1,42 @@
-from high_life.settings import embed, chroma_collection
+"""(Re-)embed every row whose vector wasn't computed by the current model from its current embed-visible text.
+
+Rows carry an `embed_hash` of the model name and their EMBED content once written by `search.upsert_nodes` or
+a migration; rows from before that have none and are embedded once. Reruns skip everything already current,
+so an interrupted run just picks up where it stopped. `--force` re-embeds everything, e.g. after changing
+EMBED_BACKEND.
+"""
+import argparse
+
+from chromadb.api.models import Collection
+from tqdm import tqdm
+
+from high_life.migrations.framework import PAGE_SIZE, BatchUpdater, iter_pages, snapshot_ids
+from high_life.search import EMBED_CHUNK_SIZE, EMBED_HASH_KEY, embed_hash
+from high_life.settings import chroma_collection
+
+
+def add_embeddings(collection: Collection = chroma_collection, page_size=PAGE_SIZE, chunk_size=EMBED_CHUNK_SIZE,
+                   force=False) -> dict:
+    ids = snapshot_ids(collection)
+    skipped = 0
+    with (tqdm(total=len(ids), desc="add_embeddings") as progress,
+          BatchUpdater(collection, page_size, embed_chunk_size=chunk_size) as updater):
+        for page in iter_pages(collection, ids, page_size):
+            for record in page:
+                if force or record.metadata.get(EMBED_HASH_KEY) != embed_hash(record.node):
+                    record.reembed = True
+                    updater.add(record)
+                else:
+                    skipped += 1
+            updater.flush()
+            progress.update(len(page))
+    return {"embedded": updater.embedded, "skipped": skipped}
+
 
 if __name__ == "__main__":
-    nodes = chroma_collection.get()
-    breakpoint()
-    embeddings = embed(nodes["documents"])
-    chroma_collection.update(ids=nodes["ids"], embeddings=embeddings)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=EMBED_CHUNK_SIZE, help="texts embedded per model call")
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+    print(add_embeddings(page_size=args.page_size, chunk_size=args.chunk_size, force=args.force))
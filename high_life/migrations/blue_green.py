@@ -0,0 +1,245 @@
+"""Blue/green migrations: copy into the next collection, validate it, then switch the api over to it.
+
+The collection the api serves is named in collection-alias.json (settings.active_collection_name). A
+blue/green run leaves it alone and copies every record into high_life_N+1 instead, with the migration
+applied on the way. Stored embeddings are reused; only records whose embed-visible text the migration
+changed are embedded again. Validation compares the two collections' ids, content and relationship integrity,
+and `switch` rewrites the alias file atomically. The old collection is kept, so `rollback` is another rewrite of the same file.
+Processes pick the new name up when they restart (supervisorctl restart uvicorn).
+
+    python -m high_life.migrations.add_NER_to_metadata --blue-green --switch
+    python -m high_life.migrations.blue_green status
+    python -m high_life.migrations.blue_green validate high_life_4
+    python -m high_life.migrations.blue_green switch high_life_4
+    python -m high_life.migrations.blue_green rollback
+"""
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from chromadb.api.models import Collection
+from tqdm import tqdm
+
+from high_life.migrations.framework import (PAGE_SIZE, Checkpoint, Record, embed_records, iter_pages, migrate_record,
+                                            related_ids, run_migration, snapshot_ids)
+from high_life.settings import COLLECTION_ALIAS_FILE, active_collection_name, chroma_client, chroma_collection, hex_id
+
+SOURCE_HASH_KEY = "source_hash"  # on each copied row: content_hash of the source row it was copied from
+
+
+def next_collection_name(name: str) -> str:
+    """high_life_3 -> high_life_4."""
+    if match := re.fullmatch(r"(.*_)(\d+)", name):
+        return f"{match[1]}{int(match[2]) + 1}"
+    return f"{name}_2"
+
+
+def read_alias(alias_file=COLLECTION_ALIAS_FILE) -> dict:
+    if os.path.exists(alias_file):
+        with open(alias_file) as f:
+            return json.load(f)
+    return {"active": active_collection_name(alias_file), "previous": None, "history": []}
+
+
+def write_alias(alias: dict, alias_file=COLLECTION_ALIAS_FILE):
+    tmp = f"{alias_file}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(alias, f, indent=2)
+    os.replace(tmp, alias_file)  # readers see the old file or the new one, never half of either
+
+
+def content_hash(metadata: dict, document: str | None) -> str:
+    """A row's metadata (node text and relationships included) and document, as one hash."""
+    metadata = {key: value for key, value in (metadata or {}).items() if key != SOURCE_HASH_KEY}
+    return hex_id(f"{json.dumps(metadata, sort_keys=True, default=str)}\n{document}")
+
+
+def _source_hashes(collection: Collection, stored: bool, page_size=PAGE_SIZE * 10) -> dict[str, str | None]:
+    """id -> content_hash of every row, or with `stored` the SOURCE_HASH_KEY a copied row was stamped with."""
+    hashes = {}
+    include = ["metadatas"] if stored else ["metadatas", "documents"]
+    for offset in range(0, collection.count(), page_size):
+        result = collection.get(include=include, limit=page_size, offset=offset)
+        documents = [None] * len(result["ids"]) if stored else result["documents"]
+        for node_id, metadata, document in zip(result["ids"], result["metadatas"], documents):
+            hashes[node_id] = (metadata or {}).get(SOURCE_HASH_KEY) if stored else content_hash(metadata, document)
+    return hashes
+
+
+def diff_collections(source: Collection, target: Collection) -> tuple[list[str], list[str]]:
+    """(source ids the target lacks or copied from different content, ids only the target has)."""
+    source_hashes = _source_hashes(source, stored=False)
+    target_hashes = _source_hashes(target, stored=True)
+    changed = sorted(node_id for node_id, source_hash in source_hashes.items()
+                     if target_hashes.get(node_id) != source_hash)
+    return changed, sorted(target_hashes.keys() - source_hashes.keys())
+
+
+def copy_collection(name: str, version: int, migrate: Callable[[Record], bool | None],
+                    source: Collection = chroma_collection, target_name=None, page_size=PAGE_SIZE,
+                    restart=False, concurrency=1) -> dict:
+    """Copy `source` into `target_name` (the next high_life_N by default), applying `migrate` on the way.
+
+    Records the migration skips or fails on are copied unchanged. Each copy is stamped with the hash of the
+    source row it came from, so rows added, changed or deleted in `source` while the copy runs are caught up
+    at the end; rerunning resumes from the checkpoint.
+    """
+    target_name = target_name or next_collection_name(source.name)
+    if target_name == source.name:
+        raise ValueError(f"{target_name} is the source collection")
+    target = chroma_client.get_or_create_collection(target_name, metadata=source.metadata)
+    checkpoint = Checkpoint(f"{name}-{target_name}")
+    if restart or checkpoint.state.get("version", version) != version:
+        checkpoint.reset()
+    state = checkpoint.state
+    state.update(version=version, source=source.name, target=target_name)
+    ids = snapshot_ids(source)
+    if state["last_id"] is not None:
+        ids = [node_id for node_id in ids if node_id > state["last_id"]]
+
+    def upsert(records: list[Record]):
+        target.upsert(ids=[record.id for record in records],
+                      metadatas=[record.metadata for record in records],
+                      documents=[record.document for record in records],
+                      embeddings=[record.embedding for record in records])
+
+    def copy(ids: list[str], progress: tqdm, pool: ThreadPoolExecutor):
+        for page in iter_pages(source, ids, page_size, embeddings=True):
+            for record in page:
+                record.metadata[SOURCE_HASH_KEY] = content_hash(record.metadata, record.document)
+            outcomes = pool.map(lambda record: migrate_record(name, version, migrate, record), page)
+            for outcome in outcomes:
+                state[outcome] += 1
+                progress.update(1)
+            if unchanged := [record for record in page if not record.reembed]:
+                upsert(unchanged)
+            for chunk in embed_records([record for record in page if record.reembed]):
+                upsert(chunk)
+                state["reembedded"] = state.get("reembedded", 0) + len(chunk)
+            state["processed"] += len(page)
+            if page:
+                state["last_id"] = max(state["last_id"] or "", page[-1].id)
+            checkpoint.save()
+
+    with (tqdm(total=len(ids), desc=f"{name} -> {target_name}") as progress,
+          ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=name) as pool):
+        copy(ids, progress, pool)
+        while True:
+            changed, deleted = diff_collections(source, target)
+            if deleted:
+                target.delete(ids=deleted)
+                state["deleted"] = state.get("deleted", 0) + len(deleted)
+            if not changed:
+                break
+            progress.total += len(changed)
+            copy(changed, progress, pool)
+    return checkpoint.finish()
+
+
+def _scan(collection: Collection, page_size=PAGE_SIZE) -> tuple[set[str], set[tuple[str, str]]]:
+    """(ids, dangling) where dangling holds (node_id, related_id) pairs pointing outside the collection."""
+    ids = snapshot_ids(collection)
+    known = set(ids)
+    dangling = set()
+    for page in iter_pages(collection, ids, page_size):
+        for record in page:
+            dangling.update((record.id, related_id) for related_id in related_ids(record.node) - known)
+    return known, dangling
+
+
+def validate(target_name: str, source: Collection = chroma_collection) -> dict:
+    """Same ids, each copied from the source row as it is now, same embedding size, and no relationship the
+    source could resolve that the target can't.
+
+    SOURCE relationships point at llama_index Documents, which were never stored, so some dangling ids are
+    normal; only ones the source doesn't also have count against the target.
+    """
+    target = chroma_client.get_collection(target_name)
+    source_ids, source_dangling = _scan(source)
+    target_ids, target_dangling = _scan(target)
+    dimensions = [len(collection.get(limit=1, include=["embeddings"])["embeddings"][0]) if collection.count() else 0
+                  for collection in (source, target)]
+    new_dangling = sorted(target_dangling - source_dangling)
+    changed, _ = diff_collections(source, target)
+    stale = sorted(set(changed) & target_ids)
+    report = {
+        "source": source.name, "target": target_name,
+        "source_count": len(source_ids), "target_count": len(target_ids),
+        "missing": len(source_ids - target_ids), "extra": len(target_ids - source_ids),
+        "stale": len(stale), "stale_sample": stale[:10],
+        "source_dimensions": dimensions[0], "target_dimensions": dimensions[1],
+        "dangling": len(target_dangling), "new_dangling": len(new_dangling), "new_dangling_sample": new_dangling[:10],
+    }
+    report["ok"] = (not report["missing"] and not report["extra"] and not stale and not new_dangling
+                    and dimensions[0] == dimensions[1])
+    return report
+
+
+def switch(target_name: str, force=False, alias_file=COLLECTION_ALIAS_FILE) -> dict:
+    alias = read_alias(alias_file)
+    if target_name == alias["active"]:
+        return alias
+    if not force:
+        report = validate(target_name, chroma_client.get_collection(alias["active"]))
+        if not report["ok"]:
+            raise RuntimeError(f"{target_name} failed validation, not switching: {report}")
+    alias = {"active": target_name, "previous": alias["active"], "switched_at": time.time(),
+             "history": alias.get("history", []) + [alias["active"]]}
+    write_alias(alias, alias_file)
+    return alias
+
+
+def rollback(alias_file=COLLECTION_ALIAS_FILE) -> dict:
+    alias = read_alias(alias_file)
+    if not alias.get("previous"):
+        raise RuntimeError("nothing to roll back to")
+    chroma_client.get_collection(alias["previous"])  # fail before switching to a collection that's gone
+    alias = {"active": alias["previous"], "previous": alias["active"], "switched_at": time.time(),
+             "history": alias.get("history", []) + [alias["active"]]}
+    write_alias(alias, alias_file)
+    return alias
+
+
+def migration_main(name: str, version: int, migrate: Callable[[Record], bool | None]):
+    """Command line shared by the migrations: in place by default, or --blue-green into the next collection."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blue-green", action="store_true", help="copy into a new collection instead of updating")
+    parser.add_argument("--target", help="collection to copy into, default the next high_life_N")
+    parser.add_argument("--switch", action="store_true", help="switch to the copy if it validates")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--restart", action="store_true")
+    args = parser.parse_args()
+    if not args.blue_green:
+        print(run_migration(name, version, migrate, page_size=args.page_size, restart=args.restart))
+        return
+    report = copy_collection(name, version, migrate, target_name=args.target, page_size=args.page_size,
+                             restart=args.restart)
+    print(report)
+    print(validate(report["target"]))
+    if args.switch:
+        print(switch(report["target"]))
+        print("restart the api to serve it: supervisorctl restart uvicorn")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["status", "validate", "switch", "rollback"])
+    parser.add_argument("collection", nargs="?")
+    parser.add_argument("--force", action="store_true", help="switch without validating")
+    args = parser.parse_args()
+    if args.command == "status":
+        alias = read_alias()
+        print(alias)
+        for collection in chroma_client.list_collections():
+            collection = chroma_client.get_collection(getattr(collection, "name", collection))
+            print(f"{'*' if collection.name == alias['active'] else ' '} {collection.name:<20} {collection.count():>8}")
+    elif args.command == "validate":
+        print(validate(args.collection or next_collection_name(chroma_collection.name)))
+    elif args.command == "switch":
+        print(switch(args.collection or next_collection_name(chroma_collection.name), force=args.force))
+    else:
+        print(rollback())
@@ -1,28 +1,133 @@
-from llama_index.core.vector_stores.utils import metadata_dict_to_node
+"""Checks PARENT/CHILD/NEXT/PREVIOUS links across the whole collection in one paged scan, and fixes them.
 
+Every node is read once, the links are checked against an in-memory map of the collection, and only the
+nodes that changed are written back, a page at a time:
+
+- links to ids that aren't in the collection are dropped
+- PARENT is authoritative: a parent's CHILD becomes the list of every node naming it as PARENT (the splitters
+  overwrote CHILD once per child, so parents kept only their last one), and a child listed under a parent
+  without a PARENT of its own gets one
+- a NEXT or PREVIOUS whose other end is empty gets it filled in; pairs pointing at different nodes are
+  counted as conflicts and left alone
+
+SOURCE links point at llama_index Documents, which were never stored, and are not checked.
+
+    python -m high_life.migrations.clean_up_node_relationships --dry-run
+"""
+import argparse
+import time
+from collections import defaultdict
+
+from chromadb.api.models import Collection
+from llama_index.core.schema import BaseNode, NodeRelationship, RelatedNodeInfo
+
+from high_life.doc_groups import doc_groups
+from high_life.migrations.framework import PAGE_SIZE, BatchUpdater, Record, iter_pages, snapshot_ids
 from high_life.settings import chroma_collection
 
+LINKS = (NodeRelationship.PARENT, NodeRelationship.CHILD, NodeRelationship.NEXT, NodeRelationship.PREVIOUS)
+
+
+def _infos(node: BaseNode, relationship: NodeRelationship) -> list[RelatedNodeInfo]:
+    related = node.relationships.get(relationship)
+    if related is None:
+        return []
+    return list(related) if isinstance(related, list) else [related]
+
+
+def _ids(node: BaseNode, relationship: NodeRelationship) -> list[str]:
+    return [info.node_id for info in _infos(node, relationship)]
+
+
+def _set(node: BaseNode, relationship: NodeRelationship, infos: list[RelatedNodeInfo]):
+    if not infos:
+        node.relationships.pop(relationship, None)
+    elif relationship == NodeRelationship.CHILD:
+        node.relationships[relationship] = infos
+    else:
+        node.relationships[relationship] = infos[0]
+
+
+def check_graph(nodes: dict[str, BaseNode]) -> tuple[dict, set[str]]:
+    """Fix the links of `nodes` in place; returns (report, ids of the nodes that changed)."""
+    report = defaultdict(int)
+    changed = set()
+
+    for node_id, node in nodes.items():
+        for relationship in LINKS:
+            infos = _infos(node, relationship)
+            report[f"{relationship.name.lower()}_links"] += len(infos)
+            kept = [info for info in infos if info.node_id in nodes and info.node_id != node_id]
+            if len(kept) != len(infos):
+                report[f"dangling_{relationship.name.lower()}"] += len(infos) - len(kept)
+                _set(node, relationship, kept)
+                changed.add(node_id)
+
+    for parent_id, parent in nodes.items():
+        for child_id in _ids(parent, NodeRelationship.CHILD):
+            if not _ids(nodes[child_id], NodeRelationship.PARENT):
+                _set(nodes[child_id], NodeRelationship.PARENT, [RelatedNodeInfo(node_id=parent_id)])
+                report["missing_parent"] += 1
+                changed.add(child_id)
+
+    children = defaultdict(list)
+    for child_id, child in nodes.items():
+        for parent_id in _ids(child, NodeRelationship.PARENT):
+            children[parent_id].append(child_id)
+    for parent_id, parent in nodes.items():
+        listed = _infos(parent, NodeRelationship.CHILD)
+        expected = set(children.get(parent_id, []))
+        if {info.node_id for info in listed} == expected:
+            continue
+        kept = [info for info in listed if info.node_id in expected]
+        kept_ids = {info.node_id for info in kept}
+        added = [RelatedNodeInfo(node_id=child_id) for child_id in sorted(expected - kept_ids)]
+        report["missing_child"] += len(added)
+        report["wrong_child"] += len(listed) - len(kept)
+        _set(parent, NodeRelationship.CHILD, kept + added)
+        changed.add(parent_id)
 
-def remove_invalid_relationships():
-    # Get all the node IDs from the Chroma collection
-    node_ids = chroma_collection.get()["ids"]
-    for node_id in node_ids:
-        # Retrieve the node from the Chroma collection
-        node = chroma_collection.get(ids=node_id)
-        node = metadata_dict_to_node(node["metadatas"][0])
+    conflicts = set()
+    for relationship, opposite in ((NodeRelationship.NEXT, NodeRelationship.PREVIOUS),
+                                   (NodeRelationship.PREVIOUS, NodeRelationship.NEXT)):
+        for node_id, node in nodes.items():
+            for other_id in _ids(node, relationship):
+                back = _ids(nodes[other_id], opposite)
+                if not back:
+                    _set(nodes[other_id], opposite, [RelatedNodeInfo(node_id=node_id)])
+                    report[f"missing_{opposite.name.lower()}"] += 1
+                    changed.add(other_id)
+                elif back[0] != node_id:
+                    conflicts.add(frozenset((node_id, other_id)))
+    report["next_previous_conflicts"] = len(conflicts)
+    return dict(report), changed
 
-        # Iterate over each relationship type and related node IDs
-        for relationship_type, related_node_ids in node.relationships.items():
-            # Check if the related nodes exist in the Chroma collection
-            existing_related_node_ids = chroma_collection.get(ids=[related_node_ids.node_id])['ids']
-            # Remove the relationship if the related node doesn't exist
-            invalid_node_ids = set(related_node_ids) - set(existing_related_node_ids)
-            if invalid_node_ids:
-                node.relationships[relationship_type] = list(set(related_node_ids) - invalid_node_ids)
 
-                # Update the node in the Chroma collection
-                chroma_collection.update(ids=node_id, documents=node.text, metadatas=node.metadata)
+def remove_invalid_relationships(collection: Collection = chroma_collection, page_size=PAGE_SIZE * 4,
+                                 dry_run=False) -> dict:
+    started = time.perf_counter()
+    records: dict[str, Record] = {}
+    for page in iter_pages(collection, snapshot_ids(collection), page_size):
+        records.update((record.id, record) for record in page)
+    nodes = {node_id: record.node for node_id, record in records.items()}
+    report, changed = check_graph(nodes)
+    report.update(nodes=len(nodes), changed=len(changed), scan_seconds=time.perf_counter() - started)
+    if not dry_run:
+        with BatchUpdater(collection, page_size) as updater:
+            for node_id in sorted(changed):
+                records[node_id].set_node(nodes[node_id], reembed=False)  # links aren't part of the embedded text
+                updater.add(records[node_id])
+        if changed and collection is chroma_collection:
+            report["doc_groups"] = doc_groups.build()  # the answer documents follow the links
+    report["seconds"] = time.perf_counter() - started
+    return report
 
 
 if __name__ == "__main__":
-    remove_invalid_relationships()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="report without writing fixes")
+    args = parser.parse_args()
+    report = remove_invalid_relationships(dry_run=args.dry_run)
+    width = max(len(key) for key in report)
+    for key, value in report.items():
+        print(f"{key:<{width}} {value:.2f}" if isinstance(value, float) else f"{key:<{width}} {value}")
@@ -0,0 +1,135 @@
+"""Category and named entities for the whole collection in one concurrent pass.
+
+`get_category` and `get_NER` ask one local mistral one document at a time, ~5 s each. This runner reads
+each page once, asks for whatever a record is missing (category, entities or both) through a pool of
+models with `--concurrency` requests in flight per model and at most `--rate` requests/second each, and
+writes the page back with a single update. It stands in for running add_category_to_metadata (1) and
+add_NER_to_metadata (2) in turn, so it stamps metadata_version 2.
+
+    python -m high_life.migrations.enrich --models ollama:mistral ollama:mistral@http://gpu-box:11434 \
+        groq:llama3-8b-8192 --concurrency 4 --rate 2
+
+Model specs are provider:model[@base_url]; Ollama models without a url use OLLAMA_BASE_URL. Every call
+goes through llm_clients, so retries and LLM_CONCURRENCY apply on top of the per-model limits. Point
+the models at explorations/stub_llm_server.py to try it without a GPU.
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from llama_index.core.llms import LLM
+from llama_index.llms.ollama import Ollama
+
+from high_life.llm_clients import llm_clients
+from high_life.migrations.add_NER_to_metadata import NER_PROMPT, add_NER
+from high_life.migrations.add_category_to_metadata import CATEGORY_PROMPT, add_category, parse_category
+from high_life.migrations.framework import PAGE_SIZE, Record, run_migration
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+ENRICH_MODELS = os.getenv("ENRICH_MODELS", "ollama:mistral").split(",")
+ENRICH_CONCURRENCY = int(os.getenv("ENRICH_CONCURRENCY", "4"))  # in-flight requests per model
+ENRICH_RATE = float(os.getenv("ENRICH_RATE", "0"))  # requests/second per model, 0 for no limit
+ENRICH_TIMEOUT = float(os.getenv("ENRICH_TIMEOUT", "500"))
+
+
+def load_llm(spec: str, base_url=OLLAMA_BASE_URL, timeout=ENRICH_TIMEOUT) -> LLM:
+    provider, _, model = spec.partition(":")
+    model, _, url = model.partition("@")
+    if provider == "ollama":
+        return Ollama(model=model, base_url=url or base_url, temperature=0.1, request_timeout=timeout)
+    if provider == "groq":
+        return llm_clients.groq(model, temperature=0.1, **({"api_base": url} if url else {}))
+    raise ValueError(f"unknown provider in {spec!r}, expected ollama:<model> or groq:<model>")
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across threads; a rate of 0 never waits."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+class LLMPool:
+    """`concurrency` slots per model; each call takes whichever slot frees up first, so faster models do more."""
+
+    def __init__(self, specs: list[str], concurrency=ENRICH_CONCURRENCY, rate=ENRICH_RATE):
+        self.llms = {spec: load_llm(spec) for spec in specs}
+        self.limiters = {spec: RateLimiter(rate) for spec in specs}
+        self.workers = len(specs) * concurrency
+        self._slots = queue.Queue()
+        for _ in range(concurrency):
+            for spec in specs:
+                self._slots.put(spec)
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(float))
+
+    def complete(self, prompt: str) -> str:
+        spec = self._slots.get()
+        try:
+            self.limiters[spec].wait()
+            started = time.perf_counter()
+            try:
+                text = llm_clients.complete(self.llms[spec], prompt).text
+            except Exception:
+                with self._lock:
+                    self._stats[spec]["errors"] += 1
+                raise
+            with self._lock:
+                self._stats[spec]["calls"] += 1
+                self._stats[spec]["seconds"] += time.perf_counter() - started
+            return text
+        finally:
+            self._slots.put(spec)
+
+    def report(self, elapsed: float) -> dict:
+        with self._lock:
+            return {spec: {"calls": int(stats["calls"]), "errors": int(stats["errors"]),
+                           "mean_latency": stats["seconds"] / stats["calls"] if stats["calls"] else 0,
+                           "calls_per_minute": stats["calls"] / elapsed * 60 if elapsed else 0}
+                    for spec, stats in self._stats.items()}
+
+
+def enrich(record: Record, pool: LLMPool):
+    add_category(record, lambda query_str: parse_category(pool.complete(CATEGORY_PROMPT.format(query_str=query_str))))
+    add_NER(record, lambda query_str: pool.complete(NER_PROMPT.format(query_str=query_str)))
+
+
+def run_enrichment(specs=ENRICH_MODELS, concurrency=ENRICH_CONCURRENCY, rate=ENRICH_RATE, page_size=PAGE_SIZE,
+                   restart=False, **kwargs) -> dict:
+    pool = LLMPool(specs, concurrency, rate)
+    started = time.perf_counter()
+    state = run_migration("enrich_metadata", 2, lambda record: enrich(record, pool), page_size=page_size,
+                          restart=restart, concurrency=pool.workers, **kwargs)
+    elapsed = time.perf_counter() - started
+    return {**state, "seconds": elapsed, "documents_per_minute": state["updated"] / elapsed * 60 if elapsed else 0,
+            "models": pool.report(elapsed)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=ENRICH_MODELS)
+    parser.add_argument("--concurrency", type=int, default=ENRICH_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=ENRICH_RATE)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--restart", action="store_true")
+    args = parser.parse_args()
+    report = run_enrichment(args.models, args.concurrency, args.rate, args.page_size, args.restart)
+    print(f"updated={report['updated']} skipped={report['skipped']} failed={report['failed']} "
+          f"{report['seconds']:.1f}s {report['documents_per_minute']:.1f} documents/minute")
+    for spec, stats in report["models"].items():
+        print(f"{spec:<40} calls={stats['calls']:>6} errors={stats['errors']:>4} "
+              f"mean={stats['mean_latency']:6.2f}s {stats['calls_per_minute']:7.1f} calls/minute")
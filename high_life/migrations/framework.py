@@ -0,0 +1,236 @@
+"""Shared plumbing for metadata migrations over a chroma collection.
+
+    run_migration("add_category_to_metadata", version=1, migrate=add_category)
+
+walks the collection a page at a time, calls `migrate(record)` for every record whose `metadata_version` is
+below `version`, stamps it and writes each page back with a single `update`. Progress is checkpointed to
+high_life/migration-checkpoints/<name>.json after every page, so an interrupted run resumes where it stopped.
+Versions are cumulative and meant to be run in order: 1 category, 2 named entities, 3 text_hash exclusion.
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
+
+from chromadb.api.models import Collection
+from llama_index.core import Settings
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+from tqdm import tqdm
+
+from high_life.search import EMBED_CHUNK_SIZE, EMBED_HASH_KEY, embed_hash, stored_embed_hash, update_nodes
+from high_life.settings import DATA_DIR, chroma_collection
+
+PAGE_SIZE = int(os.getenv("MIGRATION_PAGE_SIZE", "500"))
+CHECKPOINT_DIR = os.path.join(DATA_DIR, "migration-checkpoints")
+VERSION_KEY = "metadata_version"
+
+logger = logging.getLogger(__name__)
+
+
+class Record:
+    """One chroma row. Change `metadata`/`document` directly, or edit `node` and hand it back with `set_node`."""
+
+    def __init__(self, node_id: str, metadata: dict, document: str, embedding=None):
+        self.id = node_id
+        self.metadata = dict(metadata or {})
+        self.document = document
+        self.embedding = embedding
+        self.reembed = False
+        self._node: BaseNode | None = None
+        self._stored_embed_hash: str | None = None
+
+    @property
+    def version(self) -> int:
+        return self.metadata.get(VERSION_KEY, 0)
+
+    @property
+    def node(self) -> BaseNode:
+        if self._node is None:
+            self._node = metadata_dict_to_node(self.metadata, text=self.document)
+            self._stored_embed_hash = stored_embed_hash(self.metadata, self.document)
+        return self._node
+
+    def set_node(self, node: BaseNode, reembed: bool | None = None):
+        """Serialise `node` the way ChromaVectorStore does; keys that only exist flat (category, version) are kept.
+
+        The record is re-embedded only if the node's embed-visible text changed, unless `reembed` says otherwise.
+        """
+        _ = self.node  # the stored hash is taken from the row as it was read
+        self._node = node
+        self.metadata.update(node_to_metadata_dict(node, remove_text=True, flat_metadata=False))
+        self.document = node.get_content()
+        if reembed is None:
+            reembed = embed_hash(node) != self._stored_embed_hash
+        self.reembed = self.reembed or reembed
+
+
+def snapshot_ids(collection: Collection, page_size=PAGE_SIZE * 10) -> list[str]:
+    """Every id in the collection, sorted: a cursor that doesn't move when rows are inserted or updated mid-run."""
+    ids = []
+    for offset in range(0, collection.count(), page_size):
+        ids.extend(collection.get(include=[], limit=page_size, offset=offset)["ids"])
+    return sorted(set(ids))
+
+
+def related_ids(node: BaseNode) -> set[str]:
+    """Ids of every node `node` points at, whatever the relationship type."""
+    ids = set()
+    for related in node.relationships.values():
+        for info in related if isinstance(related, list) else [related]:
+            ids.add(info.node_id)
+    return ids
+
+
+def iter_pages(collection: Collection, ids: list[str], page_size=PAGE_SIZE,
+               embeddings=False) -> Iterator[list[Record]]:
+    include = ["metadatas", "documents"] + (["embeddings"] if embeddings else [])
+    for i in range(0, len(ids), page_size):
+        result = collection.get(ids=ids[i:i + page_size], include=include)
+        stored = result["embeddings"] if embeddings else [None] * len(result["ids"])
+        records = {node_id: Record(node_id, metadata, document, embedding)
+                   for node_id, metadata, document, embedding
+                   in zip(result["ids"], result["metadatas"], result["documents"], stored)}
+        # chroma doesn't promise the order of a get(ids=...); keep the cursor order
+        yield [records[node_id] for node_id in ids[i:i + page_size] if node_id in records]
+
+
+def embed_records(records: list[Record], chunk_size=EMBED_CHUNK_SIZE) -> Iterator[list[Record]]:
+    """Embed the EMBED content of `records` `chunk_size` at a time, setting `embedding` and the embed_hash."""
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        embeddings = Settings.embed_model.get_text_embedding_batch(
+            [record.node.get_content(metadata_mode=MetadataMode.EMBED) for record in chunk]
+        )
+        for record, embedding in zip(chunk, embeddings):
+            record.embedding = embedding
+            record.metadata[EMBED_HASH_KEY] = embed_hash(record.node)
+        yield chunk
+
+
+class BatchUpdater:
+    """Collects changed records and writes them back in as few `update(ids=[...], ...)` calls as possible.
+
+    Records whose embed-visible text is unchanged go out in one metadata-only update per flush; records
+    flagged `reembed` are embedded and written `embed_chunk_size` at a time. Documents only ever go along
+    with embeddings: on their own chroma would embed them with its default function. Writes to the main
+    collection go through `search.update_nodes` so the node cache and text_hash index stay in sync.
+    """
+
+    def __init__(self, collection: Collection = chroma_collection, batch_size=PAGE_SIZE,
+                 embed_chunk_size=EMBED_CHUNK_SIZE):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.embed_chunk_size = embed_chunk_size
+        self.pending: list[Record] = []
+        self.written = self.embedded = 0
+
+    def add(self, record: Record):
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        records, self.pending = self.pending, []
+        if unchanged := [record for record in records if not record.reembed]:
+            self._update(unchanged, metadatas=[record.metadata for record in unchanged])
+        for chunk in embed_records([record for record in records if record.reembed], self.embed_chunk_size):
+            self._update(chunk, metadatas=[record.metadata for record in chunk],
+                         documents=[record.document for record in chunk],
+                         embeddings=[record.embedding for record in chunk])
+            self.embedded += len(chunk)
+        self.written += len(records)
+
+    def _update(self, records: list[Record], **kwargs):
+        ids = [record.id for record in records]
+        if self.collection is chroma_collection:
+            update_nodes(ids, **kwargs)
+        else:
+            self.collection.update(ids=ids, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+class Checkpoint:
+    def __init__(self, name: str, directory=CHECKPOINT_DIR):
+        self.path = os.path.join(directory, f"{name}.json")
+        self.state = {"name": name, "last_id": None, "processed": 0, "updated": 0, "skipped": 0, "failed": 0}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.state.update(json.load(f))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.state["saved_at"] = time.time()
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.path)  # never leaves a half-written checkpoint behind
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.state.update(last_id=None, processed=0, updated=0, skipped=0, failed=0)
+
+    def finish(self) -> dict:
+        """The final counts; the checkpoint is cleared so the next run is a full pass, not a resume past the end."""
+        state = {**self.state, "last_id": None, "finished_at": time.time()}
+        self.reset()
+        return state
+
+
+def migrate_record(name: str, version: int, migrate: Callable[[Record], bool | None], record: Record) -> str:
+    """Run `migrate` on one record and stamp it; returns "updated", "skipped" or "failed"."""
+    if record.version >= version:
+        return "skipped"
+    try:
+        if migrate(record) is False:
+            return "failed"
+    except Exception:
+        logger.exception(f"{name}: {record.id} failed")
+        return "failed"
+    record.metadata[VERSION_KEY] = version
+    return "updated"
+
+
+def run_migration(name: str, version: int, migrate: Callable[[Record], bool | None],
+                  collection: Collection = chroma_collection, page_size=PAGE_SIZE, restart=False,
+                  concurrency=1) -> dict:
+    """Apply `migrate` to every record below `version`.
+
+    `migrate` edits the record in place; returning False leaves it unstamped so the next run retries it.
+    An interrupted run resumes from its checkpoint; a completed one clears it, so the next run sees every id.
+    Exceptions count as failures for that record only. With `concurrency` > 1 the records of a page are
+    migrated on that many threads, which only pays off when `migrate` waits on something like an LLM.
+    """
+    checkpoint = Checkpoint(name)
+    if restart or checkpoint.state.get("version", version) != version:
+        checkpoint.reset()
+    checkpoint.state["version"] = version
+    ids = snapshot_ids(collection)
+    if checkpoint.state["last_id"] is not None:
+        ids = [node_id for node_id in ids if node_id > checkpoint.state["last_id"]]
+    state = checkpoint.state
+    with (tqdm(total=len(ids), desc=name) as progress, BatchUpdater(collection, page_size) as updater,
+          ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=name) as pool):
+        for page in iter_pages(collection, ids, page_size):
+            outcomes = pool.map(lambda record: migrate_record(name, version, migrate, record), page)
+            for record, outcome in zip(page, outcomes):
+                state[outcome] += 1
+                if outcome == "updated":
+                    updater.add(record)
+                progress.update(1)
+            updater.flush()
+            state["processed"] += len(page)
+            if page:
+                state["last_id"] = page[-1].id
+            checkpoint.save()
+    return checkpoint.finish()
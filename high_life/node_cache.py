@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from llama_index.core.schema import BaseNode
+
+from settings import DB_NAME
+
+NODE_CACHE_SIZE = int(os.getenv("NODE_CACHE_SIZE", "5000"))
+NODE_CACHE_BYTES = int(os.getenv("NODE_CACHE_BYTES", 64 * 1024 * 1024))
+NODE_CACHE_SYNC_INTERVAL = float(os.getenv("NODE_CACHE_SYNC_INTERVAL", "5"))
+INVALIDATION_RETENTION = 60 * 60 * 24
+
+
+def node_size(node: BaseNode) -> int:
+    """Rough in-memory footprint: the text plus the stringified metadata."""
+    return len(node.get_content()) + sum(len(str(k)) + len(str(v)) for k, v in node.metadata.items())
+
+
+class NodeCache:
+    """LRU cache of chroma nodes bounded by item count and approximate bytes.
+
+    Writers record invalidated ids in the `node_invalidations` table, so the api process drops stale
+    nodes written by the scraper or the migrations even though they run in other processes.
+    """
+
+    def __init__(self, max_items=NODE_CACHE_SIZE, max_bytes=NODE_CACHE_BYTES, db_name=DB_NAME,
+                 sync_interval=NODE_CACHE_SYNC_INTERVAL):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.db_name = db_name
+        self.sync_interval = sync_interval
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self.bytes = 0
+        self._nodes: OrderedDict[str, tuple[BaseNode, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS node_invalidations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    node_id TEXT,
+                    invalidated_at REAL
+                )
+            """)
+            self._last_invalidation = conn.execute("SELECT COALESCE(MAX(id), 0) FROM node_invalidations").fetchone()[0]
+
+    def get_many(self, node_ids) -> dict[str, BaseNode]:
+        self.sync()
+        found = {}
+        with self._lock:
+            for node_id in node_ids:
+                if node_id in self._nodes:
+                    self._nodes.move_to_end(node_id)
+                    found[node_id] = self._nodes[node_id][0]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def put_many(self, nodes: dict[str, BaseNode]):
+        with self._lock:
+            for node_id, node in nodes.items():
+                self._evict(node_id)
+                size = node_size(node)
+                if size > self.max_bytes:
+                    continue
+                self._nodes[node_id] = (node, size)
+                self.bytes += size
+            while self._nodes and (len(self._nodes) > self.max_items or self.bytes > self.max_bytes):
+                self._evict(next(iter(self._nodes)))
+                self.evictions += 1
+
+    def _evict(self, node_id) -> bool:
+        if entry := self._nodes.pop(node_id, None):
+            self.bytes -= entry[1]
+            return True
+        return False
+
+    def invalidate(self, node_ids):
+        """Drop `node_ids` here and tell every other process holding a cache to do the same."""
+        node_ids = list(node_ids)
+        with self._lock:
+            self.invalidations += sum(self._evict(node_id) for node_id in node_ids)
+        now = time.time()
+        with sqlite3.connect(self.db_name) as conn:
+            conn.executemany("INSERT INTO node_invalidations (node_id, invalidated_at) VALUES (?,?)",
+                             [(node_id, now) for node_id in node_ids])
+            conn.execute("DELETE FROM node_invalidations WHERE invalidated_at < ?", (now - INVALIDATION_RETENTION,))
+
+    def sync(self, force=False):
+        """Apply invalidations recorded by other processes, at most once per `sync_interval`."""
+        if not force and time.monotonic() - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = time.monotonic()
+        with sqlite3.connect(self.db_name) as conn:
+            rows = conn.execute("SELECT id, node_id FROM node_invalidations WHERE id > ? ORDER BY id",
+                                (self._last_invalidation,)).fetchall()
+        if rows:
+            with self._lock:
+                self.invalidations += sum(self._evict(node_id) for _, node_id in rows)
+                self._last_invalidation = rows[-1][0]
+
+    def warm(self, loader, limit=1000, batch_size=200) -> int:
+        """Preload the ids retrieved most often according to the `vector_retrieval` log table."""
+        with sqlite3.connect(self.db_name) as conn:
+            rows = conn.execute("""
+                SELECT COALESCE(node_id, json_extract(document, '$.node.id_')) AS retrieved_id, COUNT(*) AS retrievals
+                FROM vector_retrieval
+                WHERE stage IS NOT 'candidates'
+                GROUP BY retrieved_id
+                HAVING retrieved_id IS NOT NULL
+                ORDER BY retrievals DESC
+                LIMIT ?
+            """, (limit,)).fetchall()
+        node_ids = [node_id for node_id, _ in rows]
+        loaded = {}
+        for i in range(0, len(node_ids), batch_size):
+            loaded.update(loader(node_ids[i:i + batch_size]))
+        # least retrieved first, so the most popular ids are the last to be evicted
+        self.put_many({node_id: loaded[node_id] for node_id in reversed(node_ids) if node_id in loaded})
+        return len(loaded)
+
+    def stats(self) -> dict:
+        return {"items": len(self._nodes), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
@@ -1,8 +1,4 @@
-import os
-
-import dirtyjson
 from llama_index.core import PromptTemplate
-from llama_index.llms.groq import Groq
 
 accumulated_prompt = PromptTemplate("""You are an expert Q&A assistant, specializing in extracting and synthesizing the most relevant information from provided knowledge bases to answer user queries accurately and concisely.
 
@@ -82,9 +78,8 @@ In the thought process, discuss content relevance without mentioning document nu
 """
 
 
-def propositional_splitter(query_str: str):
-    prompt = PromptTemplate(
-        """Decompose the "Content" into clear and simple propositions, ensuring they are interpretable out of context.
+propositions_prompt = PromptTemplate(
+    """Decompose the "Content" into clear and simple propositions, ensuring they are interpretable out of context.
     1. Split compound sentence into simple sentences. Maintain the original phrasing from the input
     whenever possible.
     2. For any named entity that is accompanied by additional descriptive information, separate this
@@ -120,8 +115,27 @@ def propositional_splitter(query_str: str):
     ALWAYS GIVE BACK A JSON LIST
     Input: {query_str}
     Output:""")
-    prompt = prompt.format(query_str=query_str)
-    resp = Groq(model="mixtral-8x7b-32768", api_key=os.getenv("GROQ_API_KEY"), temperature=0.1).complete(prompt)
-    text = resp.text
-    text = text.replace("\\_", "_")
-    return dirtyjson.loads(text)
+
+packed_propositions_prompt = PromptTemplate(
+    """Decompose each numbered "Content" below into clear and simple propositions, ensuring they are interpretable
+    out of context, following the same rules as for a single input:
+    1. Split compound sentence into simple sentences. Maintain the original phrasing from the input
+    whenever possible.
+    2. For any named entity that is accompanied by additional descriptive information, separate this
+    information into its own distinct proposition.
+    3. Decontextualize the proposition by adding necessary modifier to nouns or entire sentences
+    and replacing pronouns (e.g., "it", "he", "she", "they", "this", "that") with the full name of the
+    entities they refer to.
+    4. Present the results as one JSON object mapping each input's number to its list of strings.
+    Input: 1. Content: Dinner at Noma in Copenhagen. The chef, René Redzepi, served reindeer moss.
+    2. Content: Sunday swim at the Badeschiff.
+    Output: {{"1": ["Someone had dinner at Noma in Copenhagen.", "René Redzepi is the chef of Noma.",
+    "René Redzepi served reindeer moss at Noma."], "2": ["Someone went for a Sunday swim at the Badeschiff."]}}
+    ALWAYS GIVE BACK ONE JSON OBJECT WITH A KEY FOR EVERY INPUT NUMBER
+    Input: {items}
+    Output:""")
+
+repair_json_prompt = PromptTemplate(
+    """The text below should have been {expected}, but it is not valid JSON of that shape. Return only the
+    corrected JSON, keeping every string as it is.
+    {output}""")
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import threading
+from itertools import chain
+from typing import TYPE_CHECKING
+
+from llama_index.core.indices.utils import default_format_node_batch_fn, default_parse_choice_select_answer_fn
+from llama_index.core.prompts.default_prompts import DEFAULT_CHOICE_SELECT_PROMPT
+from llama_index.core.schema import MetadataMode, NodeWithScore
+
+from llm_clients import llm_clients
+
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
+
+RERANKER = os.getenv("RERANKER", "llm")  # llm | cross-encoder
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "2"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "5"))
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+CROSS_ENCODER_BACKEND = os.getenv("CROSS_ENCODER_BACKEND", "torch")  # torch | onnx
+# int8 weights published alongside the model; only read with the onnx backend
+CROSS_ENCODER_ONNX_FILE = os.getenv("CROSS_ENCODER_ONNX_FILE", "onnx/model_qint8_avx512.onnx")
+
+
+def merge_results(*results: list[NodeWithScore]) -> list[NodeWithScore]:
+    best: dict[str, NodeWithScore] = {}
+    for node in chain.from_iterable(results):
+        if node.node_id not in best or (node.score or 0) > (best[node.node_id].score or 0):
+            best[node.node_id] = node
+    return sorted(best.values(), key=lambda node: node.score or 0, reverse=True)
+
+
+class LLMReranker:
+    """LLMRerank's choice-select prompt over Groq, with every batch sent concurrently and the picks merged by relevance."""
+    name = "llm"
+
+    def __init__(self, model="llama3-8b-8192", batch_size=RERANK_BATCH_SIZE):
+        self.model = model
+        self.batch_size = batch_size
+
+    def warm(self):
+        llm_clients.groq(self.model)
+
+    async def _rerank_batch(self, query_str: str, batch: list[NodeWithScore], logging_id=None) -> list[NodeWithScore]:
+        prompt = DEFAULT_CHOICE_SELECT_PROMPT.format(context_str=default_format_node_batch_fn([n.node for n in batch]),
+                                                     query_str=query_str)
+        response = await llm_clients.acomplete(llm_clients.groq(self.model), prompt, logging_id)
+        choices, relevances = default_parse_choice_select_answer_fn(response.text, len(batch))
+        return [NodeWithScore(node=batch[choice - 1].node, score=relevance)
+                for choice, relevance in zip(choices, relevances) if 1 <= choice <= len(batch)]
+
+    async def rerank(self, query_str: str, candidates: list[NodeWithScore], top_n: int = RERANK_TOP_N,
+                     logging_id=None) -> list[NodeWithScore]:
+        batches = [candidates[i:i + self.batch_size] for i in range(0, len(candidates), self.batch_size)]
+        results = await asyncio.gather(*[self._rerank_batch(query_str, batch, logging_id) for batch in batches],
+                                       return_exceptions=True)
+        reranked = merge_results(*[result for result in results if not isinstance(result, BaseException)])
+        # nothing usable came back from the LLM: fall back to vector order rather than an empty answer
+        return reranked[:top_n] or candidates[:top_n]
+
+
+class CrossEncoderReranker:
+    """Scores every (query, candidate) pair on the local CPU in a single forward pass.
+
+    Weights are downloaded once into `embeddings-cache`, like the embedding model. With
+    CROSS_ENCODER_BACKEND=onnx the int8-quantized ONNX export runs through onnxruntime instead of torch.
+    """
+    name = "cross-encoder"
+
+    def __init__(self, model_name=CROSS_ENCODER_MODEL, backend=CROSS_ENCODER_BACKEND,
+                 onnx_file=CROSS_ENCODER_ONNX_FILE, max_length=512):
+        self.model_name = model_name
+        self.backend = backend
+        self.onnx_file = onnx_file
+        self.max_length = max_length
+        self._model: "CrossEncoder | None" = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self) -> "CrossEncoder":
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder  # the default llm reranker never needs it
+
+                    model_kwargs = {"file_name": self.onnx_file} if self.backend == "onnx" else {}
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, cache_folder="embeddings-cache",
+                                               backend=self.backend, model_kwargs=model_kwargs)
+        return self._model
+
+    def warm(self):
+        self.score("warm up", ["warm up"])
+
+    def score(self, query_str: str, texts: list[str]) -> list[float]:
+        if not texts:
+            return []
+        model = self.model
+        # one request's pairs are a single batch; requests take turns rather than oversubscribing the cores
+        with self._lock:
+            scores = model.predict([(query_str, text) for text in texts], batch_size=len(texts),
+                                   show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    def rerank_sync(self, query_str: str, candidates: list[NodeWithScore], top_n: int = RERANK_TOP_N) -> list[NodeWithScore]:
+        scores = self.score(query_str, [c.node.get_content(metadata_mode=MetadataMode.EMBED) for c in candidates])
+        reranked = [NodeWithScore(node=c.node, score=score) for c, score in zip(candidates, scores)]
+        return sorted(reranked, key=lambda node: node.score, reverse=True)[:top_n]
+
+    async def rerank(self, query_str: str, candidates: list[NodeWithScore], top_n: int = RERANK_TOP_N,
+                     logging_id=None) -> list[NodeWithScore]:
+        return await asyncio.to_thread(self.rerank_sync, query_str, candidates, top_n)
+
+
+RERANKERS = {LLMReranker.name: LLMReranker, CrossEncoderReranker.name: CrossEncoderReranker}
+
+
+def get_reranker(name: str = RERANKER):
+    try:
+        return RERANKERS[name]()
+    except KeyError:
+        raise ValueError(f"unknown RERANKER {name!r}, expected one of {sorted(RERANKERS)}") from None
@@ -0,0 +1,174 @@
+import os
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import urllib3
+
+SCRAPING_DB = os.getenv("SCRAPING_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scraping.db"))
+SCRAPE_LEASE_SECONDS = float(os.getenv("SCRAPE_LEASE_SECONDS", "900"))
+SCRAPE_MAX_ATTEMPTS = int(os.getenv("SCRAPE_MAX_ATTEMPTS", "5"))
+SCRAPE_PER_HOST = int(os.getenv("SCRAPE_PER_HOST", "2"))
+SCRAPE_BACKOFF_SECONDS = float(os.getenv("SCRAPE_BACKOFF_SECONDS", "60"))
+SCRAPE_BACKOFF_CAP = 6 * 60 * 60
+
+COLUMNS = [
+    ("status", "TEXT DEFAULT 'pending'"),  # pending | running | retry | done | failed
+    ("attempts", "INTEGER DEFAULT 0"),
+    ("last_error", "TEXT"),
+    ("leased_until", "REAL"),
+    ("priority", "INTEGER DEFAULT 0"),
+    ("host", "TEXT"),
+    ("next_attempt_at", "REAL DEFAULT 0"),
+    ("updated_at", "REAL"),
+]
+
+
+def host_of(url: str) -> str:
+    return urllib3.util.parse_url(url).hostname or ""
+
+
+def retry_delay(attempts: int, base=SCRAPE_BACKOFF_SECONDS, cap=SCRAPE_BACKOFF_CAP) -> float:
+    """Doubles with every failed attempt, +-25% so a host's failures don't all come back at once."""
+    return min(cap, base * 2 ** (attempts - 1)) * random.uniform(0.75, 1.25)
+
+
+class ScrapeQueue:
+    """The `urls` table in scraping.db as a work queue.
+
+    Workers `claim` a row atomically (BEGIN IMMEDIATE, so two processes can't take the same one), which
+    leases it for `lease_seconds`; a worker that dies leaves the lease to expire and the row is claimed
+    again, unless that was its last attempt, in which case it is marked failed. Claims skip hosts that already
+    have `per_host` rows running. Failures are retried with exponential backoff until `max_attempts`, then
+    marked failed with the last error kept.
+    """
+
+    def __init__(self, db_name=SCRAPING_DB, lease_seconds=SCRAPE_LEASE_SECONDS, max_attempts=SCRAPE_MAX_ATTEMPTS,
+                 per_host=SCRAPE_PER_HOST):
+        self.db_name = db_name
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.per_host = per_host
+        self.setup()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_name, timeout=30, isolation_level=None)  # transactions are explicit
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """`connect()` for one block; sqlite3's own context manager only commits, this also closes."""
+        conn = self.connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def setup(self):
+        """Create the table, or add the queue columns to the old (url, complete) one and carry `complete` over."""
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, complete BOOLEAN)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(urls)")}
+            for column, column_type in COLUMNS:
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE urls ADD COLUMN {column} {column_type}")
+            conn.execute("UPDATE urls SET status = 'done' WHERE complete AND status = 'pending'")
+            conn.executemany("UPDATE urls SET host = ? WHERE url = ?",
+                             [(host_of(url), url) for url, in conn.execute("SELECT url FROM urls WHERE host IS NULL")])
+            conn.execute("CREATE INDEX IF NOT EXISTS urls_queue ON urls (status, next_attempt_at, priority)")
+
+    def enqueue(self, url: str, priority=0) -> bool:
+        """Add `url`; an already known url keeps its state but takes the higher priority. True if it was new."""
+        with self.connection() as conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO urls (url, complete, status, priority, host, updated_at) VALUES (?,?,?,?,?,?)",
+                (url, False, "pending", priority, host_of(url), time.time())
+            ).rowcount
+            if not inserted:
+                conn.execute("UPDATE urls SET priority = MAX(priority, ?) WHERE url = ?", (priority, url))
+        return bool(inserted)
+
+    def reschedule(self, urls, priority=0) -> int:
+        """Queue finished (or given up on) urls again, e.g. profiles due a refresh; unknown urls are enqueued."""
+        now = time.time()
+        with self.connection() as conn:
+            conn.executemany("INSERT OR IGNORE INTO urls (url, complete, status, priority, host, updated_at) "
+                             "VALUES (?,?,?,?,?,?)", [(url, False, "pending", priority, host_of(url), now) for url in urls])
+            return conn.executemany(
+                "UPDATE urls SET status = 'pending', complete = ?, attempts = 0, next_attempt_at = 0, priority = ?, "
+                "updated_at = ? WHERE url = ? AND status IN ('done', 'failed')",
+                [(False, priority, now, url) for url in urls]
+            ).rowcount
+
+    def claim(self) -> tuple[str, int] | None:
+        """Lease the most urgent runnable url whose host has a free slot; returns (url, attempt) or None."""
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # a worker that kept dying mid-scrape used up its attempts without ever reaching fail()
+            conn.execute(
+                "UPDATE urls SET status = 'failed', last_error = 'lease expired', "
+                "leased_until = NULL, updated_at = ? WHERE status = 'running' AND leased_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            # hosts at their limit are filtered here, so one host's backlog can't crowd out everyone else's
+            claimed = conn.execute("""
+                WITH running AS (
+                    SELECT host, COUNT(*) AS leases FROM urls
+                    WHERE status = 'running' AND leased_until >= ?
+                    GROUP BY host
+                )
+                SELECT url, attempts FROM urls
+                WHERE ((status IN ('pending', 'retry') AND next_attempt_at <= ?)
+                       OR (status = 'running' AND leased_until < ?))
+                  AND COALESCE((SELECT leases FROM running WHERE running.host IS urls.host), 0) < ?
+                ORDER BY priority DESC, next_attempt_at, rowid
+                LIMIT 1
+            """, (now, now, now, self.per_host)).fetchone()
+            if claimed is not None:
+                url, attempts = claimed
+                conn.execute(
+                    "UPDATE urls SET status = 'running', attempts = attempts + 1, leased_until = ?, updated_at = ? "
+                    "WHERE url = ?", (now + self.lease_seconds, now, url)
+                )
+            conn.execute("COMMIT")
+            return None if claimed is None else (claimed[0], claimed[1] + 1)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def renew(self, urls):
+        with self.connection() as conn:
+            conn.executemany("UPDATE urls SET leased_until = ? WHERE url = ? AND status = 'running'",
+                             [(time.time() + self.lease_seconds, url) for url in urls])
+
+    def complete(self, url: str):
+        with self.connection() as conn:
+            conn.execute("UPDATE urls SET status = 'done', complete = ?, leased_until = NULL, last_error = NULL, "
+                         "updated_at = ? WHERE url = ?", (True, time.time(), url))
+
+    def fail(self, url: str, error: str, attempts: int):
+        now = time.time()
+        with self.connection() as conn:
+            if attempts >= self.max_attempts:
+                conn.execute("UPDATE urls SET status = 'failed', last_error = ?, leased_until = NULL, updated_at = ? "
+                             "WHERE url = ?", (error, now, url))
+            else:
+                conn.execute("UPDATE urls SET status = 'retry', last_error = ?, leased_until = NULL, "
+                             "next_attempt_at = ?, updated_at = ? WHERE url = ?",
+                             (error, now + retry_delay(attempts), now, url))
+
+    def stats(self) -> dict:
+        with self.connection() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM urls GROUP BY status").fetchall())
+
+
+scrape_queue = ScrapeQueue()
+
+if __name__ == "__main__":
+    print(scrape_queue.stats())
@@ -1,21 +1,113 @@
-import sqlite3
+"""Scraping daemon: a pool of workers draining the scrape queue (scrape_queue.py), under supervisord.
+
+Each worker claims a url, runs `get_nodes` on it, and marks it done or failed. Failures come back after an
+exponential backoff until SCRAPE_MAX_ATTEMPTS. The main thread renews the leases of the urls in flight, so
+only a worker that died has its url claimed again, and every PROFILE_REFRESH_SECONDS it queues the
+Instagram profiles due a refresh. SIGTERM stops claiming and lets the urls in flight finish (supervisord's
+stopwaitsecs); an unfinished url is claimed again once its lease runs out.
+
+    python scraper.py           # run forever
+    python scraper.py --once    # drain what's runnable now and exit
+"""
+import argparse
+import logging
+import os
+import signal
+import threading
+import time
+import traceback
 
 from agent_splitter import get_nodes
+from instagram_util import profile_watermarks
+from scrape_queue import scrape_queue
+
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "4"))
+SCRAPE_POLL_SECONDS = float(os.getenv("SCRAPE_POLL_SECONDS", "5"))
+PROFILE_REFRESH_SECONDS = float(os.getenv("PROFILE_REFRESH_SECONDS", str(24 * 60 * 60)))  # 0 turns refreshes off
+REFRESH_PRIORITY = -1  # behind urls someone asked for
+
+logger = logging.getLogger("scraper")
 
-if __name__ == "__main__":
-    conn = sqlite3.connect("scraping.db")
-    cursor = conn.cursor()
 
-    # Query for all URLs where complete is False
-    cursor.execute('SELECT url FROM urls WHERE complete = ?', (False,))
-    incomplete_urls = cursor.fetchall()
+def schedule_profile_refreshes(queue=scrape_queue, older_than=PROFILE_REFRESH_SECONDS) -> int:
+    """Queue the profiles not refreshed for `older_than` seconds again; `refresh_profile` only ingests new posts."""
+    return queue.reschedule(profile_watermarks.due(older_than), priority=REFRESH_PRIORITY)
 
-    for (url,) in incomplete_urls:
-        # Assuming get_nodes(url) is defined elsewhere
-        get_nodes(url)
 
-        # Update the URL as complete
-        cursor.execute('UPDATE urls SET complete = ? WHERE url = ?', (True, url))
-        conn.commit()
+class Scraper:
+    def __init__(self, queue=scrape_queue, workers=SCRAPE_WORKERS, poll_seconds=SCRAPE_POLL_SECONDS, scrape=get_nodes,
+                 refresh_every=PROFILE_REFRESH_SECONDS):
+        self.queue = queue
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.scrape = scrape
+        self.refresh_every = refresh_every
+        self.stopping = threading.Event()
+        self.in_flight: set[str] = set()
+        self.lock = threading.Lock()
+        self.counts = {"done": 0, "failed": 0}
 
-    conn.close()
+    def work(self, once=False):
+        while not self.stopping.is_set():
+            claimed = self.queue.claim()
+            if claimed is None:
+                if once:
+                    return
+                self.stopping.wait(self.poll_seconds)
+                continue
+            url, attempt = claimed
+            with self.lock:
+                self.in_flight.add(url)
+            started = time.perf_counter()
+            try:
+                self.scrape(url)
+            except Exception as e:
+                self.queue.fail(url, f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}", attempt)
+                with self.lock:
+                    self.counts["failed"] += 1
+                logger.warning(f"scrape failed (attempt {attempt}) {url}: {e}")
+            else:
+                self.queue.complete(url)
+                with self.lock:
+                    self.counts["done"] += 1
+                logger.info(f"scraped {url} in {time.perf_counter() - started:.1f}s")
+            finally:
+                with self.lock:
+                    self.in_flight.discard(url)
+
+    def run(self, once=False) -> dict:
+        threads = [threading.Thread(target=self.work, args=(once,), name=f"scraper-{i}", daemon=True)
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        renew_every = max(1.0, self.queue.lease_seconds / 3)
+        refreshed_at = None
+        while any(thread.is_alive() for thread in threads):
+            if self.refresh_every and (refreshed_at is None or time.monotonic() - refreshed_at >= self.refresh_every):
+                refreshed_at = time.monotonic()
+                if scheduled := schedule_profile_refreshes(self.queue, self.refresh_every):
+                    logger.info(f"queued {scheduled} profiles for a refresh")
+            for thread in threads:
+                thread.join(timeout=renew_every / len(threads))
+            with self.lock:
+                in_flight = list(self.in_flight)
+            if in_flight:
+                self.queue.renew(in_flight)
+        return self.counts
+
+    def stop(self, *_):
+        logger.info("scraper stopping after the urls in flight")
+        self.stopping.set()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(threadName)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true", help="exit once nothing is runnable")
+    parser.add_argument("--workers", type=int, default=SCRAPE_WORKERS)
+    args = parser.parse_args()
+    scraper = Scraper(workers=args.workers)
+    signal.signal(signal.SIGTERM, scraper.stop)
+    signal.signal(signal.SIGINT, scraper.stop)
+    logger.info(f"scraper started with {args.workers} workers: {scrape_queue.stats()}")
+    print(scraper.run(once=args.once), scrape_queue.stats())
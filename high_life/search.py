@@ -1,88 +1,294 @@
-import functools
+import asyncio
 import os
-import sqlite3
 from collections import OrderedDict
 
-from llama_index.core import VectorStoreIndex
-from llama_index.core.indices.query.query_transform import HyDEQueryTransform
-from llama_index.core.postprocessor import LLMRerank
-from llama_index.core.schema import BaseNode, NodeWithScore, NodeRelationship
-from llama_index.core.vector_stores.utils import metadata_dict_to_node
-from llama_index.llms.groq import Groq
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.prompts.default_prompts import DEFAULT_HYDE_PROMPT
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore, NodeRelationship, QueryBundle
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+from tqdm import tqdm
 
-from settings import vector_store, storage_context, chroma_collection
+from doc_groups import doc_groups, links
+from llm_clients import llm_clients
+from log_sink import log_sink
+from node_cache import NodeCache
+from rerankers import RERANK_TOP_N, get_reranker, merge_results
+from settings import vector_store, storage_context, chroma_collection, hex_id
+from text_index import text_hash_index
+
+SIMILARITY_TOP_K = int(os.getenv("SIMILARITY_TOP_K", "20"))
+EMBED_CHUNK_SIZE = int(os.getenv("EMBED_CHUNK_SIZE", "64"))  # nodes embedded and written per round trip
+EMBED_HASH_KEY = "embed_hash"
 
 index = VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
 
-hyde_vector_retriever = index.as_retriever(similarity_top_k=20,
-                                           node_postprocessors=[
-                                               LLMRerank(
-                                                   llm=Groq(model="llama3-8b-8192", api_key=os.getenv("GROQ_API_KEY")),
-                                                   choice_batch_size=5,
-                                                   top_n=2,
-                                               ),
-                                           ],
-                                           vector_store_query_mode="hybrid",
-                                           query_transform=HyDEQueryTransform(
-                                               llm=Groq(model="llama3-8b-8192", api_key=os.getenv("GROQ_API_KEY")),
-                                               include_original=True, )
-                                           )
-
-
-@functools.cache
+node_cache = NodeCache()
+reranker = get_reranker()
+
+
 def retrieve_node(node_id):
-    result = chroma_collection.get(ids=node_id)
-    try:
-        node = metadata_dict_to_node(result["metadatas"][0])
-    except IndexError:
-        return None
-    node.set_content(result["documents"][0])
-    return node
-
-
-def log_retrieval(logging_id, nodes: list[NodeWithScore]):
-    # Connect to or create the database
-    with sqlite3.connect('logs.sqlite3') as conn:  # Replace with your database name
-        cursor = conn.cursor()
-        return cursor.executemany(
-            "INSERT INTO vector_retrieval (logging_id, document) VALUES (?, ?)",
-            [(logging_id, i.json()) for i in nodes]
-        )
-
-
-def retrieve_documents(query_str: str):
-    return hyde_vector_retriever.retrieve(query_str)
-
-
-def traverse_nodes(start_node, relationship):
-    """Helper function to traverse nodes in a given direction."""
-    nodes = []
-    current_node = start_node
-    while current_node.relationships.get(relationship):
-        next_node_id = current_node.relationships.get(relationship).node_id
-        next_node = retrieve_node(next_node_id)
-        if not next_node:
-            break
-        nodes.append(next_node)
-        current_node = next_node
+    return cached_nodes([node_id]).get(node_id)
+
+
+def embed_hash(node: BaseNode) -> str:
+    """What a vector is computed from: the embedding model and the node's embed-visible text."""
+    return hex_id(f"{Settings.embed_model.model_name}\n{node.get_content(metadata_mode=MetadataMode.EMBED)}")
+
+
+def stored_embed_hash(metadata: dict, document: str) -> str:
+    """The embed_hash a row was written with. Rows from before it was recorded are assumed to match their own
+    text under the current model, which holds as long as the model hasn't changed since they were written."""
+    return metadata.get(EMBED_HASH_KEY) or embed_hash(metadata_dict_to_node(metadata, text=document))
+
+
+def upsert_nodes(nodes: list[BaseNode], collection=chroma_collection, chunk_size=EMBED_CHUNK_SIZE,
+                 progress=False) -> dict:
+    """Write `nodes` like `index.insert_nodes`, but only embed the ones whose embed-visible text changed.
+
+    Nodes already stored with the same embed_hash (only flat or embed-excluded metadata changed) keep their
+    vectors and get a metadata-only update. The rest are embedded and upserted `chunk_size` at a time, so at
+    most one chunk of texts and vectors is held in memory.
+    """
+    counts = {"embedded": 0, "reused": 0}
+    for start in tqdm(range(0, len(nodes), chunk_size), disable=not progress, desc="upsert"):
+        chunk = nodes[start:start + chunk_size]
+        stored = collection.get(ids=[node.node_id for node in chunk], include=["metadatas", "documents"])
+        stored_hashes = {node_id: stored_embed_hash(metadata, document)
+                         for node_id, metadata, document in zip(stored["ids"], stored["metadatas"], stored["documents"])}
+        hashes = [embed_hash(node) for node in chunk]
+        metadatas = [{**node_to_metadata_dict(node, remove_text=True, flat_metadata=True), EMBED_HASH_KEY: h}
+                     for node, h in zip(chunk, hashes)]
+        reuse = [i for i, (node, h) in enumerate(zip(chunk, hashes)) if stored_hashes.get(node.node_id) == h]
+        embed = sorted(set(range(len(chunk))) - set(reuse))
+        if reuse:
+            collection.update(ids=[chunk[i].node_id for i in reuse], metadatas=[metadatas[i] for i in reuse])
+        if embed:
+            embeddings = Settings.embed_model.get_text_embedding_batch(
+                [chunk[i].get_content(metadata_mode=MetadataMode.EMBED) for i in embed]
+            )
+            collection.upsert(ids=[chunk[i].node_id for i in embed], embeddings=embeddings,
+                              metadatas=[metadatas[i] for i in embed],
+                              documents=[chunk[i].get_content() for i in embed])
+        counts["reused"] += len(reuse)
+        counts["embedded"] += len(embed)
+    node_cache.invalidate(node.node_id for node in nodes)
+    if collection is chroma_collection:
+        text_hash_index.add(nodes)
+        doc_groups.refresh(nodes, retrieve_nodes)
+    return counts
+
+
+def insert_nodes(nodes: list[BaseNode], target_index: VectorStoreIndex = index):
+    """`index.insert_nodes` that also invalidates the cached copies of `nodes` and records their text hashes.
+
+    Nodes for the main index go through `upsert_nodes`, so re-inserting a node that is already stored only
+    re-embeds it when its embed-visible text changed.
+    """
+    if target_index is index:
+        upsert_nodes(nodes)
+        return
+    target_index.insert_nodes(nodes)
+    node_cache.invalidate(node.node_id for node in nodes)
+
+
+def _stored_links(node_ids: list[str]) -> dict[str, dict]:
+    result = chroma_collection.get(ids=node_ids, include=["metadatas"])
+    return {node_id: links(metadata_dict_to_node(metadata))
+            for node_id, metadata in zip(result["ids"], result["metadatas"]) if metadata and "_node_content" in metadata}
+
+
+def update_nodes(ids: list[str], **kwargs):
+    """`chroma_collection.update` that also invalidates the cached copies of `ids`, re-indexes their text hashes
+    and recomputes the document groups around the nodes whose relationships changed."""
+    metadatas = kwargs.get("metadatas") or []
+    nodes = {node_id: metadata_dict_to_node(metadata) for node_id, metadata in zip(ids, metadatas)
+             if metadata and "_node_content" in metadata}
+    before = _stored_links(list(nodes)) if nodes else {}
+    chroma_collection.update(ids=ids, **kwargs)
+    node_cache.invalidate(ids)
+    text_hash_index.add_pairs([(metadata["text_hash"], node_id) for node_id, metadata in zip(ids, metadatas)
+                               if metadata and metadata.get("text_hash")])
+    # metadata-only migrations rewrite every node's _node_content with the same links; skip those
+    if relinked := [node for node_id, node in nodes.items() if before.get(node_id) != links(node)]:
+        doc_groups.refresh(relinked, retrieve_nodes)
+
+
+def log_retrieval(logging_id, nodes: list[NodeWithScore], stage: str | None = None):
+    """`stage` is "candidates" for the pre-rerank list, otherwise the name of the reranker that picked `nodes`."""
+    stage = stage or reranker.name
+    log_sink.write(
+        "INSERT INTO vector_retrieval (logging_id, node_id, score, rank, stage) VALUES (?, ?, ?, ?, ?)",
+        [(logging_id, node.node_id, node.score, rank, stage) for rank, node in enumerate(nodes)]
+    )
+
+
+async def aretrieve_documents(query_str: str, similarity_top_k: int = SIMILARITY_TOP_K, top_n: int = RERANK_TOP_N,
+                              logging_id=None) -> list[NodeWithScore]:
+    """HyDE retrieval followed by the RERANKER stage, with the LLM calls overlapped instead of run back to back.
+
+    The plain-query vector search starts straight away while Groq writes the hypothetical document, the
+    HyDE search (hypothetical document + original query, as HyDEQueryTransform(include_original=True) does)
+    follows, and the merged candidates are logged and handed to `reranker`.
+    """
+    original_search = asyncio.create_task(asyncio.to_thread(vector_search, QueryBundle(query_str), similarity_top_k))
+    hypothetical = await llm_clients.acomplete(llm_clients.groq("llama3-8b-8192"),
+                                               DEFAULT_HYDE_PROMPT.format(context_str=query_str), logging_id)
+    hyde_bundle = QueryBundle(query_str, custom_embedding_strs=[hypothetical.text, query_str])
+    hyde_results = await asyncio.to_thread(vector_search, hyde_bundle, similarity_top_k)
+    candidates = merge_results(await original_search, hyde_results)[:similarity_top_k]
+    if logging_id:
+        log_retrieval(logging_id, candidates, stage="candidates")
+    return await reranker.rerank(query_str, candidates, top_n, logging_id=logging_id)
+
+
+def vector_search(query_bundle: QueryBundle, similarity_top_k: int) -> list[NodeWithScore]:
+    # ChromaVectorStore.aquery and HuggingFaceEmbedding's async methods just call their sync versions,
+    # so the search runs on a worker thread rather than through `aretrieve`.
+    retriever = index.as_retriever(similarity_top_k=similarity_top_k, vector_store_query_mode="hybrid")
+    return retriever.retrieve(query_bundle)
+
+
+def retrieve_nodes(node_ids: list[str]) -> dict[str, BaseNode]:
+    """Fetch many nodes in a single round trip to chroma."""
+    result = chroma_collection.get(ids=node_ids)
+    nodes = {}
+    for node_id, metadata, document in zip(result["ids"], result["metadatas"], result["documents"]):
+        node = metadata_dict_to_node(metadata)
+        node.set_content(document)
+        nodes[node_id] = node
     return nodes
 
 
-def gather_nodes_recursively(docs: list[NodeWithScore]) -> dict[str, list[BaseNode]]:
-    contents = OrderedDict()
-    for node in docs:
-        new_node = node.node
-        if parent_node := new_node.relationships.get(NodeRelationship.PARENT):
-            if retrieved_parent_node := retrieve_node(parent_node.node_id):
-                contents[parent_node.node_id] = [retrieved_parent_node]
+def cached_nodes(node_ids: list[str]) -> dict[str, BaseNode]:
+    nodes = node_cache.get_many(node_ids)
+    if missing := [node_id for node_id in node_ids if node_id not in nodes]:
+        loaded = retrieve_nodes(missing)
+        node_cache.put_many(loaded)
+        nodes.update(loaded)
+    return nodes
+
+
+class NodeFetcher:
+    """Fetches nodes a whole frontier at a time and remembers every node (or miss) it has already seen."""
+
+    def __init__(self):
+        self.nodes: dict[str, BaseNode | None] = {}
+        self.round_trips = 0
+
+    def fetch(self, node_ids):
+        missing = [node_id for node_id in dict.fromkeys(node_ids) if node_id not in self.nodes]
+        found = node_cache.get_many(missing)
+        if remaining := [node_id for node_id in missing if node_id not in found]:
+            self.round_trips += 1
+            loaded = retrieve_nodes(remaining)
+            node_cache.put_many(loaded)
+            found.update(loaded)
+        self.nodes.update({node_id: found.get(node_id) for node_id in missing})
+
+    def get(self, node_id) -> BaseNode | None:
+        return self.nodes.get(node_id)
+
+
+def _related_id(node: BaseNode, relationship: NodeRelationship) -> str | None:
+    related = node.relationships.get(relationship)
+    return related.node_id if related else None
+
+
+class _Chain:
+    """PREVIOUS/NEXT walk outwards from one retrieved node."""
+
+    def __init__(self, node: BaseNode):
+        self.node = node
+        self.previous: list[BaseNode] = []
+        self.next: list[BaseNode] = []
+        self.seen = {node.node_id}
+        self.frontier = {NodeRelationship.PREVIOUS: _related_id(node, NodeRelationship.PREVIOUS),
+                         NodeRelationship.NEXT: _related_id(node, NodeRelationship.NEXT)}
+
+    def pending(self) -> list[str]:
+        return [node_id for node_id in self.frontier.values() if node_id]
+
+    def advance(self, fetcher: NodeFetcher):
+        for relationship, node_id in self.frontier.items():
+            if not node_id:
+                continue
+            node = fetcher.get(node_id)
+            if node is None or node_id in self.seen:
+                self.frontier[relationship] = None
                 continue
-        if previous_nodes := traverse_nodes(
-                new_node, NodeRelationship.PREVIOUS
-        ):
-            new_node = previous_nodes[-1]
-        _contents = [new_node] + traverse_nodes(new_node, NodeRelationship.NEXT)
-        contents[_contents[0].node_id] = _contents
+            self.seen.add(node_id)
+            (self.previous if relationship == NodeRelationship.PREVIOUS else self.next).append(node)
+            self.frontier[relationship] = _related_id(node, relationship)
+
+    def nodes(self) -> list[BaseNode]:
+        return self.previous[::-1] + [self.node] + self.next
+
+
+def _group_current(hit: BaseNode, members: list[str], fetcher: NodeFetcher) -> bool:
+    """Whether a stored group is still what walking from `hit` would give: its parent if it has one, otherwise
+    a chain through it whose head has no PREVIOUS and whose tail has no NEXT left to follow."""
+    parent_id = _related_id(hit, NodeRelationship.PARENT)
+    if parent_id and fetcher.get(parent_id):
+        return members == [parent_id]
+    if hit.node_id not in members:
+        return False
+    before = _related_id(fetcher.get(members[0]), NodeRelationship.PREVIOUS)
+    after = _related_id(fetcher.get(members[-1]), NodeRelationship.NEXT)
+    return all(not node_id or node_id in members or fetcher.get(node_id) is None for node_id in (before, after))
 
+
+def gather_nodes_recursively(docs: list[NodeWithScore], fetcher: NodeFetcher | None = None) -> dict[str, list[BaseNode]]:
+    """Expand each retrieved node into its answer document.
+
+    A node with a retrievable PARENT becomes that parent; otherwise it becomes its whole PREVIOUS/NEXT chain.
+    Hits with a precomputed group in `doc_groups` take their members from it, fetched in one round trip.
+    The rest are walked together, one `chroma_collection.get` per hop, so the number of round trips is the
+    length of the longest chain rather than the sum of all of them.
+    """
+    fetcher = fetcher or NodeFetcher()
+    hits = [doc.node for doc in docs]
+    for hit in hits:
+        fetcher.nodes.setdefault(hit.node_id, hit)
+    materialised = doc_groups.lookup([hit.node_id for hit in hits])
+    fetcher.fetch([member_id for members in materialised.values() for member_id in members] +
+                  list(filter(None, [_related_id(hit, NodeRelationship.PARENT) for hit in hits])))
+    # a group whose members aren't all there any more is stale; those hits are walked instead
+    materialised = {node_id: members for node_id, members in materialised.items()
+                    if all(fetcher.get(member_id) for member_id in members)}
+    # and so is one with a parent the hit now has, or a chain that goes on past either end
+    ends = [(fetcher.get(members[0]), fetcher.get(members[-1])) for members in materialised.values()]
+    fetcher.fetch(filter(None, [_related_id(head, NodeRelationship.PREVIOUS) for head, _ in ends] +
+                               [_related_id(tail, NodeRelationship.NEXT) for _, tail in ends]))
+    materialised = {node_id: members for node_id, members in materialised.items()
+                    if _group_current(fetcher.get(node_id), members, fetcher)}
+    walked = [hit for hit in hits if hit.node_id not in materialised]
+    # parents and the first hop of every chain go out together
+    fetcher.fetch(filter(None, [_related_id(hit, relationship) for hit in walked
+                                for relationship in (NodeRelationship.PARENT,
+                                                     NodeRelationship.PREVIOUS,
+                                                     NodeRelationship.NEXT)]))
+
+    groups: list[tuple[str, list[BaseNode]] | _Chain] = []
+    for hit in hits:
+        parent_id = _related_id(hit, NodeRelationship.PARENT)
+        if hit.node_id in materialised:
+            members = materialised[hit.node_id]
+            groups.append((members[0], [fetcher.get(member_id) for member_id in members]))
+        elif parent_id and (parent := fetcher.get(parent_id)):
+            groups.append((parent_id, [parent]))
+        else:
+            groups.append(_Chain(hit))
+
+    chains = [group for group in groups if isinstance(group, _Chain)]
+    while frontier := [node_id for chain in chains for node_id in chain.pending()]:
+        fetcher.fetch(frontier)
+        for chain in chains:
+            chain.advance(fetcher)
+
+    contents = OrderedDict()
+    for group in groups:
+        node_id, nodes = group if isinstance(group, tuple) else (None, group.nodes())
+        contents[node_id or nodes[0].node_id] = nodes
     return contents
 
 # ANSWERS = list[tuple[tuple[str, list[NodeWithScore]], CompletionResponse]]
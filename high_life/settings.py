@@ -1,20 +1,23 @@
 import hashlib
+import json
+import os
 import sqlite3
 
 import chromadb
 from chromadb.api.models import Collection
 from llama_index.core import StorageContext, Settings, set_global_handler
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.vector_stores.chroma import ChromaVectorStore
 
+from embedding_service import EmbeddingService, load_embed_model
+
 set_global_handler("simple")  # side effect
 
-Settings.embed_model = HuggingFaceEmbedding("avsolatorio/GIST-large-Embedding-v0", cache_folder="embeddings-cache")
-chroma_client = chromadb.HttpClient(host='localhost', port=8000)
-chroma_collection: Collection = chroma_client.get_collection("high_life_3")
-vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-storage_context = StorageContext.from_defaults(vector_store=vector_store)
-DB_NAME = 'logs.sqlite3'
+
+# data files live next to the code, so the api (run from high_life/) and `python -m high_life.migrations...`
+# (run from the repo root) read and write the same ones
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+COLLECTION_ALIAS_FILE = os.getenv("COLLECTION_ALIAS_FILE", os.path.join(DATA_DIR, "collection-alias.json"))
+DEFAULT_COLLECTION = "high_life_3"
 
 
 def hex_id(hash_value):
@@ -23,6 +26,23 @@ def hex_id(hash_value):
     return h.hexdigest()
 
 
+def active_collection_name(alias_file=COLLECTION_ALIAS_FILE) -> str:
+    """The collection migrations.blue_green last switched to, or DEFAULT_COLLECTION before the first switch."""
+    if os.path.exists(alias_file):
+        with open(alias_file) as f:
+            return json.load(f)["active"]
+    return DEFAULT_COLLECTION
+
+
+Settings.embed_model = EmbeddingService(load_embed_model, hash_fn=hex_id)  # EMBED_BACKEND picks the model
+chroma_client = chromadb.HttpClient(host='localhost', port=8000)
+chroma_collection: Collection = chroma_client.get_collection(active_collection_name())
+vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+storage_context = StorageContext.from_defaults(vector_store=vector_store)
+DB_NAME = os.path.join(DATA_DIR, 'logs.sqlite3')
+INDEX_DB_NAME = os.path.join(DATA_DIR, 'node_index.sqlite3')
+
+
 def logging_startup():
     conn = sqlite3.connect(DB_NAME)  # Replace with your database name
     cursor = conn.cursor()
@@ -40,9 +60,18 @@ def logging_startup():
         CREATE TABLE IF NOT EXISTS vector_retrieval (
             logging_id TEXT,
             document TEXT,
+            node_id TEXT,
+            score REAL,
+            rank INTEGER,
+            stage TEXT,
             FOREIGN KEY(logging_id) REFERENCES queries(logging_id)
         )
     """)
+    # older databases logged the whole node as json in `document`; new rows only keep node_id, score and rank
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(vector_retrieval)")}
+    for column, column_type in [("node_id", "TEXT"), ("score", "REAL"), ("rank", "INTEGER"), ("stage", "TEXT")]:
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE vector_retrieval ADD COLUMN {column} {column_type}")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS filtering_responses (
             logging_id TEXT,
@@ -59,8 +88,48 @@ def logging_startup():
             FOREIGN KEY(logging_id) REFERENCES queries(logging_id)
         )
     """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            cache_id TEXT PRIMARY KEY,
+            query TEXT,
+            answer TEXT,
+            embedding BLOB,
+            created_at REAL,
+            last_used REAL,
+            hits INTEGER DEFAULT 0,
+            embed_model TEXT,
+            dimension INTEGER
+        )
+    """)
+    # rows from before embed_model was recorded are never matched, and expire with the ttl
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(answer_cache)")}
+    for column, column_type in [("embed_model", "TEXT"), ("dimension", "INTEGER")]:
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE answer_cache ADD COLUMN {column} {column_type}")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            logging_id TEXT,
+            provider TEXT,
+            model TEXT,
+            latency REAL,
+            input_tokens INTEGER,
+            output_tokens INTEGER,
+            attempts INTEGER,
+            status TEXT,
+            created_at REAL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cache_hits (
+            logging_id TEXT,
+            cache_id TEXT,
+            similarity REAL,
+            FOREIGN KEY(logging_id) REFERENCES queries(logging_id)
+        )
+    """)
 
 ###
 #  metadata_versions
 #  1. adding categories
 # 2. adding NER
+# 3. excluding text_hash from the LLM and embed text
@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import dirtyjson
+from llama_index.core.llms import LLM
+
+from llm_clients import llm_clients, token_usage
+from prompts import packed_propositions_prompt, propositions_prompt, repair_json_prompt
+from settings import DB_NAME, hex_id
+
+SPLITTER_MODEL = os.getenv("SPLITTER_MODEL", "mixtral-8x7b-32768")
+SPLITTER_PACK_CHARS = int(os.getenv("SPLITTER_PACK_CHARS", "2400"))  # content per packed request
+SPLITTER_PACK_ITEMS = int(os.getenv("SPLITTER_PACK_ITEMS", "8"))
+SPLITTER_SHORT_CHARS = int(os.getenv("SPLITTER_SHORT_CHARS", "600"))  # longer captions get a request of their own
+SPLITTER_REPAIRS = int(os.getenv("SPLITTER_REPAIRS", "1"))
+SPLITTER_CONCURRENCY = int(os.getenv("SPLITTER_CONCURRENCY", "4"))
+# USD per million tokens, for the cost counter
+SPLITTER_INPUT_PRICE = float(os.getenv("SPLITTER_INPUT_PRICE", "0.24"))
+SPLITTER_OUTPUT_PRICE = float(os.getenv("SPLITTER_OUTPUT_PRICE", "0.24"))
+PROMPT_VERSION = "1"  # part of the cache key: bump when the prompts change what comes back
+
+logger = logging.getLogger(__name__)
+
+
+def parse_json(text: str):
+    """The first JSON list or object in `text`; json first, then dirtyjson for the trailing commas and the like."""
+    text = text.replace("\\_", "_")
+    if match := re.search(r"[\[{]", text):
+        text = text[match.start():]
+    try:
+        return json.JSONDecoder().raw_decode(text)[0]
+    except ValueError:
+        return dirtyjson.loads(text)
+
+
+def validate_propositions(value) -> list[str]:
+    if not isinstance(value, list) or not value:
+        raise ValueError(f"expected a non-empty list of strings, got {type(value).__name__}")
+    propositions = [item.strip() for item in value if isinstance(item, str) and item.strip()]
+    if len(propositions) != len(value):
+        raise ValueError("expected a list of strings, got other items")
+    return propositions
+
+
+def validate_packed(value, count: int) -> list[list[str]]:
+    if not isinstance(value, dict):
+        raise ValueError(f"expected an object keyed 1..{count}, got {type(value).__name__}")
+    if missing := [str(number) for number in range(1, count + 1) if str(number) not in value]:
+        raise ValueError(f"missing items {missing}")
+    return [validate_propositions(value[str(number)]) for number in range(1, count + 1)]
+
+
+class PropositionSplitter:
+    """Captions -> propositions through the LLM, with a persistent cache, request packing and validated output.
+
+    Results are cached in sqlite by a hash of the model, PROMPT_VERSION and the caption, so a caption is only
+    ever sent once. `split_many` packs short captions (under `short_chars`) into requests of up to
+    `pack_items` captions / `pack_chars` characters, answered as one JSON object keyed by item number; longer
+    ones go alone. Every answer is validated, and malformed JSON gets `repairs` cheap retries that send only
+    the bad output back. A pack that still fails, or whose request errors, is split one caption at a time.
+    """
+
+    def __init__(self, llm: LLM | None = None, db_name=DB_NAME, pack_chars=SPLITTER_PACK_CHARS,
+                 pack_items=SPLITTER_PACK_ITEMS, short_chars=SPLITTER_SHORT_CHARS, repairs=SPLITTER_REPAIRS,
+                 concurrency=SPLITTER_CONCURRENCY):
+        self._llm = llm
+        self.db_name = db_name
+        self.pack_chars = pack_chars
+        self.pack_items = pack_items
+        self.short_chars = short_chars
+        self.repairs = repairs
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._stats = {"items": 0, "cache_hits": 0, "requests": 0, "packed_requests": 0, "packed_items": 0,
+                       "repairs": 0, "unpacked_fallbacks": 0, "failures": 0, "llm_seconds": 0.0,
+                       "input_tokens": 0, "output_tokens": 0}
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS proposition_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    propositions TEXT,
+                    created_at REAL
+                )
+            """)
+
+    @property
+    def llm(self) -> LLM:
+        return self._llm or llm_clients.groq(SPLITTER_MODEL, temperature=0.1)
+
+    def cache_key(self, text: str) -> str:
+        return hex_id(f"{getattr(self.llm, 'model', '')}\n{PROMPT_VERSION}\n{text}")
+
+    def _count(self, **amounts):
+        with self._lock:
+            for key, amount in amounts.items():
+                self._stats[key] += amount
+
+    def _cached(self, keys: list[str]) -> dict[str, list[str]]:
+        found = {}
+        with sqlite3.connect(self.db_name) as conn:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = conn.execute(f"SELECT cache_key, propositions FROM proposition_cache "
+                                    f"WHERE cache_key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                found.update({key: json.loads(propositions) for key, propositions in rows})
+        return found
+
+    def _store(self, results: dict[str, list[str]]):
+        with sqlite3.connect(self.db_name) as conn:
+            conn.executemany("INSERT OR REPLACE INTO proposition_cache VALUES (?,?,?)",
+                             [(key, json.dumps(propositions), time.time()) for key, propositions in results.items()])
+
+    def _complete(self, prompt: str) -> str:
+        started = time.perf_counter()
+        response = llm_clients.complete(self.llm, prompt)
+        input_tokens, output_tokens = token_usage(response)
+        self._count(requests=1, llm_seconds=time.perf_counter() - started, input_tokens=input_tokens or 0,
+                    output_tokens=output_tokens or 0)
+        return response.text
+
+    def _ask(self, prompt: str, expected: str, validate):
+        """Send `prompt` and validate the answer, asking for just the JSON to be fixed when it doesn't parse."""
+        output = self._complete(prompt)
+        for attempt in range(self.repairs + 1):
+            try:
+                return validate(parse_json(output))
+            except ValueError as e:
+                if attempt == self.repairs:
+                    raise ValueError(f"invalid splitter output after {self.repairs} repairs: {e}") from e
+                self._count(repairs=1)
+                output = self._complete(repair_json_prompt.format(expected=expected, output=output))
+
+    def _split_one(self, text: str) -> list[str]:
+        return self._ask(propositions_prompt.format(query_str=text), "a JSON list of strings", validate_propositions)
+
+    def _split_pack(self, texts: list[str]) -> list[list[str]]:
+        if len(texts) == 1:
+            return [self._split_one(texts[0])]
+        items = "\n".join(f"{number}. Content: {text}" for number, text in enumerate(texts, 1))
+        self._count(packed_requests=1, packed_items=len(texts))
+        try:
+            return self._ask(packed_propositions_prompt.format(items=items),
+                             f"a JSON object mapping each of 1..{len(texts)} to a list of strings",
+                             lambda value: validate_packed(value, len(texts)))
+        except Exception as e:  # bad output or a transport error: either way the captions go one at a time
+            logger.warning(f"packed split of {len(texts)} captions failed ({e!r}), splitting them one at a time")
+            self._count(unpacked_fallbacks=1)
+            return [self._split_one(text) for text in texts]
+
+    def packs(self, texts: list[str]) -> list[list[str]]:
+        """Group `texts` into requests: short ones packed by count and size, long ones alone."""
+        packs, current, size = [], [], 0
+        for text in texts:
+            if len(text) >= self.short_chars:
+                packs.append([text])
+                continue
+            if current and (len(current) >= self.pack_items or size + len(text) > self.pack_chars):
+                packs.append(current)
+                current, size = [], 0
+            current.append(text)
+            size += len(text)
+        if current:
+            packs.append(current)
+        return packs
+
+    def split_many(self, texts: list[str]) -> list[list[str]]:
+        """Propositions for each of `texts`, in order; raises the first error of a pack that could not be split.
+
+        Each pack is cached as soon as it completes, so a failure (or a crash) later in the batch doesn't lose it.
+        """
+        keys = [self.cache_key(text) for text in texts]
+        results = self._cached(list(dict.fromkeys(keys)))
+        self._count(items=len(texts), cache_hits=sum(key in results for key in keys))
+        missing = list({key: text for key, text in zip(keys, texts) if key not in results}.values())
+        if missing:
+            packs = self.packs(missing)
+            failed = None
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                futures = {pool.submit(self._split_pack, pack): pack for pack in packs}
+                for future in as_completed(futures):
+                    pack = futures[future]
+                    try:
+                        answers = future.result()
+                    except Exception as e:
+                        self._count(failures=len(pack))
+                        failed = failed or e
+                        continue
+                    split = {self.cache_key(text): propositions for text, propositions in zip(pack, answers)}
+                    self._store(split)
+                    results.update(split)
+            if failed is not None:  # the packs that did succeed are cached for the retry
+                raise failed
+        return [results[key] for key in keys]
+
+    def split(self, text: str) -> list[str]:
+        return self.split_many([text])[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        split = stats["items"] - stats["cache_hits"]
+        stats["cost_usd"] = (stats["input_tokens"] * SPLITTER_INPUT_PRICE +
+                             stats["output_tokens"] * SPLITTER_OUTPUT_PRICE) / 1_000_000
+        stats["llm_seconds_per_item"] = stats["llm_seconds"] / split if split else 0
+        stats["tokens_per_item"] = (stats["input_tokens"] + stats["output_tokens"]) / split if split else 0
+        stats["cost_usd_per_item"] = stats["cost_usd"] / split if split else 0
+        return stats
+
+
+splitter = PropositionSplitter()
@@ -46,6 +46,8 @@ type alias Model =
     , request : WebData LLMRequest
     , newRow : TableRow
     , tableRows : TableRows
+    , streamStatus : String
+    , streamText : ResponseText
     }
 
 
@@ -85,14 +87,20 @@ type alias FullTableRow =
     { requestText : RequestText, responseText : ResponseText }
 
 
+type alias StreamEvent =
+    { event : String
+    , data : String
+    }
+
+
 init : Json.Encode.Value -> ( Model, Cmd Msg )
 init flags =
     case Decode.decodeValue tableRowsDecoder flags of
         Ok tableRows ->
-            ( Model "" NotAsked NoInput tableRows, Cmd.none )
+            ( Model "" NotAsked NoInput tableRows "" "", Cmd.none )
 
         Err _ ->
-            ( Model "" NotAsked NoInput [], Cmd.none )
+            ( Model "" NotAsked NoInput [] "" "", Cmd.none )
 
 
 
@@ -107,6 +115,7 @@ type Msg
     | LoadTableRowsFromLocalStorage Json.Encode.Value
     | SaveTableRowsToLocalStorage
     | DeleteRow Int
+    | ReceiveStreamEvent Json.Encode.Value
 
 
 update : Msg -> Model -> ( Model, Cmd Msg )
@@ -122,7 +131,9 @@ update msg model =
                         tableRows =
                             newRow :: model.tableRows
                     in
-                    ( { input = input, request = Loading, newRow = newRow, tableRows = tableRows }, postLLMRequest input )
+                    ( { model | input = input, request = Loading, newRow = newRow, tableRows = tableRows, streamStatus = "", streamText = "" }
+                    , streamQuery input
+                    )
 
                 _ ->
                     ( { model | request = NotAsked }, Cmd.none )
@@ -142,7 +153,7 @@ update msg model =
                                 tableRows =
                                     newRow :: List.drop 1 model.tableRows
                             in
-                            ( { input = "", request = NotAsked, newRow = NoInput, tableRows = tableRows }
+                            ( { model | input = "", request = NotAsked, newRow = NoInput, tableRows = tableRows }
                             , saveTableRows <| encodeTableRows tableRows
                             )
 
@@ -183,10 +194,42 @@ update msg model =
             in
             ( { model | tableRows = tableRows }, saveTableRows <| encodeTableRows tableRows )
 
+        ReceiveStreamEvent json ->
+            case Decode.decodeValue streamEventDecoder json of
+                Ok streamEvent ->
+                    updateFromStreamEvent streamEvent model
+
+                Err _ ->
+                    ( model, Cmd.none )
+
+
+updateFromStreamEvent : StreamEvent -> Model -> ( Model, Cmd Msg )
+updateFromStreamEvent streamEvent model =
+    case streamEvent.event of
+        "status" ->
+            ( { model | streamStatus = streamEvent.data }, Cmd.none )
+
+        "token" ->
+            ( { model | streamText = model.streamText ++ streamEvent.data }, Cmd.none )
+
+        "done" ->
+            update (UseResponseToUpdateModel (Success { responseText = model.streamText }))
+                { model | streamStatus = "", streamText = "" }
+
+        "error" ->
+            update (UseResponseToUpdateModel (Failure (Http.BadBody streamEvent.data)))
+                { model | streamStatus = "", streamText = "" }
+
+        _ ->
+            ( model, Cmd.none )
+
 
 subscriptions : Model -> Sub Msg
 subscriptions _ =
-    loadTableRows LoadTableRowsFromLocalStorage
+    Sub.batch
+        [ loadTableRows LoadTableRowsFromLocalStorage
+        , queryStreamEvents ReceiveStreamEvent
+        ]
 
 
 
@@ -218,8 +261,17 @@ viewResponseCell responseText =
         ]
 
 
-viewTableRow : Int -> TableRow -> Maybe (Html Msg)
-viewTableRow index tableRow =
+viewStreamingCell : Model -> Html Msg
+viewStreamingCell model =
+    if String.isEmpty model.streamText then
+        td [] [ progress [] [], text (" " ++ model.streamStatus) ]
+
+    else
+        viewResponseCell model.streamText
+
+
+viewTableRow : Model -> Int -> TableRow -> Maybe (Html Msg)
+viewTableRow model index tableRow =
     case tableRow of
         NoInput ->
             Nothing
@@ -229,7 +281,7 @@ viewTableRow index tableRow =
                 tr []
                     [ td [] [ text "" ]
                     , viewInputCell llmRequest.requestText
-                    , td [] [ progress [] [] ]
+                    , viewStreamingCell model
                     ]
 
         HasAllData data ->
@@ -244,9 +296,9 @@ viewTableRow index tableRow =
                     ]
 
 
-viewTableRows : TableRows -> List (Maybe (Html Msg))
-viewTableRows tableRows =
-    List.indexedMap viewTableRow tableRows
+viewTableRows : Model -> List (Maybe (Html Msg))
+viewTableRows model =
+    List.indexedMap (viewTableRow model) model.tableRows
 
 
 maybeToList : Maybe a -> List a
@@ -274,15 +326,15 @@ thStyling =
     [ style "text-align" "left" ]
 
 
-viewResponses : TableRows -> Html Msg
-viewResponses tableRows =
+viewResponses : Model -> Html Msg
+viewResponses model =
     table []
         [ thead []
             [ th [] []
             , th thStyling [ text "Query" ]
             , th thStyling [ text "Answer" ]
             ]
-        , tbody [] <| List.concatMap maybeToList (viewTableRows tableRows)
+        , tbody [] <| List.concatMap maybeToList (viewTableRows model)
         ]
 
 
@@ -298,7 +350,7 @@ viewApp model =
                 [ text "Try a search"
                 , input [ onInput UpdateRequest, Html.Attributes.name <| appName ++ " Query" ] []
                 , button [ onClick (SendRequest model.input) ] [ text "Ask!" ]
-                , viewResponses model.tableRows
+                , viewResponses model
                 ]
 
         Failure err ->
@@ -306,12 +358,12 @@ viewApp model =
                 [ decodeError model err
                 , input [ onInput UpdateRequest, value model.input ] [ text model.input ]
                 , button [ onClick (SendRequest model.input) ] [ text "Ask!" ]
-                , viewResponses model.tableRows
+                , viewResponses model
                 ]
 
         Loading ->
             div []
-                [ viewResponses model.tableRows
+                [ viewResponses model
                 ]
 
         Success _ ->
@@ -319,7 +371,7 @@ viewApp model =
                 [ text "Try a search"
                 , input [ onInput UpdateRequest ] []
                 , button [ onClick <| SendRequest model.input ] [ text "Ask!" ]
-                , viewResponses model.tableRows
+                , viewResponses model
                 ]
 
 
@@ -388,7 +440,7 @@ decodeError model error =
         Http.BadBody string ->
             div []
                 [ text ("Bad Request Body :(" ++ " " ++ string)
-                , viewResponses model.tableRows
+                , viewResponses model
                 ]
 
 
@@ -405,6 +457,12 @@ port sendLoadTableRowsMsg : () -> Cmd msg
 port saveTableRows : Json.Encode.Value -> Cmd msg
 
 
+port streamQuery : String -> Cmd msg
+
+
+port queryStreamEvents : (Json.Encode.Value -> msg) -> Sub msg
+
+
 tableRowDecoder : Decode.Decoder TableRow
 tableRowDecoder =
     Decode.map2 (\request response -> HasAllData { requestText = request, responseText = response })
@@ -415,3 +473,10 @@ tableRowDecoder =
 tableRowsDecoder : Decode.Decoder TableRows
 tableRowsDecoder =
     Decode.list tableRowDecoder
+
+
+streamEventDecoder : Decode.Decoder StreamEvent
+streamEventDecoder =
+    Decode.map2 StreamEvent
+        (Decode.field "event" Decode.string)
+        (Decode.field "data" Decode.string)
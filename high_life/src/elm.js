@@ -5334,9 +5334,9 @@ var $elm$core$Task$perform = F2(
 				A2($elm$core$Task$map, toMessage, task)));
 	});
 var $elm$browser$Browser$element = _Browser_element;
-var $author$project$Main$Model = F4(
-	function (input, request, newRow, tableRows) {
-		return {input: input, newRow: newRow, request: request, tableRows: tableRows};
+var $author$project$Main$Model = F6(
+	function (input, request, newRow, tableRows, streamStatus, streamText) {
+		return {input: input, newRow: newRow, request: request, streamStatus: streamStatus, streamText: streamText, tableRows: tableRows};
 	});
 var $author$project$Main$NoInput = {$: 'NoInput'};
 var $krisajenkins$remotedata$RemoteData$NotAsked = {$: 'NotAsked'};
@@ -5364,21 +5364,31 @@ var $author$project$Main$init = function (flags) {
 	if (_v0.$ === 'Ok') {
 		var tableRows = _v0.a;
 		return _Utils_Tuple2(
-			A4($author$project$Main$Model, '', $krisajenkins$remotedata$RemoteData$NotAsked, $author$project$Main$NoInput, tableRows),
+			A6($author$project$Main$Model, '', $krisajenkins$remotedata$RemoteData$NotAsked, $author$project$Main$NoInput, tableRows, '', ''),
 			$elm$core$Platform$Cmd$none);
 	} else {
 		return _Utils_Tuple2(
-			A4($author$project$Main$Model, '', $krisajenkins$remotedata$RemoteData$NotAsked, $author$project$Main$NoInput, _List_Nil),
+			A6($author$project$Main$Model, '', $krisajenkins$remotedata$RemoteData$NotAsked, $author$project$Main$NoInput, _List_Nil, '', ''),
 			$elm$core$Platform$Cmd$none);
 	}
 };
 var $author$project$Main$LoadTableRowsFromLocalStorage = function (a) {
 	return {$: 'LoadTableRowsFromLocalStorage', a: a};
 };
+var $author$project$Main$ReceiveStreamEvent = function (a) {
+	return {$: 'ReceiveStreamEvent', a: a};
+};
+var $elm$core$Platform$Sub$batch = _Platform_batch;
 var $elm$json$Json$Decode$value = _Json_decodeValue;
 var $author$project$Main$loadTableRows = _Platform_incomingPort('loadTableRows', $elm$json$Json$Decode$value);
+var $author$project$Main$queryStreamEvents = _Platform_incomingPort('queryStreamEvents', $elm$json$Json$Decode$value);
 var $author$project$Main$subscriptions = function (_v0) {
-	return $author$project$Main$loadTableRows($author$project$Main$LoadTableRowsFromLocalStorage);
+	return $elm$core$Platform$Sub$batch(
+		_List_fromArray(
+			[
+				$author$project$Main$loadTableRows($author$project$Main$LoadTableRowsFromLocalStorage),
+				$author$project$Main$queryStreamEvents($author$project$Main$ReceiveStreamEvent)
+			]));
 };
 var $krisajenkins$remotedata$RemoteData$Failure = function (a) {
 	return {$: 'Failure', a: a};
@@ -5476,44 +5486,6 @@ var $author$project$Main$encodeTableRows = function (rows) {
 var $author$project$Main$UseResponseToUpdateModel = function (a) {
 	return {$: 'UseResponseToUpdateModel', a: a};
 };
-var $elm$http$Http$Header = F2(
-	function (a, b) {
-		return {$: 'Header', a: a, b: b};
-	});
-var $elm$http$Http$header = $elm$http$Http$Header;
-var $ohanhi$remotedata_http$RemoteData$Http$acceptJson = A2($elm$http$Http$header, 'Accept', 'application/json');
-var $ohanhi$remotedata_http$RemoteData$Http$defaultConfig = {
-	headers: _List_fromArray(
-		[$ohanhi$remotedata_http$RemoteData$Http$acceptJson]),
-	risky: false,
-	timeout: $elm$core$Maybe$Nothing,
-	tracker: $elm$core$Maybe$Nothing
-};
-var $author$project$Main$encodeRequest = function (input) {
-	return $elm$json$Json$Encode$object(
-		_List_fromArray(
-			[
-				_Utils_Tuple2(
-				'text',
-				$elm$json$Json$Encode$string(input))
-			]));
-};
-var $author$project$Main$LLMResponse = function (responseText) {
-	return {responseText: responseText};
-};
-var $NoRedInk$elm_json_decode_pipeline$Json$Decode$Pipeline$custom = $elm$json$Json$Decode$map2($elm$core$Basics$apR);
-var $NoRedInk$elm_json_decode_pipeline$Json$Decode$Pipeline$required = F3(
-	function (key, valDecoder, decoder) {
-		return A2(
-			$NoRedInk$elm_json_decode_pipeline$Json$Decode$Pipeline$custom,
-			A2($elm$json$Json$Decode$field, key, valDecoder),
-			decoder);
-	});
-var $author$project$Main$llmResponseDecoder = A3(
-	$NoRedInk$elm_json_decode_pipeline$Json$Decode$Pipeline$required,
-	'text',
-	$elm$json$Json$Decode$string,
-	$elm$json$Json$Decode$succeed($author$project$Main$LLMResponse));
 var $elm$http$Http$BadStatus_ = F2(
 	function (a, b) {
 		return {$: 'BadStatus_', a: a, b: b};
@@ -6056,99 +6028,12 @@ var $elm$core$Dict$update = F3(
 			return A2($elm$core$Dict$remove, targetKey, dictionary);
 		}
 	});
-var $elm$http$Http$jsonBody = function (value) {
-	return A2(
-		_Http_pair,
-		'application/json',
-		A2($elm$json$Json$Encode$encode, 0, value));
-};
-var $elm$core$Basics$composeR = F3(
-	function (f, g, x) {
-		return g(
-			f(x));
-	});
-var $elm$json$Json$Decode$decodeString = _Json_runOnString;
-var $elm$http$Http$expectStringResponse = F2(
-	function (toMsg, toResult) {
-		return A3(
-			_Http_expect,
-			'',
-			$elm$core$Basics$identity,
-			A2($elm$core$Basics$composeR, toResult, toMsg));
-	});
-var $elm$core$Result$mapError = F2(
-	function (f, result) {
-		if (result.$ === 'Ok') {
-			var v = result.a;
-			return $elm$core$Result$Ok(v);
-		} else {
-			var e = result.a;
-			return $elm$core$Result$Err(
-				f(e));
-		}
-	});
 var $elm$http$Http$BadBody = function (a) {
 	return {$: 'BadBody', a: a};
 };
-var $elm$http$Http$BadStatus = function (a) {
-	return {$: 'BadStatus', a: a};
-};
-var $elm$http$Http$BadUrl = function (a) {
-	return {$: 'BadUrl', a: a};
-};
-var $elm$http$Http$NetworkError = {$: 'NetworkError'};
-var $elm$http$Http$Timeout = {$: 'Timeout'};
-var $elm$http$Http$resolve = F2(
-	function (toResult, response) {
-		switch (response.$) {
-			case 'BadUrl_':
-				var url = response.a;
-				return $elm$core$Result$Err(
-					$elm$http$Http$BadUrl(url));
-			case 'Timeout_':
-				return $elm$core$Result$Err($elm$http$Http$Timeout);
-			case 'NetworkError_':
-				return $elm$core$Result$Err($elm$http$Http$NetworkError);
-			case 'BadStatus_':
-				var metadata = response.a;
-				return $elm$core$Result$Err(
-					$elm$http$Http$BadStatus(metadata.statusCode));
-			default:
-				var body = response.b;
-				return A2(
-					$elm$core$Result$mapError,
-					$elm$http$Http$BadBody,
-					toResult(body));
-		}
-	});
-var $elm$http$Http$expectJson = F2(
-	function (toMsg, decoder) {
-		return A2(
-			$elm$http$Http$expectStringResponse,
-			toMsg,
-			$elm$http$Http$resolve(
-				function (string) {
-					return A2(
-						$elm$core$Result$mapError,
-						$elm$json$Json$Decode$errorToString,
-						A2($elm$json$Json$Decode$decodeString, decoder, string));
-				}));
-	});
 var $krisajenkins$remotedata$RemoteData$Success = function (a) {
 	return {$: 'Success', a: a};
 };
-var $krisajenkins$remotedata$RemoteData$fromResult = function (result) {
-	if (result.$ === 'Err') {
-		var e = result.a;
-		return $krisajenkins$remotedata$RemoteData$Failure(e);
-	} else {
-		var x = result.a;
-		return $krisajenkins$remotedata$RemoteData$Success(x);
-	}
-};
-var $elm$http$Http$Request = function (a) {
-	return {$: 'Request', a: a};
-};
 var $elm$http$Http$State = F2(
 	function (reqs, subs) {
 		return {reqs: reqs, subs: subs};
@@ -6307,62 +6192,18 @@ var $elm$http$Http$subMap = F2(
 			A2($elm$core$Basics$composeR, toMsg, func));
 	});
 _Platform_effectManagers['Http'] = _Platform_createManager($elm$http$Http$init, $elm$http$Http$onEffects, $elm$http$Http$onSelfMsg, $elm$http$Http$cmdMap, $elm$http$Http$subMap);
-var $elm$http$Http$command = _Platform_leaf('Http');
 var $elm$http$Http$subscription = _Platform_leaf('Http');
-var $elm$http$Http$request = function (r) {
-	return $elm$http$Http$command(
-		$elm$http$Http$Request(
-			{allowCookiesFromOtherDomains: false, body: r.body, expect: r.expect, headers: r.headers, method: r.method, timeout: r.timeout, tracker: r.tracker, url: r.url}));
-};
-var $elm$http$Http$riskyRequest = function (r) {
-	return $elm$http$Http$command(
-		$elm$http$Http$Request(
-			{allowCookiesFromOtherDomains: true, body: r.body, expect: r.expect, headers: r.headers, method: r.method, timeout: r.timeout, tracker: r.tracker, url: r.url}));
-};
-var $ohanhi$remotedata_http$RemoteData$Http$performRequest = function (_v0) {
-	var risky = _v0.risky;
-	return risky ? $elm$http$Http$riskyRequest : $elm$http$Http$request;
-};
-var $ohanhi$remotedata_http$RemoteData$Http$request = F6(
-	function (method, config, url, tagger, decoder, body) {
-		return A2(
-			$ohanhi$remotedata_http$RemoteData$Http$performRequest,
-			config,
-			{
-				body: body,
-				expect: A2(
-					$elm$http$Http$expectJson,
-					A2($elm$core$Basics$composeR, $krisajenkins$remotedata$RemoteData$fromResult, tagger),
-					decoder),
-				headers: config.headers,
-				method: method,
-				timeout: config.timeout,
-				tracker: config.tracker,
-				url: url
-			});
-	});
-var $ohanhi$remotedata_http$RemoteData$Http$requestWithJson = F6(
-	function (method, config, url, tagger, decoder, body) {
-		return A6(
-			$ohanhi$remotedata_http$RemoteData$Http$request,
-			method,
-			config,
-			url,
-			tagger,
-			decoder,
-			$elm$http$Http$jsonBody(body));
-	});
-var $ohanhi$remotedata_http$RemoteData$Http$postWithConfig = $ohanhi$remotedata_http$RemoteData$Http$requestWithJson('POST');
-var $author$project$Main$postLLMRequest = function (input) {
-	return A5(
-		$ohanhi$remotedata_http$RemoteData$Http$postWithConfig,
-		$ohanhi$remotedata_http$RemoteData$Http$defaultConfig,
-		'/query',
-		$author$project$Main$UseResponseToUpdateModel,
-		$author$project$Main$llmResponseDecoder,
-		$author$project$Main$encodeRequest(input));
-};
 var $author$project$Main$saveTableRows = _Platform_outgoingPort('saveTableRows', $elm$core$Basics$identity);
+var $author$project$Main$StreamEvent = F2(
+	function (event, data) {
+		return {data: data, event: event};
+	});
+var $author$project$Main$streamEventDecoder = A3(
+	$elm$json$Json$Decode$map2,
+	$author$project$Main$StreamEvent,
+	A2($elm$json$Json$Decode$field, 'event', $elm$json$Json$Decode$string),
+	A2($elm$json$Json$Decode$field, 'data', $elm$json$Json$Decode$string));
+var $author$project$Main$streamQuery = _Platform_outgoingPort('streamQuery', $elm$json$Json$Encode$string);
 var $elm$core$List$takeReverse = F3(
 	function (n, list, kept) {
 		takeReverse:
@@ -6500,8 +6341,10 @@ var $author$project$Main$update = F2(
 					var newRow = $author$project$Main$HasOnlyInput(data);
 					var tableRows = A2($elm$core$List$cons, newRow, model.tableRows);
 					return _Utils_Tuple2(
-						{input: input, newRow: newRow, request: $krisajenkins$remotedata$RemoteData$Loading, tableRows: tableRows},
-						$author$project$Main$postLLMRequest(input));
+						_Utils_update(
+							model,
+							{input: input, newRow: newRow, request: $krisajenkins$remotedata$RemoteData$Loading, streamStatus: '', streamText: '', tableRows: tableRows}),
+						$author$project$Main$streamQuery(input));
 				} else {
 					return _Utils_Tuple2(
 						_Utils_update(
@@ -6535,7 +6378,9 @@ var $author$project$Main$update = F2(
 								newRow,
 								A2($elm$core$List$drop, 1, model.tableRows));
 							return _Utils_Tuple2(
-								{input: '', newRow: $author$project$Main$NoInput, request: $krisajenkins$remotedata$RemoteData$NotAsked, tableRows: tableRows},
+								_Utils_update(
+									model,
+									{input: '', newRow: $author$project$Main$NoInput, request: $krisajenkins$remotedata$RemoteData$NotAsked, tableRows: tableRows}),
 								$author$project$Main$saveTableRows(
 									$author$project$Main$encodeTableRows(tableRows)));
 						} else {
@@ -6581,7 +6426,7 @@ var $author$project$Main$update = F2(
 					model,
 					$author$project$Main$saveTableRows(
 						$author$project$Main$encodeTableRows(model.tableRows)));
-			default:
+			case 'DeleteRow':
 				var index = msg.a;
 				var tableRows = _Utils_ap(
 					A2($elm$core$List$take, index, model.tableRows),
@@ -6592,6 +6437,55 @@ var $author$project$Main$update = F2(
 						{tableRows: tableRows}),
 					$author$project$Main$saveTableRows(
 						$author$project$Main$encodeTableRows(tableRows)));
+			default:
+				var json = msg.a;
+				var _v5 = A2($elm$json$Json$Decode$decodeValue, $author$project$Main$streamEventDecoder, json);
+				if (_v5.$ === 'Ok') {
+					var streamEvent = _v5.a;
+					return A2($author$project$Main$updateFromStreamEvent, streamEvent, model);
+				} else {
+					return _Utils_Tuple2(model, $elm$core$Platform$Cmd$none);
+				}
+		}
+	});
+var $author$project$Main$updateFromStreamEvent = F2(
+	function (streamEvent, model) {
+		var _v0 = streamEvent.event;
+		switch (_v0) {
+			case 'status':
+				return _Utils_Tuple2(
+					_Utils_update(
+						model,
+						{streamStatus: streamEvent.data}),
+					$elm$core$Platform$Cmd$none);
+			case 'token':
+				return _Utils_Tuple2(
+					_Utils_update(
+						model,
+						{
+							streamText: _Utils_ap(model.streamText, streamEvent.data)
+						}),
+					$elm$core$Platform$Cmd$none);
+			case 'done':
+				return A2(
+					$author$project$Main$update,
+					$author$project$Main$UseResponseToUpdateModel(
+						$krisajenkins$remotedata$RemoteData$Success(
+							{responseText: model.streamText})),
+					_Utils_update(
+						model,
+						{streamStatus: '', streamText: ''}));
+			case 'error':
+				return A2(
+					$author$project$Main$update,
+					$author$project$Main$UseResponseToUpdateModel(
+						$krisajenkins$remotedata$RemoteData$Failure(
+							$elm$http$Http$BadBody(streamEvent.data))),
+					_Utils_update(
+						model,
+						{streamStatus: '', streamText: ''}));
+			default:
+				return _Utils_Tuple2(model, $elm$core$Platform$Cmd$none);
 		}
 	});
 var $author$project$Main$appName = 'Crawford\'s Recommender';
@@ -6683,8 +6577,18 @@ var $author$project$Main$viewResponseCell = function (responseText) {
 					]))
 			]));
 };
-var $author$project$Main$viewTableRow = F2(
-	function (index, tableRow) {
+var $author$project$Main$viewStreamingCell = function (model) {
+	return $elm$core$String$isEmpty(model.streamText) ? A2(
+		$elm$html$Html$td,
+		_List_Nil,
+		_List_fromArray(
+			[
+				A2($elm$html$Html$progress, _List_Nil, _List_Nil),
+				$elm$html$Html$text(' ' + model.streamStatus)
+			])) : $author$project$Main$viewResponseCell(model.streamText);
+};
+var $author$project$Main$viewTableRow = F3(
+	function (model, index, tableRow) {
 		switch (tableRow.$) {
 			case 'NoInput':
 				return $elm$core$Maybe$Nothing;
@@ -6704,13 +6608,7 @@ var $author$project$Main$viewTableRow = F2(
 										$elm$html$Html$text('')
 									])),
 								$author$project$Main$viewInputCell(llmRequest.requestText),
-								A2(
-								$elm$html$Html$td,
-								_List_Nil,
-								_List_fromArray(
-									[
-										A2($elm$html$Html$progress, _List_Nil, _List_Nil)
-									]))
+								$author$project$Main$viewStreamingCell(model)
 							])));
 			default:
 				var data = tableRow.a;
@@ -6742,10 +6640,13 @@ var $author$project$Main$viewTableRow = F2(
 							])));
 		}
 	});
-var $author$project$Main$viewTableRows = function (tableRows) {
-	return A2($elm$core$List$indexedMap, $author$project$Main$viewTableRow, tableRows);
+var $author$project$Main$viewTableRows = function (model) {
+	return A2(
+		$elm$core$List$indexedMap,
+		$author$project$Main$viewTableRow(model),
+		model.tableRows);
 };
-var $author$project$Main$viewResponses = function (tableRows) {
+var $author$project$Main$viewResponses = function (model) {
 	return A2(
 		$elm$html$Html$table,
 		_List_Nil,
@@ -6778,7 +6679,7 @@ var $author$project$Main$viewResponses = function (tableRows) {
 				A2(
 					$elm$core$List$concatMap,
 					$author$project$Main$maybeToList,
-					$author$project$Main$viewTableRows(tableRows)))
+					$author$project$Main$viewTableRows(model)))
 			]));
 };
 var $author$project$Main$decodeError = F2(
@@ -6827,7 +6728,7 @@ var $author$project$Main$decodeError = F2(
 					_List_fromArray(
 						[
 							$elm$html$Html$text('Bad Request Body :(' + (' ' + string)),
-							$author$project$Main$viewResponses(model.tableRows)
+							$author$project$Main$viewResponses(model)
 						]));
 		}
 	});
@@ -6901,7 +6802,7 @@ var $author$project$Main$viewApp = function (model) {
 							[
 								$elm$html$Html$text('Ask!')
 							])),
-						$author$project$Main$viewResponses(model.tableRows)
+						$author$project$Main$viewResponses(model)
 					]));
 		case 'Failure':
 			var err = state.a;
@@ -6933,7 +6834,7 @@ var $author$project$Main$viewApp = function (model) {
 							[
 								$elm$html$Html$text('Ask!')
 							])),
-						$author$project$Main$viewResponses(model.tableRows)
+						$author$project$Main$viewResponses(model)
 					]));
 		case 'Loading':
 			return A2(
@@ -6941,7 +6842,7 @@ var $author$project$Main$viewApp = function (model) {
 				_List_Nil,
 				_List_fromArray(
 					[
-						$author$project$Main$viewResponses(model.tableRows)
+						$author$project$Main$viewResponses(model)
 					]));
 		default:
 			return A2(
@@ -6968,7 +6869,7 @@ var $author$project$Main$viewApp = function (model) {
 							[
 								$elm$html$Html$text('Ask!')
 							])),
-						$author$project$Main$viewResponses(model.tableRows)
+						$author$project$Main$viewResponses(model)
 					]));
 	}
 };
@@ -0,0 +1,71 @@
+import json
+
+
+def sse_event(event: str, data) -> str:
+    """Format a single server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class AnswerStreamParser:
+    """Incrementally pulls the <answer> body out of a streamed model reply.
+
+    Everything inside <thinking></thinking> (and anything else outside <answer>) is dropped as it
+    arrives; only a tail shorter than the longest tag is held back so tags split across chunks still match.
+    """
+    ANSWER_OPEN, ANSWER_CLOSE = "<answer>", "</answer>"
+    THINKING_OPEN, THINKING_CLOSE = "<thinking>", "</thinking>"
+
+    def __init__(self):
+        self._buffer = ""
+        self._state = "outside"  # outside | thinking | answer | done
+        self.emitted = False
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        out = []
+        while self._buffer and self._state != "done":
+            if self._state == "outside":
+                thinking = self._buffer.find(self.THINKING_OPEN)
+                answer = self._buffer.find(self.ANSWER_OPEN)
+                if answer != -1 and (thinking == -1 or answer < thinking):
+                    self._buffer = self._buffer[answer + len(self.ANSWER_OPEN):]
+                    self._state = "answer"
+                elif thinking != -1:
+                    self._buffer = self._buffer[thinking + len(self.THINKING_OPEN):]
+                    self._state = "thinking"
+                else:
+                    self._buffer = self._buffer[-(len(self.THINKING_OPEN) - 1):]
+                    break
+            elif self._state == "thinking":
+                end = self._buffer.find(self.THINKING_CLOSE)
+                if end == -1:
+                    self._buffer = self._buffer[-(len(self.THINKING_CLOSE) - 1):]
+                    break
+                self._buffer = self._buffer[end + len(self.THINKING_CLOSE):]
+                self._state = "outside"
+            else:
+                end = self._buffer.find(self.ANSWER_CLOSE)
+                if end == -1:
+                    safe = len(self._buffer) - (len(self.ANSWER_CLOSE) - 1)
+                    if safe > 0:
+                        out.append(self._buffer[:safe])
+                        self._buffer = self._buffer[safe:]
+                    break
+                out.append(self._buffer[:end])
+                self._buffer = ""
+                self._state = "done"
+        text = "".join(out)
+        if not self.emitted:
+            text = text.lstrip()
+        self.emitted = self.emitted or bool(text)
+        return text
+
+    def close(self) -> str:
+        """Flush whatever is left if the reply ended without a closing </answer>."""
+        if self._state != "answer":
+            return ""
+        text, self._buffer, self._state = self._buffer, "", "done"
+        if not self.emitted:
+            text = text.lstrip()
+        self.emitted = self.emitted or bool(text)
+        return text
@@ -0,0 +1,128 @@
+import sqlite3
+import threading
+
+from chromadb.api.models import Collection
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from settings import INDEX_DB_NAME, chroma_collection
+
+REBUILD_PAGE_SIZE = 1000
+
+
+class TextHashIndex:
+    """Local text_hash -> node_id index of one chroma collection.
+
+    Ingestion used to ask chroma `get(where={"text_hash": ...})` for every block and paragraph, a metadata
+    scan over HTTP each time. The mapping lives in a sqlite table instead and is held in memory once loaded,
+    so membership is a dict lookup and existing nodes come back in one `get(ids=...)`. Hashes not in memory
+    are looked up in sqlite before being treated as new, which picks up rows other processes wrote since.
+    """
+
+    def __init__(self, collection: Collection, db_name=INDEX_DB_NAME):
+        self.collection = collection
+        self.name = collection.name
+        self.db_name = db_name
+        self._ids: dict[str, str] | None = None
+        self._lock = threading.Lock()
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS text_hashes (
+                    collection TEXT,
+                    text_hash TEXT,
+                    node_id TEXT,
+                    PRIMARY KEY (collection, text_hash)
+                )
+            """)
+
+    def load(self) -> int:
+        """Bulk-load this collection's rows, rebuilding from chroma when there are none yet."""
+        with sqlite3.connect(self.db_name) as conn:
+            rows = conn.execute("SELECT text_hash, node_id FROM text_hashes WHERE collection = ?", (self.name,)).fetchall()
+        if not rows and self.collection.count():
+            return self.rebuild()
+        with self._lock:
+            self._ids = dict(rows)
+        return len(rows)
+
+    def _loaded(self) -> dict[str, str]:
+        if self._ids is None:
+            self.load()
+        return self._ids
+
+    def rebuild(self, page_size=REBUILD_PAGE_SIZE) -> int:
+        """Replace the index with one paged pass over the collection's metadata."""
+        ids = {}
+        for offset in range(0, self.collection.count(), page_size):
+            page = self.collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            for node_id, metadata in zip(page["ids"], page["metadatas"]):
+                if metadata and metadata.get("text_hash"):
+                    ids.setdefault(metadata["text_hash"], node_id)
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("DELETE FROM text_hashes WHERE collection = ?", (self.name,))
+            conn.executemany("INSERT INTO text_hashes (collection, text_hash, node_id) VALUES (?,?,?)",
+                             [(self.name, text_hash, node_id) for text_hash, node_id in ids.items()])
+        with self._lock:
+            self._ids = ids
+        return len(ids)
+
+    def node_ids(self, text_hashes) -> dict[str, str]:
+        known = self._loaded()
+        text_hashes = list(dict.fromkeys(text_hashes))
+        found = {text_hash: known[text_hash] for text_hash in text_hashes if text_hash in known}
+        if missing := [text_hash for text_hash in text_hashes if text_hash not in found]:
+            with sqlite3.connect(self.db_name) as conn:
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i + 500]
+                    found.update(conn.execute(
+                        f"SELECT text_hash, node_id FROM text_hashes WHERE collection = ? "
+                        f"AND text_hash IN ({','.join('?' * len(chunk))})", [self.name, *chunk]
+                    ).fetchall())
+            with self._lock:
+                self._ids.update({text_hash: found[text_hash] for text_hash in missing if text_hash in found})
+        return found
+
+    def __contains__(self, text_hash: str) -> bool:
+        return bool(self.node_ids([text_hash]))
+
+    def get_nodes(self, text_hashes) -> dict[str, BaseNode]:
+        """Existing nodes by text_hash, fetched in a single round trip; stale entries are dropped."""
+        node_ids = self.node_ids(text_hashes)
+        if not node_ids:
+            return {}
+        result = self.collection.get(ids=list(set(node_ids.values())))
+        nodes_by_id = {}
+        for node_id, metadata, document in zip(result["ids"], result["metadatas"], result["documents"]):
+            node = metadata_dict_to_node(metadata)
+            node.set_content(document)
+            nodes_by_id[node_id] = node
+        if stale := [text_hash for text_hash, node_id in node_ids.items() if node_id not in nodes_by_id]:
+            self.remove(stale)
+        return {text_hash: nodes_by_id[node_id] for text_hash, node_id in node_ids.items() if node_id in nodes_by_id}
+
+    def add(self, nodes: list[BaseNode]):
+        self.add_pairs([(node.metadata["text_hash"], node.node_id) for node in nodes if node.metadata.get("text_hash")])
+
+    def add_pairs(self, pairs: list[tuple[str, str]]):
+        if not pairs:
+            return
+        with sqlite3.connect(self.db_name) as conn:
+            conn.executemany("INSERT OR REPLACE INTO text_hashes (collection, text_hash, node_id) VALUES (?,?,?)",
+                             [(self.name, text_hash, node_id) for text_hash, node_id in pairs])
+        with self._lock:
+            if self._ids is not None:
+                self._ids.update(pairs)
+
+    def remove(self, text_hashes: list[str]):
+        with sqlite3.connect(self.db_name) as conn:
+            conn.executemany("DELETE FROM text_hashes WHERE collection = ? AND text_hash = ?",
+                             [(self.name, text_hash) for text_hash in text_hashes])
+        with self._lock:
+            for text_hash in text_hashes:
+                (self._ids or {}).pop(text_hash, None)
+
+
+text_hash_index = TextHashIndex(chroma_collection)
+
+if __name__ == "__main__":
+    print(f"{text_hash_index.rebuild()} text hashes indexed for {text_hash_index.name}")